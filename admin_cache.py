@@ -0,0 +1,53 @@
+"""
+ذاكرة مؤقتة لحالة إشراف البوت في كل محادثة مع مدة صلاحية
+تُحدَّث مباشرة من تحديثات my_chat_member/chat_member
+"""
+import threading
+import time
+
+ADMIN_STATUSES = ("administrator", "creator")
+
+
+class AdminCache:
+    """ chat_id ← (هل البوت مشرف، وقت انتهاء الصلاحية) """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id):
+        """ الحالة المحفوظة أو None إذا لم تكن موجودة أو انتهت صلاحيتها """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(str(chat_id))
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self.entries[str(chat_id)]
+            self.misses += 1
+            return None
+
+    def set(self, chat_id, is_admin):
+        with self.lock:
+            self.entries[str(chat_id)] = (is_admin, time.monotonic() + self.ttl)
+
+    def set_status(self, chat_id, status):
+        self.set(chat_id, status in ADMIN_STATUSES)
+
+    def invalidate(self, chat_id):
+        with self.lock:
+            self.entries.pop(str(chat_id), None)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
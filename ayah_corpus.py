@@ -0,0 +1,84 @@
+"""
+نص القرآن الكريم (الرسم العثماني من Tanzil) مضمّن مع البوت لاختيار الآيات محلياً
+النص كله ملف UTF-8 واحد مع مصفوفة مواضع، يُفتح بـ mmap عند أول استخدام فقط
+"""
+import hashlib
+import mmap
+import os
+import random
+import sys
+import threading
+from array import array
+
+import quran_index
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+TEXT_FILE = os.path.join(DATA_DIR, "quran-uthmani.bin")
+INDEX_FILE = os.path.join(DATA_DIR, "quran-uthmani.idx")
+
+TOTAL_AYAHS = quran_index.TOTAL_AYAHS
+
+_lock = threading.Lock()
+_text = None
+_offsets = None
+
+
+def _load():
+    """ فتح الملفين مرة واحدة؛ النص يبقى على القرص ويقرأ نظام التشغيل ما يلزم منه فقط """
+    global _text, _offsets
+    if _text is None:
+        with _lock:
+            if _text is None:
+                offsets = array("I")
+                with open(INDEX_FILE, "rb") as f:
+                    offsets.frombytes(f.read())
+                if sys.byteorder != "little":
+                    offsets.byteswap()
+                if len(offsets) != TOTAL_AYAHS + 1:
+                    raise ValueError(f"ملف المواضع تالف: {len(offsets)} موضعاً")
+                with open(TEXT_FILE, "rb") as f:
+                    text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                _offsets = offsets
+                _text = text
+    return _text, _offsets
+
+
+def ayah_text(index):
+    """ نص الآية من رقمها المطلق (0-6235) """
+    text, offsets = _load()
+    return text[offsets[index]:offsets[index + 1]].decode("utf-8")
+
+
+def format_ayah(index):
+    surah, number = quran_index.ayah_ref(index)
+    return f"{ayah_text(index)}\n(سورة {quran_index.surah_name(surah)} - الآية {number})"
+
+
+# ========== طرق اختيار الآية ==========
+def _digest(*parts):
+    """ رقم ثابت من النصوص المعطاة (لا يتغير بين العمليات بخلاف hash) """
+    key = "|".join(str(part) for part in parts).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big")
+
+
+def random_index():
+    return random.randrange(TOTAL_AYAHS)
+
+
+def slot_index(day, slot):
+    """ آية الوقت: نفس الآية لكل المجموعات في هذا اليوم وهذا الوقت """
+    return _digest("slot", day, slot) % TOTAL_AYAHS
+
+
+def khatma_index(chat_id, khatma_number, step):
+    """
+    آية بدون تكرار داخل ختمة المجموعة: تبديل خطي (a*step + b) mod 6236
+    يعطي آيات مختلفة لكل خطوة دون حفظ أي قائمة للآيات السابقة
+    """
+    seed = _digest("khatma", chat_id, khatma_number)
+    # 6236 = 4 * 1559 لذلك يجب أن يكون a فردياً وغير قابل للقسمة على 1559
+    a = (seed >> 16) % TOTAL_AYAHS | 1
+    if a % 1559 == 0:
+        a += 2
+    b = seed % TOTAL_AYAHS
+    return (a * step + b) % TOTAL_AYAHS
@@ -0,0 +1,185 @@
+"""
+خادم Bot API محلي بديل لاختبارات الحمل: يطبق الطرق التي يستخدمها البوت
+(sendMediaGroup, sendPhoto, sendMessage, getChatMember, getMe, getUpdates) مع حقن
+زمن استجابة وأخطاء 429 وأخطاء Forbidden لمحادثات محددة
+"""
+import hashlib
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Khatma Bot", "username": "khatma_bot"}
+
+
+class FakeBotApi:
+    """
+    latency: متوسط زمن الرد بالثواني (مع تفاوت عشوائي ±50%)
+    rate_limit_ratio: نسبة طلبات الإرسال التي ترجع 429 مع retry_after
+    forbidden_ratio: نسبة المحادثات التي طُرد منها البوت (ثابتة لكل chat_id)
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, rate_limit_ratio=0.0,
+                 retry_after=1, forbidden_ratio=0.0, seed=0):
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.forbidden_ratio = forbidden_ratio
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.messages = 0
+        self.message_id = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "messages": self.messages}
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls = {}
+            self.messages = 0
+
+    # ========== منطق الطرق ==========
+    def _count(self, method, outcome):
+        with self.lock:
+            key = f"{method}:{outcome}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def _is_forbidden(self, chat_id):
+        return zlib.crc32(str(chat_id).encode("utf-8")) % 10000 < self.forbidden_ratio * 10000
+
+    def _next_message(self, chat_id, **content):
+        with self.lock:
+            self.message_id += 1
+            self.messages += 1
+            message_id = self.message_id
+        return dict(
+            message_id=message_id, date=int(time.time()),
+            chat={"id": int(chat_id), "type": "supergroup", "title": "bench"},
+            **content
+        )
+
+    def _photo(self, media):
+        # نفس file_id لنفس الصورة كما يفعل تيليجرام، حتى تمتلئ ذاكرة file_id في البوت
+        if media.startswith("fake_"):
+            file_id = media
+        else:
+            file_id = "fake_" + hashlib.blake2b(media.encode("utf-8"), digest_size=8).hexdigest()
+        return [{"file_id": file_id, "file_unique_id": file_id[5:], "width": 1024, "height": 1600}]
+
+    def handle(self, method, params):
+        """ (رمز HTTP، جسم JSON) للطلب """
+        if self.latency:
+            time.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        chat_id = params.get("chat_id")
+        sending = method in ("sendMessage", "sendMediaGroup", "sendPhoto")
+        if sending and self._is_forbidden(chat_id):
+            self._count(method, 403)
+            return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was kicked from the supergroup chat"}
+        if sending and self.rate_limit_ratio and self.random.random() < self.rate_limit_ratio:
+            self._count(method, 429)
+            return 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            # استطلاع طويل بلا تحديثات (مع حد أعلى قصير حتى لا يعلق الإيقاف)
+            time.sleep(min(float(params.get("timeout") or 0), 1.0))
+            result = []
+        elif method == "getChatMember":
+            result = {"user": BOT_USER, "status": "administrator", "can_post_messages": True}
+        elif method == "sendMessage":
+            result = self._next_message(chat_id, text=params.get("text", ""))
+        elif method == "sendPhoto":
+            # الصورة المرفوعة كملف لها file_id جديد، والمرسلة بـ file_id تبقى كما هي
+            result = self._next_message(chat_id, photo=self._photo(params.get("photo") or f"upload_{self.message_id}"))
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            result = [
+                self._next_message(chat_id, photo=self._photo(item.get("media", "")), media_group_id="1")
+                for item in media
+            ]
+        elif method in ("setWebhook", "deleteWebhook", "answerCallbackQuery", "editMessageReplyMarkup",
+                        "editMessageText"):
+            result = True
+        else:
+            self._count(method, 404)
+            return 404, {"ok": False, "error_code": 404, "description": "Not Found: method not implemented"}
+        self._count(method, 200)
+        return 200, {"ok": True, "result": result}
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # ترويسات الرد وجسمه في كتابة واحدة، وإلا تأخر كل رد ~40ms بسبب Nagle و delayed ACK
+            wbufsize = -1
+            disable_nagle_algorithm = True
+
+            def _serve(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    if "json" in (self.headers.get("Content-Type") or ""):
+                        params.update(json.loads(body or b"{}"))
+                    elif b"Content-Disposition" not in body[:200]:
+                        params.update({k: v[-1] for k, v in parse_qs(body.decode("utf-8")).items()})
+                status, payload = api.handle(method, params)
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _serve
+            do_POST = _serve
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--forbidden-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+    api = FakeBotApi(port=args.port, latency=args.latency_ms / 1000,
+                     rate_limit_ratio=args.rate_limit_ratio, forbidden_ratio=args.forbidden_ratio)
+    print(f"Fake Bot API listening on {api.api_url.format('<token>', '<method>')}")
+    api.server.serve_forever()
@@ -0,0 +1,292 @@
+"""
+اختبار حمل لمسار الجدولة والإرسال مقابل خادم Bot API المحلي البديل (fake_bot_api.py)
+
+لكل عدد مجموعات تعمل عملية مستقلة: تُنشأ مجموعات وهمية موزعة على الأوقات الاثني عشر،
+ثم تُشغّل أوقات كاملة عبر build_slot_jobs و run_slot كما يفعل المجدول، وتُسجل:
+زمن تفريغ الوقت، الرسائل في الثانية، أقصى استهلاك للذاكرة (RSS)، وزمن الحفظ في القاعدة
+
+أمثلة:
+    python benchmarks/run_benchmark.py --groups 1000 10000 100000 --output results/base.json
+    python benchmarks/run_benchmark.py --groups 1000 10000 100000 --compare results/base.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+# المقاييس التي تكون القيمة الأعلى فيها أفضل؛ الباقي كلما قل كان أفضل
+HIGHER_IS_BETTER = ("messages_per_second", "jobs_per_second")
+# القيم الأصغر من هذا (ثوانٍ أو ms) ضجيج قياس ولا تُعد تراجعاً
+NOISE_FLOOR = 0.01
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # لينكس يرجع كيلوبايت و macOS يرجع بايت
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+def import_bot(api, args):
+    """ تحميل bot.py في مجلد مؤقت وتوجيه طلباته إلى الخادم البديل """
+    os.environ.update({
+        "BOT_TOKEN": "1000:benchmark",
+        "ADMIN_ID": "1",
+        "DISPATCH_WORKERS": str(args.workers),
+        "GLOBAL_RATE_PER_SECOND": str(args.rate),
+        "CHAT_RATE_PER_MINUTE": "20",
+        "HTTP_POOL_SIZE": str(max(args.workers, 10)),
+    })
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ.pop("SHARD_COUNT", None)
+    if args.spread_pack:
+        os.environ.update({"PAGE_DELIVERY": "spread", "SPREAD_PACK_FILE": os.path.abspath(args.spread_pack)})
+    os.chdir(tempfile.mkdtemp(prefix="khatma-bench-"))
+    sys.path.insert(0, ROOT)
+    from telebot import apihelper
+    apihelper.API_URL = api.api_url
+    import bot
+    return bot
+
+
+def seed_groups(bot, count):
+    """ مجموعات وهمية: كل مجموعة لها وقت صور ووقت ختمة، موزعة بالتساوي على الأوقات """
+    from group_state import GroupRecord
+    for i in range(count):
+        chat_id = str(-1000000000000 - i)
+        bot.groups_data[chat_id] = GroupRecord(
+            current_page=1 + 2 * (i % 302),
+            image_mask=1 << (i % 12),
+            images_active=True,
+            current_part=1 + i % 30,
+            khatma_mask=1 << ((i * 5 + 3) % 12),
+            khatma_active=True,
+        )
+        bot.refresh_schedule(chat_id)
+
+
+def persisted_seconds(bot):
+    state = bot.persist_seconds.values.get(("save",))
+    return state[1] if state else 0.0
+
+
+def run_single(args, groups):
+    sys.path.insert(0, BENCH_DIR)
+    from fake_bot_api import FakeBotApi
+
+    api = FakeBotApi(
+        latency=args.latency_ms / 1000,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+        forbidden_ratio=args.forbidden_ratio,
+        seed=args.seed,
+    ).start()
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        bot = import_bot(api, args)
+        from group_state import AVAILABLE_TIMES
+
+        started = time.perf_counter()
+        seed_groups(bot, groups)
+        seed_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        bot.save_data()
+        initial_persist_seconds = time.perf_counter() - started
+
+        # فحص صلاحيات الإشراف: أول مرة من getChatMember ثم من الذاكرة
+        sample = list(bot.groups_data)[:args.admin_checks]
+        started = time.perf_counter()
+        for chat_id in sample:
+            bot.check_admin(chat_id)
+        admin_cold = (time.perf_counter() - started) / max(len(sample), 1)
+        started = time.perf_counter()
+        for chat_id in sample:
+            bot.check_admin(chat_id)
+        admin_warm = (time.perf_counter() - started) / max(len(sample), 1)
+
+        slots = []
+        today = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        for slot in AVAILABLE_TIMES[:args.slots]:
+            hour, minute = map(int, slot.split(":"))
+            boundary = today.replace(hour=hour, minute=minute)
+            api.reset_stats()
+            persist_before = persisted_seconds(bot)
+
+            started = time.perf_counter()
+            jobs = bot.build_slot_jobs(boundary)
+            prepare_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            stats = bot.run_slot(boundary, jobs) or {"drain_seconds": 0.0, "sent": 0, "failed": 0, "rate_limited": 0}
+            total_seconds = time.perf_counter() - started
+            api_stats = api.stats()
+            slots.append({
+                "slot": slot,
+                "jobs": len(jobs),
+                "sent": stats["sent"],
+                "failed": stats["failed"],
+                "rate_limited": stats["rate_limited"],
+                "messages": api_stats["messages"],
+                "prepare_seconds": prepare_seconds,
+                "drain_seconds": stats["drain_seconds"],
+                "persist_seconds": persisted_seconds(bot) - persist_before,
+                "total_seconds": total_seconds,
+                "api_calls": api_stats["calls"],
+            })
+
+    api.stop()
+    drain = sum(s["drain_seconds"] for s in slots)
+    messages = sum(s["messages"] for s in slots)
+    jobs = sum(s["jobs"] for s in slots)
+    return {
+        "groups": groups,
+        "metrics": {
+            "seed_seconds": seed_seconds,
+            "initial_persist_seconds": initial_persist_seconds,
+            "admin_check_cold_ms": admin_cold * 1000,
+            "admin_check_warm_ms": admin_warm * 1000,
+            "prepare_seconds": sum(s["prepare_seconds"] for s in slots),
+            "drain_seconds": drain,
+            "persist_seconds": sum(s["persist_seconds"] for s in slots),
+            "messages_per_second": messages / drain if drain else 0.0,
+            "jobs_per_second": jobs / drain if drain else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "db_size_mb": sum(
+                os.path.getsize(path) for path in (bot.DB_FILE, bot.DB_FILE + "-wal") if os.path.exists(path)
+            ) / (1024 * 1024),
+        },
+        "slots": slots,
+    }
+
+
+def run_all(args):
+    """ كل عدد مجموعات في عملية جديدة حتى لا تتأثر الذاكرة والحالة بالتشغيل السابق """
+    runs = []
+    for groups in args.groups:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            result_file = f.name
+        command = [sys.executable, os.path.abspath(__file__), "--single", result_file, "--groups", str(groups)]
+        for name in ("slots", "workers", "rate", "latency_ms", "rate_limit_ratio", "retry_after",
+                     "forbidden_ratio", "admin_checks", "seed"):
+            command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        if args.spread_pack:
+            command += ["--spread-pack", os.path.abspath(args.spread_pack)]
+        if args.verbose:
+            command.append("--verbose")
+        print(f"Running {groups} groups...", file=sys.stderr)
+        subprocess.check_call(command)
+        with open(result_file, encoding="utf-8") as f:
+            runs.append(json.load(f))
+        os.unlink(result_file)
+    return {
+        "revision": git_revision(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            name: getattr(args, name)
+            for name in ("slots", "workers", "rate", "latency_ms", "rate_limit_ratio",
+                         "retry_after", "forbidden_ratio", "seed", "spread_pack")
+        },
+        "runs": runs,
+    }
+
+
+def print_report(report):
+    print(f"revision {report['revision']}  params {json.dumps(report['params'])}")
+    header = ("groups", "drain_s", "msg/s", "prepare_s", "persist_s", "rss_mb", "admin_ms")
+    print("".join(f"{name:>12}" for name in header))
+    for run in report["runs"]:
+        m = run["metrics"]
+        print(
+            f"{run['groups']:>12}{m['drain_seconds']:>12.2f}{m['messages_per_second']:>12.1f}"
+            f"{m['prepare_seconds']:>12.3f}{m['persist_seconds']:>12.3f}{m['peak_rss_mb']:>12.1f}"
+            f"{m['admin_check_cold_ms']:>12.2f}"
+        )
+
+
+def compare(baseline, report, threshold):
+    """ طباعة الفرق لكل مقياس؛ يرجع عدد المقاييس التي ساءت بأكثر من threshold """
+    if baseline.get("params") != report["params"]:
+        print("⚠️ parameters differ from the baseline, results may not be comparable")
+    old_runs = {run["groups"]: run for run in baseline.get("runs", [])}
+    regressions = 0
+    print(f"\ncompared with {baseline.get('revision')} (threshold {threshold:.0%})")
+    for run in report["runs"]:
+        old = old_runs.get(run["groups"])
+        if old is None:
+            continue
+        print(f"-- {run['groups']} groups")
+        for name, value in run["metrics"].items():
+            previous = old["metrics"].get(name)
+            if not previous:
+                continue
+            change = (value - previous) / previous
+            worse = -change if name in HIGHER_IS_BETTER else change
+            noisy = max(value, previous) < NOISE_FLOOR
+            flag = "  REGRESSION" if worse > threshold and not noisy else ""
+            regressions += bool(flag)
+            print(f"   {name:<26}{previous:>12.3f} -> {value:>12.3f}  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler and delivery load test against a fake Bot API")
+    parser.add_argument("--groups", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--slots", type=int, default=1, help="how many of the 12 slots to drain")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=100000, help="global sends per second (the real limit is 30)")
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.001)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--forbidden-ratio", type=float, default=0.001)
+    parser.add_argument("--admin-checks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spread-pack", help="send one composed photo per group from this pack (spread_pack.py)")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from a previous --output")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own output")
+    parser.add_argument("--single", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        result = run_single(args, args.groups[0])
+        with open(args.single, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    report = run_all(args)
+    print_report(report)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
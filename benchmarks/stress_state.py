@@ -0,0 +1,253 @@
+"""
+اختبار ضغط لطبقة حالة المجموعات: خيوط كثيرة تقلب أوقات نفس المجموعات في نفس اللحظة
+كل وقت يُقلب عدداً معروفاً من المرات، فيجب أن يساوي القناع النهائي زوجية عدد القلبات؛
+أي تعديل ضائع يظهر كفرق في القناع
+
+المراحل:
+    table      - GroupTable.locked مباشرة (مع حذف وإعادة إنشاء متزامن لمحادثات أخرى)
+    collective - ضغطات متزامنة على أجزاء الختمة الجماعية كما بعد إرسال التذكير: كل جزء يُحجز مرة
+                 ويُتم مرة واحدة بالضبط، وتكتمل كل ختمة مرة واحدة
+    handlers   - معالج handle_time_selection الحقيقي عبر خادم Bot API البديل مع حفظ في القاعدة،
+                 وذاكرة سجلات أصغر من عدد المجموعات حتى تُخرج السجلات وتُعاد قراءتها أثناء الاختبار،
+                 ثم معالج handle_collective_press بنفس الطريقة
+
+مثال:
+    python benchmarks/stress_state.py --threads 64 --toggles 2000
+"""
+import argparse
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from collective_khatma import (  # noqa: E402
+    ALL_JUZ, CLAIMED, COMPLETED, FINISHED, JUZ_COUNT, CollectiveKhatmas, KhatmaState,
+)
+from group_state import AVAILABLE_TIMES, SLOT_BITS, GroupTable  # noqa: E402
+
+
+def run_threads(threads, target):
+    """ تشغيل target(i) في خيوط تبدأ معاً؛ يرجع الزمن المستغرق """
+    barrier = threading.Barrier(threads)
+
+    def worker(i):
+        barrier.wait()
+        target(i)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return time.perf_counter() - started
+
+
+def expected_masks(counts):
+    """ (chat_id, النوع) ← القناع المتوقع من عدد قلبات كل وقت """
+    masks = {}
+    for (chat_id, kind, time_str), count in counts.items():
+        masks.setdefault((chat_id, kind), 0)
+        if count % 2:
+            masks[(chat_id, kind)] |= SLOT_BITS[time_str]
+    return masks
+
+
+def check(table, counts):
+    errors = 0
+    for (chat_id, kind), mask in expected_masks(counts).items():
+        actual = table.get(chat_id).mask(kind)
+        if actual != mask:
+            errors += 1
+            print(f"   lost update in {chat_id} {kind}: expected {mask:012b}, got {actual:012b}")
+    return errors
+
+
+def stress_table(args):
+    table = GroupTable()
+    chats = [str(-100 - i) for i in range(args.chats)]
+    counts = Counter()
+    counts_lock = threading.Lock()
+
+    def hammer(i):
+        rng = random.Random(i)
+        local = Counter()
+        for n in range(args.toggles):
+            chat_id = rng.choice(chats)
+            kind = rng.choice(("image", "khatma"))
+            time_str = rng.choice(AVAILABLE_TIMES)
+            with table.locked(chat_id) as data:
+                data.toggle_time(kind, time_str)
+                data.current_page += 1
+            local[(chat_id, kind, time_str)] += 1
+            # محادثات أخرى تُحذف وتُنشأ في نفس الوقت كما يفعل خطأ Forbidden
+            if n % 50 == 0:
+                table.remove(f"churn-{i}")
+                with table.locked(f"churn-{i}"):
+                    pass
+        with counts_lock:
+            counts.update(local)
+
+    elapsed = run_threads(args.threads, hammer)
+    total = args.threads * args.toggles
+    errors = check(table, counts)
+    pages = sum(table.get(chat_id).current_page - 1 for chat_id in chats)
+    if pages != total:
+        errors += 1
+        print(f"   lost page increments: expected {total}, got {pages}")
+    print(f"table:    {total} toggles in {elapsed:.2f}s ({total / elapsed:,.0f}/s), {errors} errors")
+    return errors
+
+
+def stress_collective(args):
+    khatmas = CollectiveKhatmas({})
+    chats = [str(-100 - i) for i in range(args.chats)]
+    for chat_id in chats:
+        khatmas.start(chat_id)
+    results = Counter()
+    results_lock = threading.Lock()
+
+    def hammer(i):
+        rng = random.Random(i)
+        local = Counter()
+        for _ in range(args.presses):
+            chat_id = rng.choice(chats)
+            juz = rng.randint(1, JUZ_COUNT)
+            result = khatmas.press(chat_id, 1, juz, user_id=i)
+            local[(chat_id, juz, result)] += 1
+        with results_lock:
+            results.update(local)
+
+    elapsed = run_threads(args.threads, hammer)
+    total = args.threads * args.presses
+    errors = 0
+    for chat_id in chats:
+        state = khatmas.get(chat_id)
+        for juz in range(1, JUZ_COUNT + 1):
+            bit = 1 << (juz - 1)
+            claims = results[(chat_id, juz, CLAIMED)]
+            completions = results[(chat_id, juz, COMPLETED)] + results[(chat_id, juz, FINISHED)]
+            if claims != bool(state.claimed & bit) or completions != bool(state.completed & bit):
+                errors += 1
+                print(f"   juz {juz} of {chat_id}: {claims} claims, {completions} completions")
+        finishes = sum(results[(chat_id, juz, FINISHED)] for juz in range(1, JUZ_COUNT + 1))
+        if finishes != (state.completed == ALL_JUZ):
+            errors += 1
+            print(f"   khatma of {chat_id} finished {finishes} times")
+    print(f"collective: {total} presses in {elapsed:.2f}s ({total / elapsed:,.0f}/s), {errors} errors")
+    return errors
+
+
+def stress_handlers(args):
+    from fake_bot_api import FakeBotApi
+    from telebot import apihelper, types
+
+    api = FakeBotApi().start()
+    os.environ.update({"BOT_TOKEN": "1000:stress", "ADMIN_ID": "1", "GROUP_CACHE_SIZE": str(args.cache_size)})
+    os.environ.pop("SHARD_COUNT", None)
+    os.chdir(tempfile.mkdtemp(prefix="khatma-stress-"))
+    apihelper.API_URL = api.api_url
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        import bot
+
+    chats = [str(-100 - i) for i in range(args.chats)]
+    for chat_id in chats:
+        bot.admin_cache.set_status(chat_id, "administrator")
+        bot.get_group(chat_id)
+    bot.save_data()
+    counts = Counter()
+    counts_lock = threading.Lock()
+
+    def callback(chat_id, data, n):
+        return types.CallbackQuery.de_json({
+            "id": str(n), "chat_instance": "1", "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "admin"},
+            "message": {"message_id": 1, "date": 0, "chat": {"id": int(chat_id), "type": "supergroup"}},
+        })
+
+    def hammer(i):
+        rng = random.Random(i)
+        local = Counter()
+        for n in range(args.handler_toggles):
+            chat_id = rng.choice(chats)
+            kind = rng.choice(("image", "khatma"))
+            time_str = rng.choice(AVAILABLE_TIMES)
+            bot.handle_time_selection(callback(chat_id, f"{kind}_time_{time_str}", n))
+            local[(chat_id, kind, time_str)] += 1
+        with counts_lock:
+            counts.update(local)
+
+    elapsed = run_threads(args.threads, hammer)
+    # الحفظ وتعديل اللوحات مؤجلان حتى تهدأ الضغطات
+    bot.time_keyboards.flush_all()
+    total = args.threads * args.handler_toggles
+    errors = check(bot.groups_data, counts)
+    # ما حُفظ في القاعدة يجب أن يطابق الذاكرة أيضاً
+    stored = dict(bot.store.iter_groups())
+    for chat_id in chats:
+        if stored[chat_id].to_dict() != bot.groups_data.get(chat_id).to_dict():
+            errors += 1
+            print(f"   stored state of {chat_id} differs from memory")
+    evictions = bot.groups_data.stats()["evictions"]
+    edits = bot.time_keyboards.stats()
+    print(f"handlers: {total} toggles in {elapsed:.2f}s ({total / elapsed:,.0f}/s), {evictions} evictions, "
+          f"{edits['flushes']} edits ({edits['coalesced']} coalesced), {errors} errors")
+
+    # ضغطات الأعضاء على لوحة الختمة الجماعية: كل خيط عضو مختلف
+    for chat_id in chats:
+        bot.khatma_data.start(chat_id)
+    bot.save_khatma_data()
+
+    def press(i):
+        rng = random.Random(i)
+        for n in range(args.handler_toggles):
+            chat_id = rng.choice(chats)
+            query = callback(chat_id, f"ck_1_{rng.randint(1, JUZ_COUNT)}", n)
+            query.from_user.id = 1000 + i
+            bot.handle_collective_press(query)
+
+    elapsed = run_threads(args.threads, press)
+    bot.collective_keyboards.flush_all()
+    api.stop()
+    total = args.threads * args.handler_toggles
+    stored = bot.store.load_khatma()
+    for chat_id in chats:
+        state = bot.khatma_data.get(chat_id)
+        if state.completed & ~state.claimed or KhatmaState.from_dict(stored[chat_id]).to_dict() != state.to_dict():
+            errors += 1
+            print(f"   stored collective khatma of {chat_id} differs from memory")
+    edits = bot.collective_keyboards.stats()
+    print(f"presses:  {total} presses in {elapsed:.2f}s ({total / elapsed:,.0f}/s), "
+          f"{edits['flushes']} edits ({edits['coalesced']} coalesced), {errors} errors")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent toggle stress test for the group state layer")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--chats", type=int, default=4, help="few chats so threads collide")
+    parser.add_argument("--toggles", type=int, default=5000, help="toggles per thread on the table")
+    parser.add_argument("--handler-toggles", type=int, default=100, help="toggles per thread through the handler")
+    parser.add_argument("--presses", type=int, default=2000, help="collective khatma presses per thread")
+    parser.add_argument("--cache-size", type=int, default=2, help="group records kept in memory by the bot")
+    parser.add_argument("--skip-handlers", action="store_true")
+    args = parser.parse_args()
+
+    errors = stress_table(args)
+    errors += stress_collective(args)
+    if not args.skip_handlers:
+        errors += stress_handlers(args)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,112 +1,350 @@
+import atexit
+import signal
 import threading
 import telebot
-from telebot import types
+from telebot import types, util, apihelper
 import time
 import os
-import json
-from datetime import datetime
+import functools
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
-import requests
+import quran_index
+import ayah_corpus
+import metrics
+from file_id_cache import FileIdCache, is_invalid_file_id_error, largest_photo_id
+from spread_pack import PACK_FILE, SpreadPack, spread_index
+from slot_index import SlotIndex, host_zone_name
+from dispatcher import Dispatcher, retry_after_seconds
+from outbox import Delivery, DeliveryBatch
+from storage import GroupStore
+from admin_cache import AdminCache
+from http_client import HttpClient
+from broadcast import Broadcaster, FILTERS, message_content, send_content
+from conversations import ConversationStore
+from debounce import Debouncer
+from collective_khatma import CollectiveKhatmas, CHANGED, CLAIMED, COMPLETED, FINISHED, TAKEN, ALREADY_DONE
+from sharding import shard_of, spawn_workers, stop_workers, follow_changes
+from supervisor import Lease, Supervisor
+from group_state import GroupRecord, GroupTable, mask_to_times, time_display, time_keyboard
 
 # تحميل بيانات التوكن من ملف .env
 load_dotenv()
-bot = telebot.TeleBot(os.getenv("BOT_TOKEN"))
 ADMIN_ID = os.getenv("ADMIN_ID")
 
+# طبقة HTTP مشتركة لكل الطلبات الصادرة (ومنها طلبات Bot API)؛
+# قاطع الدائرة للمضيفين الخارجيين فقط، وأخطاء Bot API يعالجها الموزع وإعادة الاستطلاع
+http = HttpClient(
+    pool_size=int(os.getenv("HTTP_POOL_SIZE", "32")),
+    max_retries=int(os.getenv("HTTP_MAX_RETRIES", "3")),
+    breaker_exempt=(urlsplit(apihelper.API_URL or "https://api.telegram.org").hostname,)
+)
+api_requests = metrics.Counter("bot_api_requests_total", "Bot API calls by method and HTTP status", ("method", "code"))
+api_seconds = metrics.Histogram("bot_api_request_seconds", "Bot API call latency", ("method",))
+
+def send_api_request(method, url, **kwargs):
+    """ كل طلبات Bot API تمر من هنا لتسجيل عددها وزمنها حسب الطريقة ورمز الرد """
+    # الرابط يحتوي التوكن، فلا يُسجل منه إلا اسم الطريقة
+    api_method = "file" if "/file/bot" in url else url.rsplit("/", 1)[-1]
+    code = "network_error"
+    started = time.perf_counter()
+    try:
+        response = http.request(method, url, **kwargs)
+        code = str(response.status_code)
+        return response
+    finally:
+        api_seconds.observe(time.perf_counter() - started, api_method)
+        api_requests.inc(api_method, code)
+
+apihelper.CUSTOM_REQUEST_SENDER = send_api_request
+# عدد خيوط معالجة التحديثات؛ حالة المجموعات محمية بأقفال لكل محادثة فيمكن زيادته بأمان
+bot = telebot.TeleBot(os.getenv("BOT_TOKEN"), num_threads=int(os.getenv("HANDLER_THREADS", "16")))
+# بدون chat_member (كل دخول وخروج للأعضاء في كل مجموعة)؛ تغييرات عضوية البوت نفسه تصل في my_chat_member
+ALLOWED_UPDATES = [update_type for update_type in util.update_types if update_type != "chat_member"]
+
 # ملفات تخزين البيانات
+DB_FILE = "khatma_bot.db"
+FILE_ID_CACHE_FILE = "file_ids.json"
+SPREAD_FILE_ID_CACHE_FILE = "spread_file_ids.json"
+# ملفات JSON القديمة تُستورد مرة واحدة إلى قاعدة البيانات
 DATA_FILE = "groups_data.json"
 KHATMA_FILE = "khatma_data.json"
 
-# الأوقات المتاحة للاختيار
-AVAILABLE_TIMES = [
-    "01:00", "03:00", "05:00", 
-    "07:00", "09:00", "11:00", 
-    "13:00", "15:00", "17:00", 
-    "19:00", "21:00", "23:00"
-]
+# إعدادات موزع الإرسال (عدد العمال وحدود تيليجرام العامة ولكل مجموعة)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+GLOBAL_RATE_PER_SECOND = float(os.getenv("GLOBAL_RATE_PER_SECOND", "30"))
+CHAT_RATE_PER_MINUTE = float(os.getenv("CHAT_RATE_PER_MINUTE", "20"))
+
+# أقصى عدد لسجلات المجموعات المحملة في الذاكرة؛ الباقي يُقرأ من القاعدة عند الحاجة
+GROUP_CACHE_SIZE = int(os.getenv("GROUP_CACHE_SIZE", "10000"))
+
+# مدة انتظار رد المشرف على أوامر مثل /set_start_page (بالثواني) وأقصى عدد للردود المنتظرة
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "600"))
+CONVERSATION_LIMIT = int(os.getenv("CONVERSATION_LIMIT", "10000"))
+
+# مدة صلاحية حالة إشراف البوت المحفوظة لكل مجموعة (بالثواني)
+ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "600"))
+
+# طريقة اختيار آية التذكير: random أو slot أو khatma
+AYAH_SELECTION = os.getenv("AYAH_SELECTION", "random")
+
+# وضع الـ webhook: يُفعّل عند تحديد WEBHOOK_URL و WEBHOOK_SECRET، وإلا يُستخدم الاستطلاع
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEB_PORT = int(os.getenv("PORT", "8080"))
+
+# عدد الدقائق قبل كل وقت لتجهيز الرسائل مسبقاً
+PREFETCH_MINUTES = float(os.getenv("PREFETCH_MINUTES", "3"))
+
+# التشغيل المقسم: عند SHARD_COUNT > 1 تصبح هذه العملية عملية استقبال وتشغّل عمال الإرسال
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "0"))
+BOT_ROLE = os.getenv("BOT_ROLE") or ("ingress" if SHARD_COUNT > 1 else "all")
+SPAWN_WORKERS = os.getenv("SPAWN_WORKERS", "1") == "1"
+
+# ثوانٍ تبقى فيها قيادة العملية النشطة دون تجديد قبل أن تستلمها عملية احتياطية تتشارك نفس القاعدة (0 يعطلها)
+LEASE_TTL = float(os.getenv("LEASE_TTL", "10"))
+# أقصى ثوانٍ لانتظار انتهاء الإرسال الجاري عند الإيقاف أو فقد القيادة
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "120"))
+
+# عدد الإرسالات المؤكدة التي تُكتب مع تقدم محادثاتها في معاملة واحدة أثناء الوقت
+OUTBOX_COMMIT_EVERY = int(os.getenv("OUTBOX_COMMIT_EVERY", "200"))
+
+# أقصى عمر بالدقائق للإرسال الفائت (بعد توقف البوت أو تأخر المجدول) الذي يُرسل متأخراً؛ 0 يعطل التعويض
+CATCHUP_MAX_AGE_MINUTES = float(os.getenv("CATCHUP_MAX_AGE_MINUTES", "180"))
+
+# المنطقة الزمنية للمجموعات التي لم تحدد منطقتها بالأمر /set_timezone؛ افتراضياً منطقة الجهاز
+# كما كانت تُجدول قبل دعم المناطق، حتى لا تتغير ساعة إرسالها بعد التحديث
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE") or host_zone_name()
+
+# اختياري: منفذ لتطبيق Flask في وضع الاستطلاع لقراءة /metrics (في وضع الـ webhook يُقرأ من نفس المنفذ)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# عنوان تطبيق /metrics في وضع الاستطلاع والعمال؛ محلي فقط افتراضياً (0.0.0.0 للقراءة من جهاز آخر مع METRICS_TOKEN)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# طريقة إرسال الصفحتين: pages (صورتان في مجموعة وسائط) أو spread (صورة واحدة مركبة مسبقاً
+# بـ spread_pack.py، تُحسب رسالة واحدة بدل رسالتين وحجمها أصغر)
+PAGE_DELIVERY = os.getenv("PAGE_DELIVERY", "pages")
+SPREAD_PACK_FILE = os.getenv("SPREAD_PACK_FILE", PACK_FILE)
+
+# ثوانٍ تُجمع فيها الضغطات المتتالية على أزرار نفس الرسالة قبل تعديل لوحتها وحفظ التغيير مرة واحدة
+KEYBOARD_EDIT_DELAY = float(os.getenv("KEYBOARD_EDIT_DELAY", "1.5"))
+
+# قناة خاصة تُرفع إليها صفحات المصحف مرة واحدة لتعبئة ذاكرة file_id
+CACHE_CHANNEL_ID = os.getenv("CACHE_CHANNEL_ID")
+
+# ========== مقاييس الأداء ==========
+persist_seconds = metrics.Histogram("persistence_seconds", "Time spent loading and saving state", ("operation",))
+handler_seconds = metrics.Histogram("handler_seconds", "Update handler latency", ("handler",))
+delivery_seconds = metrics.Histogram("delivery_seconds", "Time to send one scheduled delivery", ("kind",))
+admin_check_seconds = metrics.Histogram("check_admin_seconds", "Admin check latency (cached or get_chat_member)")
+scheduler_lag = metrics.Histogram("scheduler_lag_seconds", "Delay between a slot boundary and the start of its sends")
+slot_prepare_seconds = metrics.Histogram("slot_prepare_seconds", "Time to prepare the jobs of one slot")
+slot_drain_seconds = metrics.Histogram("slot_drain_seconds", "Time to drain the jobs of one slot")
+slot_deliveries = metrics.Counter("slot_deliveries_total", "Scheduled deliveries by result", ("result",))
+keyboard_edits = metrics.Counter("keyboard_edits_total", "Inline keyboard edits after button presses by result", ("result",))
+outbox_commits = metrics.Counter("outbox_commits_total", "Batched commits of acknowledged deliveries with their progress")
+catchup_deliveries = metrics.Counter("catchup_deliveries_total", "Missed deliveries queued for catch-up")
 
 # تحميل البيانات
+store = GroupStore(DB_FILE, track_changes=(BOT_ROLE == "ingress"))
+
+def is_my_chat(chat_id):
+    """ هل هذه المحادثة ضمن الجزء الذي تملكه هذه العملية """
+    return BOT_ROLE != "worker" or shard_of(chat_id, SHARD_COUNT) == SHARD_INDEX
+
 def load_data():
+    """ استيراد ملفات JSON القديمة مرة واحدة؛ السجلات نفسها تُحمّل عند أول طلب لكل محادثة """
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, "r", encoding='utf-8') as f:
-                data = json.load(f)
-                # تحويل البيانات القديمة إلى التنسيق الجديد
-                for chat_id, group_data in data.items():
-                    if "image_time" in group_data:
-                        group_data["image_times"] = [group_data.pop("image_time")] if group_data["image_time"] else []
-                    if "khatma_time" in group_data:
-                        group_data["khatma_times"] = [group_data.pop("khatma_time")] if group_data["khatma_time"] else []
-                return data
-        return {}
+        if BOT_ROLE != "worker":
+            store.import_json_once(DATA_FILE, KHATMA_FILE)
     except Exception as e:
         print(f"Error loading data: {e}")
-        return {}
 
 def load_khatma_data():
     try:
-        if os.path.exists(KHATMA_FILE):
-            with open(KHATMA_FILE, "r", encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        with persist_seconds.time("load_khatma"):
+            return store.load_khatma()
     except Exception as e:
         print(f"Error loading khatma data: {e}")
         return {}
 
-def save_data():
+def save_data(chat_ids=None):
+    """ حفظ الحقول المتغيرة للمحادثات المحددة (أو للجميع) في معاملة واحدة """
     try:
-        with open(DATA_FILE, "w", encoding='utf-8') as f:
-            json.dump(groups_data, f, ensure_ascii=False, indent=4)
+        with persist_seconds.time("save"):
+            store.save_groups(groups_data, chat_ids)
+        groups_data.trim()
     except Exception as e:
         print(f"Error saving data: {e}")
 
-def save_khatma_data():
+def save_group(chat_id):
+    save_data([chat_id])
+
+def get_group(chat_id):
+    """ سجل المجموعة للقراءة، ويُنشأ بالقيم الافتراضية إذا لم يكن موجوداً (للتعديل استخدم groups_data.locked) """
+    with groups_data.locked(chat_id) as data:
+        return data
+
+def save_khatma_data(chat_ids=None):
+    """ حفظ الختمات الجماعية المتغيرة للمحادثات المحددة (أو للجميع) """
     try:
-        with open(KHATMA_FILE, "w", encoding='utf-8') as f:
-            json.dump(khatma_data, f, ensure_ascii=False, indent=4)
+        with persist_seconds.time("save_khatma"):
+            store.save_khatma(khatma_data.snapshot(chat_ids), chat_ids)
     except Exception as e:
         print(f"Error saving khatma data: {e}")
 
-groups_data = load_data()
-khatma_data = load_khatma_data()
+# آخر تغيير رآه العامل قبل التحميل، ليتابع ما بعده فقط
+config_seq = store.last_change_seq()
+load_data()
+groups_data = GroupTable(store, GROUP_CACHE_SIZE)
+khatma_data = CollectiveKhatmas(load_khatma_data())
+conversations = ConversationStore(store, CONVERSATION_TTL, CONVERSATION_LIMIT)
+page_file_ids = FileIdCache(FILE_ID_CACHE_FILE)
 
-# ========== نظام الصور القرآنية ==========
-def get_page_info(page):
-    """ الحصول على معلومات الصفحة من API مع حساب الجزء """
+spreads = None
+spread_file_ids = FileIdCache(SPREAD_FILE_ID_CACHE_FILE)
+if PAGE_DELIVERY == "spread":
     try:
-        response = requests.get(f"https://api.alquran.cloud/v1/page/{page}/quran-uthmani", timeout=10)
-        if response.status_code == 200:
-            data = response.json()
-            surah_name = data["data"]["ayahs"][0]["surah"]["name"]
-            juz_number = ((page - 1) // 20) + 1
-            return {"surah": surah_name, "juz": juz_number}
-        return {"surah": "غير معروف", "juz": "غير معروف"}
+        spreads = SpreadPack(SPREAD_PACK_FILE).check()
     except Exception as e:
-        print(f"Error fetching page info: {e}")
-        return {"surah": "غير معروف", "juz": "غير معروف"}
+        print(f"Spread pack unavailable, sending pages as two photos: {e}")
+
+metrics.Gauge("groups_loaded", "Groups held in memory by this process", func=lambda: len(groups_data))
+metrics.Counter("group_cache_evictions_total", "Group records evicted from memory since start", func=lambda: groups_data.evictions)
+metrics.Gauge("pending_conversations", "Admin replies the bot is waiting for", func=lambda: len(conversations))
+metrics.Gauge("page_file_id_cache_entries", "Pages with a cached Telegram file_id", func=lambda: len(page_file_ids))
+
+def reload_group(chat_id):
+    """ تحديث سجل المحادثة من القاعدة بعد أن غيرته عملية أخرى """
+    # القراءة من القاعدة خارج قفل المحادثة (ترتيب الأقفال: المخزن ثم المحادثة)
+    record = store.load_group(chat_id, groups_data.cached(chat_id))
+    with groups_data.lock(chat_id):
+        current = groups_data.cached(chat_id)
+        if record is None:
+            groups_data.discard(chat_id)
+        elif current is None:
+            groups_data[chat_id] = record
+        else:
+            # نسخ القيم داخل نفس الكائن حتى تبقى المراجع الموجودة عليه صحيحة
+            for name in GroupRecord.__slots__:
+                setattr(current, name, getattr(record, name))
+        refresh_schedule(chat_id)
+
+# ========== فهرس أوقات الإرسال ==========
+slot_index = SlotIndex(DEFAULT_TIMEZONE)
+
+def utc_now():
+    return datetime.now(timezone.utc)
+
+def group_today(data):
+    """ تاريخ اليوم بتوقيت المجموعة، وبه يُمنع تكرار الإرسال في نفس اليوم المحلي """
+    return datetime.now(ZoneInfo(data.timezone or DEFAULT_TIMEZONE)).strftime("%d/%m/%Y")
+
+def index_schedule(chat_id, data):
+    now = utc_now()
+    slot_index.update(chat_id, "image", mask_to_times(data.image_mask), data.images_active, data.timezone, now)
+    slot_index.update(chat_id, "khatma", mask_to_times(data.khatma_mask), data.khatma_active, data.timezone, now)
+
+def refresh_schedule(chat_id):
+    """ تحديث فهرس الأوقات لمحادثة واحدة بعد أي تغيير في إعداداتها """
+    # تحت قفل المحادثة حتى لا يسبق تحديثٌ قديم للفهرس تحديثاً أحدث منه
+    with groups_data.locked(chat_id, create=False) as data:
+        if data is None:
+            slot_index.remove(chat_id)
+            return
+        index_schedule(chat_id, data)
+
+def load_schedule():
+    """
+    فهرس الأوقات عند التشغيل من المجموعات المفعلة فقط (عبر الفهرس الجزئي في القاعدة)،
+    دون إبقاء سجلاتها في الذاكرة؛ فيتناسب زمن التشغيل مع المجموعات النشطة لا مع كل ما سُجل
+    """
+    count = 0
+    with persist_seconds.time("load"):
+        for chat_id, data in store.iter_groups(active_only=True, chat_filter=is_my_chat):
+            index_schedule(chat_id, data)
+            count += 1
+    print(f"Indexed {count} active groups (schema version {store.schema_version()})")
+
+# عملية الاستقبال في التشغيل المقسم لا تجدول شيئاً، فلا تحتاج الفهرس كاملاً
+if BOT_ROLE != "ingress":
+    load_schedule()
+
+# ========== نظام الصور القرآنية ==========
+def get_page_info(page):
+    """ الحصول على معلومات الصفحة من الفهرس المضمّن (بدون طلبات شبكة) """
+    return quran_index.page_info(page)
+
+@functools.lru_cache(maxsize=None)
+def build_pages_caption(page):
+    """ نص التعليق على صفحتين متتاليتين يبدأن من page """
+    first_info = get_page_info(page)
+    last_page = min(page + 1, quran_index.TOTAL_PAGES)
+    last_info = get_page_info(last_page)
+    surahs = quran_index.pages_surahs(page, last_page)
+    return (
+        f"📖 الصفحات {page}-{page+1}\n"
+        f"الجزء: {first_info['juz']}\n"
+        f"الحزب: {first_info['hizb']} (الربع {first_info['rub']})\n"
+        f"السورة: {' - '.join(surahs)}\n"
+        f"من ({first_info['surah']} {first_info['first_ayah']}) "
+        f"إلى ({quran_index.surah_name(last_info['last_surah'])} {last_info['last_ayah']})"
+    )
 
 def get_image_url(page):
     """ الحصول على صورة الصفحة من GitHub """
     return f"https://raw.githubusercontent.com/Mohamed-Nagdy/Quran-App-Data/main/quran_images/{page}.png"
 
+def get_page_media(page, count=True):
+    """
+    file_id الصفحة إذا سبق رفعها إلى تيليجرام، وإلا رابط الصورة
+    count: احتساب البحث في نسبة الإصابة؛ يُطلب مرة واحدة لكل إرسال فلا تُحسب إعادة المحاولة
+    """
+    return page_file_ids.get(page, count) or get_image_url(page)
+
+def remember_page_file_ids(pages, sent_messages):
+    """ حفظ file_id لكل صفحة من الرسائل التي أعادها send_media_group """
+    page_file_ids.put_many(zip(pages, map(largest_photo_id, sent_messages or [])))
+
 # ========== نظام الختمة بالآيات ==========
-def get_random_ayah():
-    """ جلب آية عشوائية من API """
+def get_random_ayah(chat_id=None, data=None, slot=None, day=None):
+    """
+    اختيار آية من النص المضمّن حسب AYAH_SELECTION:
+    random - عشوائية، slot - آية واحدة لكل المجموعات في نفس الوقت،
+    khatma - بدون تكرار داخل ختمة المجموعة
+    """
     try:
-        response = requests.get("https://api.alquran.cloud/v1/ayah/random/ar.alafasy", timeout=10)
-        if response.status_code == 200:
-            ayah = response.json()["data"]
-            return f"{ayah['text']}\n(سورة {ayah['surah']['name']} - الآية {ayah['numberInSurah']})"
-        return "اقْرَأْ بِاسْمِ رَبِّكَ الَّذِي خَلَقَ"
+        if AYAH_SELECTION == "slot" and slot:
+            index = ayah_corpus.slot_index(day or datetime.now().strftime("%d/%m/%Y"), slot)
+        elif AYAH_SELECTION == "khatma" and data is not None:
+            part = (data.current_part % 30) or 30
+            index = ayah_corpus.khatma_index(chat_id, data.completed_khatmas, part - 1)
+        else:
+            index = ayah_corpus.random_index()
+        return ayah_corpus.format_ayah(index)
     except Exception as e:
-        print(f"Error fetching random ayah: {e}")
+        print(f"Error loading ayah: {e}")
         return "اقْرَأْ بِاسْمِ رَبِّكَ الَّذِي خَلَقَ"
 
 # ========== التحقق من صلاحيات الأدمن ==========
+admin_cache = AdminCache(ADMIN_CACHE_TTL)
+_bot_info = None
+_bot_info_lock = threading.Lock()
+
+def get_bot_info():
+    """ بيانات البوت (get_me) تُجلب مرة واحدة فقط طوال عمر العملية """
+    global _bot_info
+    if _bot_info is None:
+        with _bot_info_lock:
+            if _bot_info is None:
+                _bot_info = bot.get_me()
+    return _bot_info
+
 @bot.message_handler(content_types=['new_chat_members'])
 def handle_new_chat(message):
     try:
-        if bot.get_me().id in [user.id for user in message.new_chat_members]:
+        if get_bot_info().id in [user.id for user in message.new_chat_members]:
             if not check_admin(message.chat.id):
                 bot.send_message(
                     message.chat.id,
@@ -116,14 +354,27 @@ def handle_new_chat(message):
     except Exception as e:
         print(f"Error in new chat handler: {e}")
 
+@admin_check_seconds.time()
 def check_admin(chat_id):
     try:
-        member = bot.get_chat_member(chat_id, bot.get_me().id)
-        return member.status in ["administrator", "creator"]
+        is_admin = admin_cache.get(chat_id)
+        if is_admin is None:
+            member = bot.get_chat_member(chat_id, get_bot_info().id)
+            admin_cache.set_status(chat_id, member.status)
+            is_admin = admin_cache.get(chat_id)
+        return is_admin
     except Exception as e:
         print(f"Error checking admin status: {e}")
         return False
 
+@bot.my_chat_member_handler()
+def handle_my_chat_member(update):
+    """ تحديث حالة البوت مباشرة عند ترقيته أو تنزيله أو طرده """
+    try:
+        admin_cache.set_status(update.chat.id, update.new_chat_member.status)
+    except Exception as e:
+        print(f"Error in my_chat_member handler: {e}")
+
 # ========== أوامر البوت الأساسية ==========
 @bot.message_handler(commands=['start', 'help'])
 def send_welcome(message):
@@ -132,18 +383,8 @@ def send_welcome(message):
         if message.chat.type in ["group", "supergroup"]:
             if check_admin(chat_id):
                 if chat_id not in groups_data:
-                    groups_data[chat_id] = {
-                        "current_page": 1,
-                        "image_times": [],
-                        "images_active": False,
-                        "last_image_sent": None,
-                        "current_part": 1,
-                        "khatma_times": [],
-                        "khatma_active": False,
-                        "last_khatma_sent": None,
-                        "completed_khatmas": 0
-                    }
-                    save_data()
+                    get_group(chat_id)
+                    save_group(chat_id)
                 
                 welcome_msg = """
 🕌 *بوت ختمة القرآن الكريم* - الإصدار المطور 🕌
@@ -164,8 +405,11 @@ def send_welcome(message):
 /stop_khatma - إيقاف تذكير الختمة
 /test_khatma - اختبار إرسال الختمة
 /khatma_status - عرض عدد الختمات
+/collective_khatma - بدء ختمة جماعية يحجز فيها الأعضاء الأجزاء
+/end_collective_khatma - إنهاء الختمة الجماعية
 
 ⚙️ *أخرى:*
+/set_timezone - تحديد المنطقة الزمنية للمجموعة
 /status - عرض جميع الإعدادات
 """
                 bot.reply_to(message, welcome_msg, parse_mode="Markdown")
@@ -183,8 +427,12 @@ def set_start_page(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            msg = bot.reply_to(message, "📖 أرسل رقم الصفحة التي تريد البدء منها (يجب أن يكون رقمًا فرديًا بين 1 و603):")
-            bot.register_next_step_handler(msg, process_start_page)
+            bot.reply_to(
+                message,
+                "📖 أرسل رقم الصفحة التي تريد البدء منها (يجب أن يكون رقمًا فرديًا بين 1 و603):",
+                reply_markup=types.ForceReply(selective=True)
+            )
+            conversations.start(chat_id, message.from_user.id, "start_page")
     except Exception as e:
         print(f"Error in set_start_page: {e}")
 
@@ -195,8 +443,9 @@ def process_start_page(message):
             try:
                 page = int(message.text)
                 if 1 <= page <= 603 and page % 2 == 1:
-                    groups_data[chat_id]["current_page"] = page
-                    save_data()
+                    with groups_data.locked(chat_id) as data:
+                        data.current_page = page
+                    save_group(chat_id)
                     bot.reply_to(message, f"✅ تم تعيين صفحة البدء إلى {page}")
                 else:
                     bot.reply_to(message, "⚠️ يجب أن يكون الرقم فرديًا بين 1 و603")
@@ -210,8 +459,12 @@ def set_start_part(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            msg = bot.reply_to(message, "📖 أرسل رقم الجزء الذي تريد البدء منه (بين 1 و30):")
-            bot.register_next_step_handler(msg, process_start_part)
+            bot.reply_to(
+                message,
+                "📖 أرسل رقم الجزء الذي تريد البدء منه (بين 1 و30):",
+                reply_markup=types.ForceReply(selective=True)
+            )
+            conversations.start(chat_id, message.from_user.id, "start_part")
     except Exception as e:
         print(f"Error in set_start_part: {e}")
 
@@ -222,8 +475,9 @@ def process_start_part(message):
             try:
                 part = int(message.text)
                 if 1 <= part <= 30:
-                    groups_data[chat_id]["current_part"] = part
-                    save_data()
+                    with groups_data.locked(chat_id) as data:
+                        data.current_part = part
+                    save_group(chat_id)
                     bot.reply_to(message, f"✅ تم تعيين جزء البدء إلى {part}")
                 else:
                     bot.reply_to(message, "⚠️ يجب أن يكون الرقم بين 1 و30")
@@ -232,42 +486,33 @@ def process_start_part(message):
     except Exception as e:
         print(f"Error in process_start_part: {e}")
 
+# الخطوات المنتظرة بأسمائها المحفوظة في القاعدة
+CONVERSATION_STEPS = {
+    "start_page": process_start_page,
+    "start_part": process_start_part,
+}
+
+def has_pending_step(message):
+    """ هل ينتظر البوت رداً من مرسل هذه الرسالة في هذه المحادثة (الأوامر لا تُعتبر رداً) """
+    if message.from_user is None or not message.text or message.text.startswith("/"):
+        return False
+    return conversations.get(message.chat.id, message.from_user.id) is not None
+
+@bot.message_handler(func=has_pending_step)
+def handle_pending_step(message):
+    try:
+        step = conversations.pop(message.chat.id, message.from_user.id)
+        if step in CONVERSATION_STEPS:
+            CONVERSATION_STEPS[step](message)
+    except Exception as e:
+        print(f"Error in pending step: {e}")
+
 # ========== دوال إعداد الأوقات ==========
-def create_time_keyboard(prefix):
-    """ إنشاء لوحة مفاتيح لاختيار الوقت """
-    markup = types.InlineKeyboardMarkup(row_width=3)
-    buttons = []
-    for time_str in AVAILABLE_TIMES:
-        hour = int(time_str.split(":")[0])
-        time_display = f"{hour}:00 {'ص' if hour < 12 else 'م'}"
-        callback_data = f"{prefix}_{time_str}"
-        
-        # تحديد إذا كان الوقت محدد مسبقاً
-        chat_id = str(call.message.chat.id) if prefix == "image" else str(call.message.chat.id)
-        if prefix == "image":
-            selected = time_str in groups_data.get(chat_id, {}).get("image_times", [])
-        else:
-            selected = time_str in groups_data.get(chat_id, {}).get("khatma_times", [])
-            
-        if selected:
-            time_display = "✅ " + time_display
-            
-        buttons.append(types.InlineKeyboardButton(
-            text=time_display,
-            callback_data=callback_data
-        ))
-    
-    # تقسيم الأزرار إلى صفوف كل 3 أزرار
-    for i in range(0, len(buttons), 3):
-        markup.row(*buttons[i:i+3])
-    
-    # زر إنهاء الاختيار
-    markup.row(types.InlineKeyboardButton(
-        text="تم الاختيار",
-        callback_data=f"done_{prefix}"
-    ))
-    
-    return markup
+def create_time_keyboard(prefix, chat_id):
+    """ لوحة مفاتيح اختيار الوقت من الجدول المبني مسبقاً حسب أوقات المجموعة الحالية """
+    kind = prefix.split("_")[0]
+    data = groups_data.get(chat_id)
+    return time_keyboard(prefix, data.mask(kind) if data else 0)
 
 @bot.message_handler(commands=['set_image_time'])
 def set_image_time(message):
@@ -277,7 +522,7 @@ def set_image_time(message):
             bot.send_message(
                 chat_id,
                 "⏰ اختر وقت إرسال الصور اليومية (يمكن اختيار أكثر من وقت):",
-                reply_markup=create_time_keyboard("image_time")
+                reply_markup=create_time_keyboard("image_time", chat_id)
             )
     except Exception as e:
         print(f"Error in set_image_time: {e}")
@@ -290,22 +535,87 @@ def set_khatma_time(message):
             bot.send_message(
                 chat_id,
                 "⏰ اختر وقت إرسال تذكير الختمة اليومية (يمكن اختيار أكثر من وقت):",
-                reply_markup=create_time_keyboard("khatma_time")
+                reply_markup=create_time_keyboard("khatma_time", chat_id)
             )
     except Exception as e:
         print(f"Error in set_khatma_time: {e}")
 
+@bot.message_handler(commands=['set_timezone'])
+def set_timezone(message):
+    try:
+        chat_id = str(message.chat.id)
+        if check_admin(chat_id):
+            args = message.text.split(maxsplit=1)
+            data = groups_data.get(chat_id)
+            current = data.timezone if data is not None else None
+            if len(args) < 2:
+                bot.reply_to(
+                    message,
+                    f"🌍 المنطقة الزمنية الحالية: {current or DEFAULT_TIMEZONE}\n"
+                    f"لتغييرها أرسل الأمر مع اسم المنطقة، مثال: /set_timezone Asia/Riyadh"
+                )
+                return
+            name = args[1].strip()
+            try:
+                zone = ZoneInfo(name)
+            except (KeyError, ValueError):
+                bot.reply_to(message, "⚠️ منطقة زمنية غير معروفة. استخدم اسماً مثل Africa/Cairo أو Asia/Riyadh")
+                return
+            with groups_data.locked(chat_id) as data:
+                data.timezone = name
+                refresh_schedule(chat_id)
+            save_group(chat_id)
+            bot.reply_to(message, f"✅ تم تعيين المنطقة الزمنية إلى {name} (الساعة الآن هناك {datetime.now(zone):%H:%M})")
+    except Exception as e:
+        print(f"Error in set_timezone: {e}")
+
+def edit_keyboard(chat_id, message_id, markup):
+    """ تعديل لوحة الأزرار؛ «message is not modified» يعني أن المعروض مطابق بالفعل """
+    try:
+        bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=markup)
+        keyboard_edits.inc("sent")
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            raise
+        keyboard_edits.inc("unchanged")
+
+def flush_time_keyboard(key, first, last, presses):
+    """ بعد هدوء الضغطات على رسالة أوقات: حفظ واحد وتعديل واحد بالاختيار النهائي """
+    chat_id, message_id = key
+    prefix, shown_mask = first
+    keyboard_edits.inc("coalesced", amount=presses - 1)
+    save_group(chat_id)
+    data = groups_data.get(chat_id)
+    mask = data.mask(prefix.split("_")[0]) if data else 0
+    if mask == shown_mask:
+        # عدد زوجي من الضغطات على نفس الأوقات: اللوحة المعروضة صحيحة كما هي
+        keyboard_edits.inc("unchanged")
+        return
+    edit_keyboard(chat_id, message_id, time_keyboard(prefix, mask))
+
+time_keyboards = Debouncer(flush_time_keyboard, KEYBOARD_EDIT_DELAY, 3 * KEYBOARD_EDIT_DELAY, name="time-keyboard")
+metrics.Gauge("pending_keyboard_edits", "Keyboard edits waiting for presses to settle",
+              func=lambda: len(time_keyboards) + len(collective_keyboards))
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith(("image_time_", "khatma_time_", "done_")))
 def handle_time_selection(call):
+    """
+    الضغطة تُطبق في الذاكرة ويُرد عليها فوراً، أما الحفظ وتعديل اللوحة فيُجمعان لكل رسالة
+    في عملية واحدة بعد هدوء الضغطات (flush_time_keyboard)
+    """
     try:
         chat_id = str(call.message.chat.id)
         if not check_admin(chat_id):
             bot.answer_callback_query(call.id, "⚠️ يجب أن تكون أدمن لاستخدام هذا الأمر")
             return
+        key = (chat_id, call.message.message_id)
             
         if call.data.startswith("done_"):
-            prefix = call.data.split("_")[1]
             bot.answer_callback_query(call.id, "تم حفظ الأوقات المحددة")
+            # التعديل المؤجل لم يعد لازماً، فاللوحة تُزال
+            if time_keyboards.cancel(key) is not None:
+                keyboard_edits.inc("coalesced")
+            save_group(chat_id)
             bot.edit_message_reply_markup(
                 chat_id=call.message.chat.id,
                 message_id=call.message.message_id,
@@ -313,75 +623,125 @@ def handle_time_selection(call):
             )
             return
             
-        prefix, selected_time = call.data.split("_", 1)
-        time_display = f"{int(selected_time.split(':')[0])}:00 {'ص' if int(selected_time.split(':')[0]) < 12 else 'م'}"
-        
-        if prefix == "image":
-            times_list = groups_data[chat_id].get("image_times", [])
-            if selected_time in times_list:
-                times_list.remove(selected_time)
-                action = "إزالة"
-            else:
-                times_list.append(selected_time)
-                action = "إضافة"
-            groups_data[chat_id]["image_times"] = times_list
-        else:
-            times_list = groups_data[chat_id].get("khatma_times", [])
-            if selected_time in times_list:
-                times_list.remove(selected_time)
-                action = "إزالة"
-            else:
-                times_list.append(selected_time)
-                action = "إضافة"
-            groups_data[chat_id]["khatma_times"] = times_list
+        prefix, selected_time = call.data.rsplit("_", 1)
+        kind = prefix.split("_")[0]
         
-        save_data()
-        bot.answer_callback_query(call.id, f"{action} الوقت {time_display}")
-        
-        # تحديث لوحة المفاتيح لتعكس التغييرات
-        new_prefix = "image" if prefix == "image" else "khatma"
-        bot.edit_message_reply_markup(
-            chat_id=call.message.chat.id,
-            message_id=call.message.message_id,
-            reply_markup=create_time_keyboard(f"{new_prefix}_time")
-        )
+        # القلب والفهرسة ذريان: نقرتان متزامنتان لا تضيع إحداهما
+        with groups_data.locked(chat_id) as data:
+            shown_mask = data.mask(kind)
+            selected = data.toggle_time(kind, selected_time)
+            refresh_schedule(chat_id)
+        action = "إضافة" if selected else "إزالة"
+        bot.answer_callback_query(call.id, f"{action} الوقت {time_display(selected_time)}")
+        time_keyboards.touch(key, (prefix, shown_mask))
         
     except Exception as e:
         print(f"Error in time selection: {e}")
 
 # ========== دوال إرسال الصور المحدثة ==========
-def send_quran_pages(chat_id):
+def is_delivery_error_to_propagate(error):
+    """ أخطاء يعالجها الموزع بنفسه: 429 (إعادة المحاولة) وطرد البوت (حذف المجموعة) """
+    return retry_after_seconds(error) is not None or "Forbidden" in str(error)
+
+def is_spread_page(page):
+    return spreads is not None and spread_index(page) is not None
+
+def build_pages_media(page, caption=None, count=True):
+    """
+    وسائط صفحتين متتاليتين مع التعليق لإرسالها بـ send_media_group،
+    أو التعليق وحده في وضع spread (الصورة المركبة تُقرأ عند الإرسال) إذا كانت الصفحة بداية صورة مركبة
+    تُبنى عند الإرسال حتى يُستعمل أي file_id حفظه إرسال سابق في نفس الوقت؛ caption تعليق مجهز مسبقاً
+    """
+    if caption is None:
+        caption = build_pages_caption(page)
+    if is_spread_page(page):
+        return caption
+    return [
+        types.InputMediaPhoto(
+            get_page_media(page, count),
+            caption=caption
+        ),
+        types.InputMediaPhoto(
+            get_page_media(page + 1, count),
+            caption=""
+        )
+    ]
+
+def pages_cost(page):
+    """ عدد الرسائل التي يحسبها تيليجرام: مجموعة الوسائط رسالتان والصورة المركبة رسالة واحدة """
+    return 1 if is_spread_page(page) else 2
+
+QURAN_COMPLETED_MESSAGE = "🎉 *تم الانتهاء من القرآن الكريم!*\n\nاللهم ارحمني بالقرآن واجعله لي نوراً وهدى ورحمة"
+KHATMA_COMPLETED_MESSAGE = "🎉 *تهانينا!* لقد أكملت ختمة كاملة!\n\nاللهم ارزقنا تلاوته آناء الليل وأطراف النهار"
+
+def send_completion_message(chat_id, text):
+    """
+    رسالة ختام القرآن أو الختمة بعد إرسال مؤكد وحفظ تقدمه، كمهمة تالية في دفعة الموزع الجارية
+    (بحصتها من حدود المعدل وإعادة المحاولة بعد 429) فلا يُعاد الإرسال الأصلي بسبب فشلها؛
+    خارج الدفعات (أوامر الاختبار) تُرسل مباشرة وأخطاؤها تُسجل فقط
+    """
+    def send():
+        return bot.send_message(chat_id, text, parse_mode="Markdown")
+
+    if dispatcher.follow_up(chat_id, send):
+        return
+    try:
+        send()
+    except Exception as e:
+        print(f"Error sending completion message to {chat_id}: {e}")
+
+def send_pages_media(chat_id, page, media):
+    """ إرسال الصفحتين؛ إذا رفض تيليجرام file_id محفوظاً يُحذف ويُعاد الإرسال مرة واحدة برفع الصور من مصدرها """
+    try:
+        return _send_pages_media(chat_id, page, media)
+    except Exception as e:
+        if not is_invalid_file_id_error(e):
+            raise
+        print(f"Cached file_id rejected for page {page}, uploading again: {e}")
+        if isinstance(media, str):
+            spread_file_ids.discard(page)
+        else:
+            for cached_page, item in zip((page, page + 1), media):
+                page_file_ids.discard(cached_page, item.media)
+        # إعادة المحاولة جزء من نفس الإرسال فلا تُحسب في نسبة الإصابة
+        return _send_pages_media(chat_id, page, build_pages_media(page, count=False), count=False)
+
+def _send_pages_media(chat_id, page, media, count=True):
+    if isinstance(media, str):
+        # الرفع من الملف مرة واحدة فقط، ثم بـ file_id
+        sent = bot.send_photo(chat_id, spread_file_ids.get(page, count) or spreads.upload(page), caption=media)
+        spread_file_ids.put_many([(page, largest_photo_id(sent))])
+        return sent
+    sent = bot.send_media_group(chat_id, media)
+    remember_page_file_ids((page, page + 1), sent)
+    return sent
+
+@delivery_seconds.time("image")
+def send_quran_pages(chat_id, persist=True, prepared=None, day=None, batch=None):
+    """
+    prepared: (الصفحة، التعليق) مجهزان مسبقاً، ويُهملان إذا تغيرت صفحة المجموعة بعد تجهيزهما
+    day: اليوم المحلي للمجموعة الذي يُسجل كآخر إرسال (اليوم الحالي إذا لم يُحدد)
+    batch: دفعة صندوق الإرسال في الأوقات المجدولة، يُؤكد فيها الإرسال ويُسجل الخطأ بدلاً من الحفظ ورسالة المشرف
+    """
     try:
-        data = groups_data[chat_id]
-        if not data.get("images_active", False):
-            return False
+        with groups_data.locked(chat_id, create=False) as data:
+            if data is None or not data.images_active:
+                return False
+            if day is not None and data.last_image_sent == day:
+                return None  # أُرسلت صفحات هذا اليوم بالفعل (من التعويض أو من وقت آخر)
             
-        current_page = data["current_page"]
-        
-        # التحقق من وجود الصفحة
-        if current_page > 604 or current_page < 1:
-            current_page = 1
-            data["current_page"] = 1
+            # التحقق من وجود الصفحة
+            if data.current_page > 604 or data.current_page < 1:
+                data.current_page = 1
+            current_page = data.current_page
 
-        page_info = get_page_info(current_page)
-        
-        # إعداد الوسائط مع التحقق من الصور
-        media = [
-            types.InputMediaPhoto(
-                get_image_url(current_page),
-                caption=f"📖 الصفحات {current_page}-{current_page+1}\n"
-                        f"الجزء: {page_info['juz']}\n"
-                        f"السورة: {page_info['surah']}"
-            ),
-            types.InputMediaPhoto(
-                get_image_url(current_page + 1),
-                caption=""
-            )
-        ]
+        # إعداد الوسائط الآن من ذاكرة file_id (التعليق فقط يُجهز مسبقاً)
+        caption = prepared[1] if prepared is not None and prepared[0] == current_page else None
+        media = build_pages_media(current_page, caption)
         
         # إرسال الصور مع معالجة الأخطاء
         try:
-            sent_msg = bot.send_media_group(chat_id, media)
+            sent_msg = send_pages_media(chat_id, current_page, media)
             print(f"تم الإرسال بنجاح إلى {chat_id}: {sent_msg}")
         except Exception as send_error:
             print(f"Error in sending: {send_error}")
@@ -391,20 +751,32 @@ def send_quran_pages(chat_id):
         new_page = current_page + 2
         if new_page > 604:
             new_page = 1
-            bot.send_message(
-                chat_id,
-                "🎉 *تم الانتهاء من القرآن الكريم!*\n\nاللهم ارحمني بالقرآن واجعله لي نوراً وهدى ورحمة",
-                parse_mode="Markdown"
-            )
 
-        data["current_page"] = new_page
-        data["last_image_sent"] = datetime.now().strftime("%d/%m/%Y")
-        save_data()
+        # الإرسال يتم خارج القفل، ثم تُقدّم الصفحة فقط إذا لم يغيرها المشرف أثناءه
+        with groups_data.locked(chat_id, create=False) as data:
+            if data is None:
+                return True
+            if data.current_page == current_page:
+                data.current_page = new_page
+            data.last_image_sent = day or group_today(data)
+        if batch is not None:
+            batch.ack("image", chat_id)
+        elif persist:
+            save_group(chat_id)
+
+        # رسالة الختام بعد حفظ التقدم، ففشلها لا يعيد إرسال الصفحات
+        if new_page == 1:
+            send_completion_message(chat_id, QURAN_COMPLETED_MESSAGE)
         return True
         
     except Exception as e:
+        if is_delivery_error_to_propagate(e):
+            raise
         print(f"Error sending pages: {e}")
-        bot.send_message(ADMIN_ID, f"⚠️ خطأ في إرسال الصفحات: {str(e)}")
+        if batch is not None:
+            batch.fail("image", chat_id, e)
+        else:
+            bot.send_message(ADMIN_ID, f"⚠️ خطأ في إرسال الصفحات: {str(e)}")
         return False
 
 @bot.message_handler(commands=['start_images'])
@@ -412,11 +784,14 @@ def start_images(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            if not groups_data[chat_id]["image_times"]:
+            with groups_data.locked(chat_id) as data:
+                if data.image_mask:
+                    data.images_active = True
+                    refresh_schedule(chat_id)
+            if not data.image_mask:
                 bot.reply_to(message, "⚠️ يرجى تحديد وقت الإرسال أولاً باستخدام /set_image_time")
             else:
-                groups_data[chat_id]["images_active"] = True
-                save_data()
+                save_group(chat_id)
                 bot.reply_to(message, "✅ تم تفعيل إرسال الصور القرآنية")
     except Exception as e:
         print(f"Error in start_images: {e}")
@@ -426,8 +801,10 @@ def stop_images(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            groups_data[chat_id]["images_active"] = False
-            save_data()
+            with groups_data.locked(chat_id) as data:
+                data.images_active = False
+                refresh_schedule(chat_id)
+            save_group(chat_id)
             bot.reply_to(message, "❌ تم إيقاف إرسال الصور القرآنية")
     except Exception as e:
         print(f"Error in stop_images: {e}")
@@ -437,7 +814,11 @@ def test_images(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            if not groups_data[chat_id]["images_active"]:
+            if BOT_ROLE == "ingress":
+                # الإرسال والحفظ من تقدم العامل الحالي، لا من نسخة قديمة تعيده إلى الوراء عبر جدول التغييرات
+                reload_group(chat_id)
+
+            if not get_group(chat_id).images_active:
                 bot.reply_to(message, "⚠️ إرسال الصور معطل حالياً. استخدم /start_images لتفعيله.")
                 return
                 
@@ -449,50 +830,175 @@ def test_images(message):
     except Exception as e:
         print(f"Error in test_images: {e}")
 
-# ========== دوال إرسال الختمة ==========
-def send_khatma_reminder(chat_id):
+# ========== ذاكرة file_id للصفحات ==========
+def is_bot_owner(message):
+    return ADMIN_ID is not None and str(message.from_user.id) == str(ADMIN_ID)
+
+def warm_page_cache(report_chat_id):
+    """ رفع الصفحات غير المحفوظة إلى القناة الخاصة على دفعات من 10 صور """
+    pages = [page for page in range(1, quran_index.TOTAL_PAGES + 1) if page not in page_file_ids]
+    uploaded = 0
+    for i in range(0, len(pages), 10):
+        batch = pages[i:i+10]
+        try:
+            sent = bot.send_media_group(
+                CACHE_CHANNEL_ID,
+                [types.InputMediaPhoto(get_image_url(page)) for page in batch]
+            )
+            remember_page_file_ids(batch, sent)
+            uploaded += len(batch)
+        except Exception as e:
+            print(f"Error warming page cache at page {batch[0]}: {e}")
+        time.sleep(3)  # البقاء تحت حدود الإرسال للقناة الواحدة
+    bot.send_message(
+        report_chat_id,
+        f"✅ اكتمل رفع الصفحات: {uploaded} صفحة جديدة، المحفوظ الآن {len(page_file_ids)} من {quran_index.TOTAL_PAGES}"
+    )
+
+def warm_spread_cache(report_chat_id):
+    """ رفع الصور المركبة غير المحفوظة إلى القناة الخاصة واحدة واحدة """
+    uploaded = 0
+    for page in range(1, quran_index.TOTAL_PAGES, 2):
+        if page in spread_file_ids:
+            continue
+        try:
+            sent = bot.send_photo(CACHE_CHANNEL_ID, spreads.upload(page))
+            spread_file_ids.put_many([(page, largest_photo_id(sent))])
+            uploaded += 1
+        except Exception as e:
+            print(f"Error warming spread cache at page {page}: {e}")
+        time.sleep(3)
+    bot.send_message(
+        report_chat_id,
+        f"✅ اكتمل رفع الصور المركبة: {uploaded} صورة جديدة، المحفوظ الآن {len(spread_file_ids)} من {quran_index.TOTAL_PAGES // 2}"
+    )
+
+@bot.message_handler(commands=['warm_cache'])
+def warm_cache(message):
     try:
-        data = groups_data[chat_id]
-        if not data.get("khatma_active", False):
-            return False
-            
-        today = datetime.now().strftime("%d/%m/%Y")
-        part = (data.get("current_part", 1) % 30) or 30
-        
-        # إعداد رسالة التذكير
-        message = f"""
+        if not is_bot_owner(message):
+            return
+        if not CACHE_CHANNEL_ID:
+            bot.reply_to(message, "⚠️ يرجى تحديد CACHE_CHANNEL_ID في ملف .env أولاً")
+            return
+        bot.reply_to(message, "⏳ جاري رفع صفحات المصحف إلى القناة الخاصة...")
+        target = warm_spread_cache if spreads is not None else warm_page_cache
+        threading.Thread(target=target, args=(message.chat.id,), daemon=True).start()
+    except Exception as e:
+        print(f"Error in warm_cache: {e}")
+
+@bot.message_handler(commands=['cache_stats'])
+def cache_stats(message):
+    try:
+        if not is_bot_owner(message):
+            return
+        stats = page_file_ids.stats()
+        admin_stats = admin_cache.stats()
+        group_stats = groups_data.stats()
+        bot.reply_to(
+            message,
+            f"🗂 ذاكرة الصفحات: {stats['entries']} من {quran_index.TOTAL_PAGES}\n"
+            f"إصابات: {stats['hits']} | إخفاقات: {stats['misses']} | النسبة: {stats['hit_ratio']:.1%} | "
+            f"مرفوضة وأُعيد رفعها: {stats['invalidated']}\n\n"
+            f"🛡 ذاكرة صلاحيات الإشراف: {admin_stats['entries']} مجموعة\n"
+            f"إصابات: {admin_stats['hits']} | إخفاقات: {admin_stats['misses']} | النسبة: {admin_stats['hit_ratio']:.1%}\n\n"
+            f"👥 سجلات المجموعات في الذاكرة: {group_stats['entries']} من {GROUP_CACHE_SIZE}\n"
+            f"إصابات: {group_stats['hits']} | إخفاقات: {group_stats['misses']} | "
+            f"مُخرجة: {group_stats['evictions']} | النسبة: {group_stats['hit_ratio']:.1%}"
+        )
+    except Exception as e:
+        print(f"Error in cache_stats: {e}")
+
+@bot.message_handler(commands=['http_stats'])
+def http_stats(message):
+    try:
+        if not is_bot_owner(message):
+            return
+        lines = ["🌐 الطلبات الصادرة:"]
+        for host, stats in http.stats().items():
+            lines.append(
+                f"{host}: {stats['requests']} طلب، {stats['errors']} خطأ، "
+                f"متوسط {stats['avg_latency'] * 1000:.0f}ms، أقصى {stats['max_latency'] * 1000:.0f}ms"
+                f"{' ⛔ متوقف مؤقتاً' if stats['circuit_open'] else ''}"
+            )
+        bot.reply_to(message, "\n".join(lines))
+    except Exception as e:
+        print(f"Error in http_stats: {e}")
+
+# ========== دوال إرسال الختمة ==========
+def build_khatma_message(chat_id, data, slot=None, day=None):
+    """ نص تذكير الختمة للجزء الحالي من المجموعة """
+    today = day or group_today(data)
+    part = (data.current_part % 30) or 30
+    return f"""
 🕌 *تذكير ورد اليوم*  
 السلام عليكم ورحمة الله وبركاته  
 
 📅 *التاريخ:* {today}  
 📖 *الجزء:* {part} من 30  
-🔄 *الختمات المكتملة:* {data.get("completed_khatmas", 0)}  
+🔄 *الختمات المكتملة:* {data.completed_khatmas}  
 
 ✨ *آية اليوم:*  
-{get_random_ayah()}  
+{get_random_ayah(chat_id, data, slot, today)}  
 
 اللهم اجعل القرآن ربيع قلوبنا ونور صدورنا.
 """
-        bot.send_message(chat_id, message, parse_mode="Markdown")
+
+@delivery_seconds.time("khatma")
+def send_khatma_reminder(chat_id, persist=True, slot=None, prepared=None, day=None, batch=None):
+    """
+    prepared: (الجزء، عدد الختمات، النص) مجهزة مسبقاً، وتُهمل إذا تغير الجزء بعد تجهيزها
+    day: اليوم المحلي للمجموعة (اليوم الحالي إذا لم يُحدد)
+    batch: دفعة صندوق الإرسال (كما في send_quran_pages)
+    """
+    try:
+        with groups_data.locked(chat_id, create=False) as data:
+            if data is None or not data.khatma_active:
+                return False
+            if day is not None and data.last_khatma_sent == day:
+                return None
+            
+            today = day or group_today(data)
+            current_part = data.current_part
+            part = (current_part % 30) or 30
+            
+            # إعداد رسالة التذكير
+            if prepared is not None and prepared[:2] == (part, data.completed_khatmas):
+                message = prepared[2]
+            else:
+                message = build_khatma_message(chat_id, data, slot, today)
+        if BOT_ROLE == "worker":
+            # الحجز يتم في عملية الاستقبال، فتُقرأ حالة الختمة الجماعية من القاعدة
+            khatma_data.replace(chat_id, store.load_khatma_value(chat_id))
+        bot.send_message(chat_id, message, parse_mode="Markdown", reply_markup=khatma_data.keyboard(chat_id))
         
-        # التحقق من اكتمال الختمة
-        if part == 30:
-            bot.send_message(
-                chat_id,
-                "🎉 *تهانينا!* لقد أكملت ختمة كاملة!\n\nاللهم ارزقنا تلاوته آناء الليل وأطراف النهار",
-                parse_mode="Markdown"
-            )
-            data["completed_khatmas"] = data.get("completed_khatmas", 0) + 1
+        # تحديث الجزء التالي فقط إذا لم يغيره المشرف أثناء الإرسال
+        with groups_data.locked(chat_id, create=False) as data:
+            if data is None:
+                return True
+            if data.current_part == current_part:
+                data.current_part = part + 1
+                if part == 30:
+                    data.completed_khatmas += 1
+            data.last_khatma_sent = today
+        if batch is not None:
+            batch.ack("khatma", chat_id)
+        elif persist:
+            save_group(chat_id)
         
-        # تحديث الجزء التالي
-        data["current_part"] = part + 1
-        data["last_khatma_sent"] = today
-        save_data()
+        # التحقق من اكتمال الختمة (بعد حفظ التقدم كما في send_quran_pages)
+        if part == 30:
+            send_completion_message(chat_id, KHATMA_COMPLETED_MESSAGE)
         return True
         
     except Exception as e:
+        if is_delivery_error_to_propagate(e):
+            raise
         print(f"Error in khatma reminder: {e}")
-        bot.send_message(ADMIN_ID, f"⚠️ خطأ في إرسال الختمة: {str(e)}")
+        if batch is not None:
+            batch.fail("khatma", chat_id, e)
+        else:
+            bot.send_message(ADMIN_ID, f"⚠️ خطأ في إرسال الختمة: {str(e)}")
         return False
 
 @bot.message_handler(commands=['start_khatma'])
@@ -500,11 +1006,14 @@ def start_khatma(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            if not groups_data[chat_id]["khatma_times"]:
+            with groups_data.locked(chat_id) as data:
+                if data.khatma_mask:
+                    data.khatma_active = True
+                    refresh_schedule(chat_id)
+            if not data.khatma_mask:
                 bot.reply_to(message, "⚠️ يرجى تحديد وقت الإرسال أولاً باستخدام /set_khatma_time")
             else:
-                groups_data[chat_id]["khatma_active"] = True
-                save_data()
+                save_group(chat_id)
                 bot.reply_to(message, "✅ تم تفعيل تذكير الختمة اليومية")
     except Exception as e:
         print(f"Error in start_khatma: {e}")
@@ -514,8 +1023,10 @@ def stop_khatma(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            groups_data[chat_id]["khatma_active"] = False
-            save_data()
+            with groups_data.locked(chat_id) as data:
+                data.khatma_active = False
+                refresh_schedule(chat_id)
+            save_group(chat_id)
             bot.reply_to(message, "❌ تم إيقاف تذكير الختمة اليومية")
     except Exception as e:
         print(f"Error in stop_khatma: {e}")
@@ -525,7 +1036,11 @@ def test_khatma(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            if not groups_data[chat_id]["khatma_active"]:
+            if BOT_ROLE == "ingress":
+                # الإرسال والحفظ من تقدم العامل الحالي، لا من نسخة قديمة تعيده إلى الوراء عبر جدول التغييرات
+                reload_group(chat_id)
+
+            if not get_group(chat_id).khatma_active:
                 bot.reply_to(message, "⚠️ إرسال الختمة معطل حالياً. استخدم /start_khatma لتفعيله.")
                 return
                 
@@ -541,97 +1056,587 @@ def khatma_status(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            bot.reply_to(message, f"عدد الختمات المكتملة: {groups_data.get(chat_id, {}).get('completed_khatmas', 0)}")
+            if BOT_ROLE == "ingress":
+                reload_group(chat_id)  # التقدم يكتبه العمال
+
+            bot.reply_to(message, f"عدد الختمات المكتملة: {get_group(chat_id).completed_khatmas if chat_id in groups_data else 0}")
     except Exception as e:
         print(f"Error in khatma_status: {e}")
 
+# ========== الختمة الجماعية ==========
+PRESS_ANSWERS = {
+    CLAIMED: "📖 حُجز لك الجزء {juz}، اضغط عليه مرة أخرى عند الانتهاء",
+    COMPLETED: "✅ تقبل الله، تم تسجيل إتمام الجزء {juz}",
+    FINISHED: "🎉 تم إتمام الجزء {juz} واكتملت الختمة!",
+    TAKEN: "⚠️ الجزء {juz} محجوز لعضو آخر",
+    ALREADY_DONE: "✅ الجزء {juz} مكتمل بالفعل",
+}
+
+@bot.message_handler(commands=['collective_khatma'])
+def start_collective_khatma(message):
+    try:
+        chat_id = str(message.chat.id)
+        if check_admin(chat_id):
+            state, started = khatma_data.start(chat_id)
+            if started:
+                save_khatma_data([chat_id])
+                text = f"📜 *الختمة الجماعية رقم {state.number}*\n\nاختر جزءاً لحجزه، ثم اضغط عليه مرة أخرى عند إتمام قراءته"
+            else:
+                text = f"📜 *الختمة الجماعية رقم {state.number}* جارية بالفعل"
+            bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=khatma_data.keyboard(chat_id))
+    except Exception as e:
+        print(f"Error in collective_khatma: {e}")
+
+@bot.message_handler(commands=['end_collective_khatma'])
+def end_collective_khatma(message):
+    try:
+        chat_id = str(message.chat.id)
+        if check_admin(chat_id):
+            if khatma_data.end(chat_id) is None:
+                bot.reply_to(message, "⚠️ لا توجد ختمة جماعية جارية")
+                return
+            save_khatma_data([chat_id])
+            bot.reply_to(message, "❌ تم إنهاء الختمة الجماعية")
+    except Exception as e:
+        print(f"Error in end_collective_khatma: {e}")
+
+def flush_collective_keyboard(key, number, _, presses):
+    """ بعد هدوء الضغطات على لوحة ختمة جماعية: حفظ واحد وتعديل واحد بالحالة النهائية """
+    chat_id, message_id = key
+    keyboard_edits.inc("coalesced", amount=presses - 1)
+    save_khatma_data([chat_id])
+    edit_keyboard(chat_id, message_id, khatma_data.keyboard(chat_id, number))
+
+collective_keyboards = Debouncer(flush_collective_keyboard, KEYBOARD_EDIT_DELAY, 3 * KEYBOARD_EDIT_DELAY,
+                                 name="collective-keyboard")
+# ما لم يُحفظ بعد من الضغطات يُحفظ عند الخروج
+atexit.register(collective_keyboards.flush_all)
+atexit.register(time_keyboards.flush_all)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("ck_"))
+def handle_collective_press(call):
+    """
+    ضغط أي عضو على جزء: حجزه إذا كان حراً، أو إتمامه إذا كان محجوزاً له
+    بعد التذكير يضغط كثيرون معاً، فالحفظ وتعديل اللوحة يُجمعان لكل رسالة (flush_collective_keyboard)
+    """
+    try:
+        chat_id = str(call.message.chat.id)
+        if call.data == "ck_info":
+            state = khatma_data.get(chat_id)
+            if state is None:
+                bot.answer_callback_query(call.id, "لا توجد ختمة جماعية جارية")
+                return
+            done = bin(state.completed).count("1")
+            bot.answer_callback_query(call.id, f"الختمة رقم {state.number}: اكتمل {done} من 30 جزءاً")
+            return
+
+        _, number, juz = call.data.split("_")
+        juz = int(juz)
+        result = khatma_data.press(chat_id, int(number), juz, call.from_user.id)
+        if result not in PRESS_ANSWERS:
+            bot.answer_callback_query(call.id, "⚠️ هذه الختمة انتهت")
+            return
+        bot.answer_callback_query(call.id, PRESS_ANSWERS[result].format(juz=juz))
+        if result not in CHANGED:
+            return
+        collective_keyboards.touch((chat_id, call.message.message_id), int(number))
+        if result == FINISHED:
+            bot.send_message(
+                chat_id,
+                "🎉 *تهانينا!* اكتملت الختمة الجماعية بأجزائها الثلاثين\n\nاللهم تقبل منا إنك أنت السميع العليم",
+                parse_mode="Markdown"
+            )
+    except Exception as e:
+        print(f"Error in collective khatma press: {e}")
+
 @bot.message_handler(commands=['status'])
 def show_status(message):
     try:
         chat_id = str(message.chat.id)
         if check_admin(chat_id):
-            data = groups_data.get(chat_id, {})
+            if BOT_ROLE == "ingress":
+                reload_group(chat_id)  # التقدم يكتبه العمال
+
+            data = groups_data.get(chat_id) or GroupRecord()
             
             # تحويل الأوقات إلى تنسيق 12 ساعة
-            image_times = data.get("image_times", [])
-            image_times_display = []
-            for time_str in image_times:
-                hour = int(time_str.split(":")[0])
-                image_times_display.append(f"{hour}:00 {'ص' if hour < 12 else 'م'}")
-            
-            khatma_times = data.get("khatma_times", [])
-            khatma_times_display = []
-            for time_str in khatma_times:
-                hour = int(time_str.split(":")[0])
-                khatma_times_display.append(f"{hour}:00 {'ص' if hour < 12 else 'م'}")
+            image_times_display = [time_display(time_str) for time_str in mask_to_times(data.image_mask)]
+            khatma_times_display = [time_display(time_str) for time_str in mask_to_times(data.khatma_mask)]
             
             status_text = f"""
 ⚙️ *الإعدادات الحالية:*
 
 📖 *نظام الصور:*
-- الحالة: {'✅ مفعل' if data.get('images_active', False) else '❌ معطل'}
-- الصفحة الحالية: {data.get('current_page', 1)}
+- الحالة: {'✅ مفعل' if data.images_active else '❌ معطل'}
+- الصفحة الحالية: {data.current_page}
 - أوقات الإرسال: {', '.join(image_times_display) if image_times_display else 'غير محدد'}
 
 📜 *نظام الختمة:*
-- الحالة: {'✅ مفعل' if data.get('khatma_active', False) else '❌ معطل'}
-- الجزء الحالي: {data.get('current_part', 1)}
+- الحالة: {'✅ مفعل' if data.khatma_active else '❌ معطل'}
+- الجزء الحالي: {data.current_part}
 - أوقات الإرسال: {', '.join(khatma_times_display) if khatma_times_display else 'غير محدد'}
-- الختمات المكتملة: {data.get('completed_khatmas', 0)}
+- الختمات المكتملة: {data.completed_khatmas}
+
+🌍 *المنطقة الزمنية:* `{data.timezone or DEFAULT_TIMEZONE}`
 """
             bot.reply_to(message, status_text, parse_mode="Markdown")
     except Exception as e:
         print(f"Error in status: {e}")
 
 # ========== دوال الجدولة الرئيسية ==========
-def scheduler():
-    while True:
+def handle_delivery_error(chat_id, error):
+    print(f"Error in chat {chat_id}: {error}")
+    if "Forbidden" in str(error):  # إذا تم طرد البوت من المجموعة
+        with groups_data.lock(chat_id):
+            groups_data.remove(chat_id)
+            refresh_schedule(chat_id)
+
+dispatcher = Dispatcher(
+    workers=DISPATCH_WORKERS,
+    global_rate=GLOBAL_RATE_PER_SECOND,
+    chat_rate_per_minute=CHAT_RATE_PER_MINUTE,
+    on_error=handle_delivery_error
+)
+metrics.Gauge("dispatch_queue_depth", "Deliveries of the current slot not finished yet", func=lambda: dispatcher.queue_depth)
+
+def build_slot_jobs(boundary, seen=None, priority=0):
+    """
+    تجهيز مهام الإرسال لكل المحادثات المستحقة عند بداية الدقيقة boundary (UTC): التعليقات ونصوص الختمة
+    والآيات، حتى لا يبقى عند بداية الوقت إلا الإرسال عبر الشبكة؛ الوسائط تُحدد عند الإرسال من ذاكرة file_id
+    seen: مجموعة (النوع، chat_id) تُتخطى، وتُضاف إليها كل محادثة مستحقة هنا (للتعويض)
+    """
+    jobs = []
+    captions = {}
+    minute = boundary.hour * 60 + boundary.minute
+    # الوقت المحلي يُحسب مرة واحدة لكل منطقة زمنية وليس لكل محادثة
+    local_times = {}
+    
+    def local_time(zone_name):
+        if zone_name not in local_times:
+            local_times[zone_name] = slot_index.local_time(zone_name, boundary)
+        return local_times[zone_name]
+    
+    # إرسال الصور (الصفحات المتشابهة تتشارك نفس التعليق، والوسائط تُحدد عند الإرسال)
+    for chat_id, zone_name in slot_index.due("image", minute):
+        if seen is not None:
+            if ("image", chat_id) in seen:
+                continue
+            seen.add(("image", chat_id))
+        data = groups_data.get(chat_id)
+        day = local_time(zone_name).strftime("%d/%m/%Y")
+        if data is None or not data.images_active or data.last_image_sent == day:
+            continue
+        page = data.current_page
+        if page not in captions:
+            captions[page] = build_pages_caption(page)
+        prepared = (page, captions[page])
+        jobs.append(Delivery(
+            "image", chat_id, day, page,
+            lambda batch, chat_id=chat_id, prepared=prepared, day=day: send_quran_pages(chat_id, prepared=prepared, day=day, batch=batch),
+            pages_cost(page), priority
+        ))
+    
+    # إرسال الختمة
+    for chat_id, zone_name in slot_index.due("khatma", minute):
+        if seen is not None:
+            if ("khatma", chat_id) in seen:
+                continue
+            seen.add(("khatma", chat_id))
+        data = groups_data.get(chat_id)
+        day = local_time(zone_name).strftime("%d/%m/%Y")
+        if data is None or not data.khatma_active or data.last_khatma_sent == day:
+            continue
+        slot = local_time(zone_name).strftime("%H:%M")
+        part = (data.current_part % 30) or 30
+        prepared = (part, data.completed_khatmas, build_khatma_message(chat_id, data, slot, day))
+        jobs.append(Delivery(
+            "khatma", chat_id, day, part,
+            lambda batch, chat_id=chat_id, prepared=prepared, slot=slot, day=day: send_khatma_reminder(chat_id, slot=slot, prepared=prepared, day=day, batch=batch),
+            1, priority
+        ))
+    
+    return jobs
+
+def commit_deliveries(sent, failed):
+    with persist_seconds.time("save"):
+        store.commit_deliveries(groups_data, sent, failed)
+
+def run_jobs(label, jobs):
+    """
+    تسجيل الإرسالات (Delivery) في صندوق الإرسال ثم إرسال ما لم يُؤكد منها عبر الموزع؛
+    التأكيدات وتقدم المحادثات تُكتب كل OUTBOX_COMMIT_EVERY إرسال، والأخطاء تصل المشرف في رسالة واحدة
+    """
+    batch = DeliveryBatch(store.claim_deliveries, commit_deliveries, OUTBOX_COMMIT_EVERY)
+    pending = batch.claim(jobs)
+
+    def on_error(chat_id, error):
+        handle_delivery_error(chat_id, error)
+        batch.fail_chat(chat_id, error)
+
+    stats = dispatcher.run([delivery.job(batch) for delivery in pending], on_error=on_error)
+    batch.commit()
+    # المحادثات التي حُذفت أثناء الإرسال (طرد البوت) تُحذف من القاعدة هنا
+    save_data([delivery.chat_id for delivery in pending])
+    stats["already_sent"] = batch.already_sent
+    slot_drain_seconds.observe(stats['drain_seconds'])
+    for result in ("sent", "failed", "skipped", "rate_limited", "already_sent"):
+        slot_deliveries.inc(result, amount=stats[result])
+    outbox_commits.inc(amount=batch.commits)
+    print(
+        f"{label} drained in {stats['drain_seconds']:.1f}s: "
+        f"{stats['sent']} sent, {stats['failed']} failed, {stats['skipped']} skipped, "
+        f"{stats['rate_limited']} rate limited, {stats['already_sent']} already sent, "
+        f"{stats['follow_ups']} follow-ups ({stats['follow_ups_failed']} failed), "
+        f"{batch.commits} commits ({stats['messages_per_second']:.1f} jobs/s)"
+    )
+    summary = batch.summary(label)
+    if summary is not None:
         try:
-            now = datetime.now().strftime("%H:%M")
-            today = datetime.now().strftime("%d/%m/%Y")
+            bot.send_message(ADMIN_ID, summary)
+        except Exception as e:
+            print(f"Error sending delivery summary: {e}")
+    return stats
+
+def run_slot(boundary, jobs=None):
+    """ إرسال المهام المجهزة (أو تجهيزها الآن) لوقت واحد """
+    if jobs is None:
+        jobs = build_slot_jobs(boundary)
+    if not jobs:
+        return None
+    return run_jobs(f"Slot {boundary:%H:%M} UTC", jobs)
+
+def build_catchup_jobs(since, now):
+    """
+    الإرسال الفائت في الفترة (since, now]: لكل محادثة ونوع يؤخذ آخر وقت مستحق فقط،
+    ويُرسل إذا لم يصل إرسال في يومه المحلي؛ الأقدم له أولوية عند الموزع
+    """
+    jobs = []
+    seen = set()
+    # من الأحدث إلى الأقدم حتى لا يُرسل عن يوم أقدم لمحادثة وصلها إرسال أحدث
+    for boundary in reversed(slot_index.boundaries_between(since, now)):
+        jobs.extend(build_slot_jobs(boundary, seen, priority=boundary.timestamp()))
+    return jobs
+
+def run_catchup(since, now):
+    jobs = build_catchup_jobs(since, now)
+    if not jobs:
+        return None
+    print(f"Catching up {len(jobs)} missed deliveries since {since:%d/%m %H:%M} UTC")
+    catchup_deliveries.inc(amount=len(jobs))
+    return run_jobs("Catch-up", jobs)
+
+def scheduler(stop=None):
+    """
+    كل الحسابات هنا بتوقيت UTC؛ فهرس الأوقات يحمل مسبقاً دقيقة UTC لكل وقت محلي
+    يعمل حتى يُضبط stop، ودفعة الإرسال الجارية تكتمل قبل الخروج
+    """
+    stop = stop or threading.Event()
+    # عند التشغيل: تعويض ما فات خلال مدة التعويض (أو الوقت الذي بدأ قبل أقل من دقيقة فقط)
+    last_boundary = utc_now() - timedelta(minutes=max(CATCHUP_MAX_AGE_MINUTES, 1))
+    prefetch_seconds = PREFETCH_MINUTES * 60
+    prepared = None
+    while not stop.is_set():
+        try:
+            now = utc_now()
+            if slot_index.refresh_offsets(now):
+                print("Time zone offsets changed, slot index rebuilt")
+            boundary = slot_index.next_boundary(last_boundary)
+            if boundary is None:
+                stop.wait(60)
+                continue
+            remaining = (boundary - now).total_seconds()
+            if remaining < -60:
+                # فات أكثر من وقت (توقف البوت أو انشغل المجدول بإرسال طويل): تعويض دفعة واحدة
+                since = max(last_boundary, now - timedelta(minutes=CATCHUP_MAX_AGE_MINUTES))
+                last_boundary, prepared = now, None
+                if CATCHUP_MAX_AGE_MINUTES > 0:
+                    run_catchup(since, now)
+                continue
+            if remaining > prefetch_seconds:
+                # النوم حتى موعد التجهيز أو تغير التوقيت الصيفي (مع إعادة الحساب كل دقيقة لالتقاط الأوقات الجديدة)
+                wait = min(remaining - prefetch_seconds, 60)
+                rebuild = slot_index.next_rebuild()
+                if rebuild is not None:
+                    wait = min(wait, max((rebuild - now).total_seconds(), 0))
+                stop.wait(wait)
+                continue
             
-            for chat_id, data in list(groups_data.items()):
-                try:
-                    # إرسال الصور
-                    if (data.get("images_active", False) and 
-                        now in data.get("image_times", []) and 
-                        data.get("last_image_sent") != today):
-                        if send_quran_pages(chat_id):
-                            data["last_image_sent"] = today
-                    
-                    # إرسال الختمة
-                    if (data.get("khatma_active", False) and 
-                        now in data.get("khatma_times", []) and 
-                        data.get("last_khatma_sent") != today):
-                        if send_khatma_reminder(chat_id):
-                            data["last_khatma_sent"] = today
-                    
-                    save_data()
-                        
-                except Exception as e:
-                    print(f"Error in chat {chat_id}: {e}")
-                    if "Forbidden" in str(e):  # إذا تم طرد البوت من المجموعة
-                        del groups_data[chat_id]
-                        save_data()
+            # مرحلة التجهيز المسبق قبل بداية الوقت
+            if prepared is None or prepared[:2] != (boundary, slot_index.version):
+                started = time.monotonic()
+                # seen: المحادثات المجهزة، حتى تُضاف عند بداية الوقت فقط التي فُعلت أوقاتها بعد التجهيز
+                seen = set()
+                prepared = (boundary, slot_index.version, build_slot_jobs(boundary, seen), seen)
+                slot_prepare_seconds.observe(time.monotonic() - started)
+                print(f"Prepared {len(prepared[2])} deliveries for {boundary:%H:%M} UTC in {time.monotonic() - started:.2f}s")
+                continue
             
-            time.sleep(30)  # التحقق كل 30 ثانية
+            if remaining > 0:
+                stop.wait(remaining)
+                continue
+            
+            last_boundary = boundary
+            jobs = prepared[2] + build_slot_jobs(boundary, prepared[3])
+            prepared = None
+            scheduler_lag.observe((utc_now() - boundary).total_seconds())
+            run_slot(boundary, jobs)
             
         except Exception as e:
             print(f"Critical error in scheduler: {e}")
             bot.send_message(ADMIN_ID, f"🚨 البوت تعطل: {str(e)}")
-            time.sleep(60)
+            stop.wait(60)
             
+# ========== البث للمجموعات ==========
+def report_broadcast(state, messages_per_second, finished):
+    """ رسالة تقدم واحدة عند المشرف تُعدل أثناء البث """
+    if not finished:
+        title = "📣 جاري البث"
+    elif state.get("cancelled"):
+        title = "⛔ تم إلغاء البث"
+    else:
+        title = "✅ اكتمل البث"
+    percent = state["done"] / state["total"] if state["total"] else 1.0
+    text = (
+        f"{title} ({state['filter']})\n"
+        f"التقدم: {state['done']} من {state['total']} ({percent:.0%})\n"
+        f"أُرسلت: {state['sent']} | فشلت: {state['failed']} | محذوفة: {state['pruned']} | متخطاة: {state['skipped']}\n"
+        f"السرعة: {messages_per_second:.1f} رسالة/ث"
+    )
+    if state["progress_message_id"] is None:
+        state["progress_message_id"] = bot.send_message(state["report_chat_id"], text).message_id
+    else:
+        bot.edit_message_text(text, state["report_chat_id"], state["progress_message_id"])
+
+broadcaster = Broadcaster(
+    store,
+    dispatcher,
+    send=lambda chat_id, content: send_content(bot, chat_id, content),
+    is_target=lambda chat_id: chat_id in groups_data,
+    after_chunk=save_data,
+    on_progress=report_broadcast
+)
+
+@bot.message_handler(commands=['broadcast'])
+def start_broadcast(message):
+    try:
+        if not is_bot_owner(message):
+            return
+        args = message.text.split()
+        filter_name = args[1] if len(args) > 1 else "all"
+        if filter_name not in FILTERS or message.reply_to_message is None:
+            bot.reply_to(
+                message,
+                "↩️ أرسل الأمر رداً على الرسالة المراد بثها:\n"
+                "/broadcast all - كل المجموعات\n"
+                "/broadcast images - المجموعات المفعل فيها إرسال الصور\n"
+                "/broadcast khatma - المجموعات المفعل فيها تذكير الختمة"
+            )
+            return
+        content = message_content(message.reply_to_message)
+        if content is None:
+            bot.reply_to(message, "⚠️ نوع الرسالة غير مدعوم للبث")
+            return
+        chat_ids = [chat_id for chat_id, data in store.iter_groups() if FILTERS[filter_name](data)]
+        if not broadcaster.start(content, filter_name, chat_ids, message.chat.id):
+            bot.reply_to(message, "⚠️ يوجد بث لم يكتمل بعد. استخدم /broadcast_status أو /broadcast_cancel")
+            return
+        bot.reply_to(message, f"📣 بدأ البث إلى {len(chat_ids)} مجموعة")
+    except Exception as e:
+        print(f"Error in broadcast: {e}")
+
+@bot.message_handler(commands=['broadcast_status'])
+def broadcast_status(message):
+    try:
+        if not is_bot_owner(message):
+            return
+        state = broadcaster.state()
+        if state is None:
+            bot.reply_to(message, "لا يوجد بث جارٍ")
+        else:
+            bot.reply_to(message, f"📣 البث ({state['filter']}): {state['done']} من {state['total']}، أُرسلت {state['sent']}")
+    except Exception as e:
+        print(f"Error in broadcast_status: {e}")
+
+@bot.message_handler(commands=['broadcast_cancel'])
+def broadcast_cancel(message):
+    try:
+        if not is_bot_owner(message):
+            return
+        broadcaster.cancel()
+        bot.reply_to(message, "⛔ سيتوقف البث بعد الدفعة الحالية")
+    except Exception as e:
+        print(f"Error in broadcast_cancel: {e}")
+
+def instrument_handlers():
+    """ تغليف كل معالجات التحديثات المسجلة بقياس زمن تنفيذها حسب اسم الدالة """
+    for handlers in (bot.message_handlers, bot.callback_query_handlers, bot.my_chat_member_handlers):
+        for handler in handlers:
+            function = handler["function"]
+            handler["function"] = handler_seconds.time(function.__name__)(function)
+
+def start_metrics_server(port):
+    """ تطبيق Flask لمسار /metrics فقط، عندما لا يعمل وضع الـ webhook """
+    import web_server
+    threading.Thread(
+        target=web_server.app.run,
+        kwargs={"host": METRICS_HOST, "port": port},
+        daemon=True
+    ).start()
+
+# ========== تشغيل المكونات تحت المشرف ==========
+# وحدة web_server في وضع الـ webhook (None في الاستطلاع)
+webhook_server = None
+
+def run_polling(stop):
+    """
+    الاستطلاع حتى stop_polling؛ أي خطأ من Bot API (مثل 409 عند وجود عملية أخرى تستطلع)
+    يُنهيه بدلاً من إعادة المحاولة داخله، فيعيد المشرف تشغيله بانتظار متزايد
+    """
+    if not stop.is_set():
+        bot.polling(non_stop=False, timeout=30, long_polling_timeout=20, allowed_updates=ALLOWED_UPDATES)
+
+def follow_config(stop):
+    """ متابعة تغييرات الإعدادات في العامل، من آخر تغيير طُبق قبل أي إعادة تشغيل """
+    global config_seq
+    config_seq = follow_changes(store, config_seq, is_my_chat, reload_group, stop=stop)
+
+def reload_state():
+    """
+    بعد الانتظار احتياطياً أو فقد القيادة: ما في الذاكرة أقدم مما كتبته العملية النشطة في القاعدة،
+    فيُعاد تحميل كل شيء (المعالجات والمجدول متوقفة في هذه اللحظة)
+    """
+    global groups_data, khatma_data, conversations, slot_index, config_seq
+    store.reset_cache()
+    config_seq = store.last_change_seq()
+    groups_data = GroupTable(store, GROUP_CACHE_SIZE)
+    khatma_data = CollectiveKhatmas(load_khatma_data())
+    conversations = ConversationStore(store, CONVERSATION_TTL, CONVERSATION_LIMIT)
+    slot_index = SlotIndex(DEFAULT_TIMEZONE)
+    if BOT_ROLE != "ingress":
+        load_schedule()
+
+def start_webhook():
+    """ تفعيل الـ webhook وتشغيل عمال التحديثات؛ فقط بعد أخذ القيادة حتى لا تعالج العملية الاحتياطية شيئاً """
+    try:
+        bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + webhook_server.WEBHOOK_PATH,
+            secret_token=webhook_server.WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    except Exception as e:
+        # العمال يعملون على أي حال لتحديثات webhook مسجل من قبل بنفس الرابط
+        print(f"Error setting webhook: {e}")
+    webhook_server.start_webhook_workers(bot)
+
+def start_components(takeover):
+    if takeover:
+        print("Took over as the active process, reloading state")
+        reload_state()
+    if webhook_server is not None:
+        start_webhook()
+    if BOT_ROLE != "worker":
+        # متابعة بث لم يكتمل قبل إعادة التشغيل أو قبل توقف العملية النشطة السابقة
+        resumed = broadcaster.resume()
+        if resumed is not None:
+            print(f"Resuming broadcast at {resumed['done']}/{resumed['total']}")
+
+def stop_components():
+    """ بعد إيقاف الاستطلاع والمجدول: إيقاف عمال الـ webhook والبث مؤقتاً وحفظ كل ما بقي في الذاكرة """
+    if webhook_server is not None:
+        # قبل أي إعادة تحميل للحالة، فلا يعمل معالج على جداول استُبدلت
+        webhook_server.stop_webhook_workers(DRAIN_TIMEOUT)
+    if BOT_ROLE != "worker":
+        broadcaster.pause(DRAIN_TIMEOUT)
+    time_keyboards.flush_all()
+    collective_keyboards.flush_all()
+    save_data()
+    save_khatma_data()
+
+def build_supervisor(polling=True):
+    """
+    المكونات حسب الدور: المجدول في التشغيل العادي وفي العمال، والاستطلاع في عملية الاستقبال؛
+    كل مكون في خيط واحد فقط مهما تكرر توقفه
+    """
+    lease = None
+    if LEASE_TTL > 0:
+        lease = Lease(store, f"worker-{SHARD_INDEX}" if BOT_ROLE == "worker" else "bot", LEASE_TTL)
+    supervisor = Supervisor(lease, DRAIN_TIMEOUT, on_start=start_components, on_stop=stop_components)
+    if BOT_ROLE in ("all", "worker"):
+        supervisor.add("scheduler", scheduler)
+    if BOT_ROLE == "worker":
+        supervisor.add("config-follower", follow_config)
+    elif polling:
+        supervisor.add("polling", run_polling, stop_hook=bot.stop_polling)
+    metrics.Gauge("supervisor_active", "1 while this process holds the lease and runs its components",
+                  func=lambda: int(supervisor.active))
+    metrics.Counter("supervisor_restarts_total", "Component restarts after a crash or stop", func=lambda: supervisor.restarts)
+    return supervisor
+
+def run_supervised(supervisor):
+    """ تشغيل المشرف حتى SIGTERM/SIGINT، ثم انتظار الإرسال الجاري وترك القيادة """
+    signal.signal(signal.SIGTERM, supervisor.shutdown)
+    signal.signal(signal.SIGINT, supervisor.shutdown)
+    supervisor.run()
+    print("Stopped")
+
+def run_worker():
+    """ عامل التشغيل المقسم: إرسال مجدول لمحادثات جزئه فقط بدون استقبال تحديثات """
+    print(f"Worker {SHARD_INDEX}/{SHARD_COUNT} started")
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + 1 + SHARD_INDEX)
+    run_supervised(build_supervisor())
+
+def run_webhook():
+    """
+    استقبال التحديثات عبر تطبيق Flask في web_server.py؛ يرجع False إذا لم يُضبط WEBHOOK_SECRET
+    تفعيل الـ webhook وعمال التحديثات في start_components بعد أخذ القيادة، وحتى ذلك يرد المسار بـ 503
+    """
+    global webhook_server
+    import web_server
+    if not web_server.WEBHOOK_SECRET:
+        print("WEBHOOK_SECRET is not set, falling back to polling")
+        return False
+    webhook_server = web_server
+    # Flask في خيط جانبي والمشرف في الخيط الرئيسي حتى تصل إليه إشارات الإيقاف
+    threading.Thread(
+        target=web_server.app.run,
+        kwargs={"host": "0.0.0.0", "port": WEB_PORT},
+        daemon=True
+    ).start()
+    run_supervised(build_supervisor(polling=False))
+    return True
+
+instrument_handlers()
+
 if __name__ == "__main__":
-    # حل نهائي لمشكلة التوكن المكرر
-    from telebot import apihelper
-    apihelper.SESSION_TIME_TO_LIVE = 60
+    if BOT_ROLE == "worker":
+        run_worker()
+        raise SystemExit
     
-    # بدء البوت مع التعامل مع الأخطاء
-    while True:
-        try:
-            # بدء الجدولة في خيط منفصل
-            threading.Thread(target=scheduler, daemon=True).start()
-            bot.infinity_polling(timeout=30, long_polling_timeout=20)
-        except Exception as e:
-            print(f"Polling error: {e}")
-            time.sleep(15)
+    if BOT_ROLE == "ingress":
+        store.prune_changes()
+        if SPAWN_WORKERS:
+            workers = spawn_workers(os.path.abspath(__file__), SHARD_COUNT, GLOBAL_RATE_PER_SECOND)
+            # العمال ينهون الإرسال الجاري قبل الخروج
+            atexit.register(stop_workers, workers, DRAIN_TIMEOUT + 10)
+    
+    # جلب بيانات البوت مرة واحدة عند التشغيل
+    try:
+        get_bot_info()
+    except Exception as e:
+        print(f"Error fetching bot info: {e}")
+    
+    if WEBHOOK_URL and run_webhook():
+        raise SystemExit
+    
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    
+    # الاستطلاع يتطلب حذف أي webhook سابق
+    try:
+        bot.remove_webhook()
+    except Exception as e:
+        print(f"Error removing webhook: {e}")
+    
+    # الاستطلاع والجدولة تحت المشرف: كل منهما في خيط واحد يُعاد تشغيله وحده عند توقفه
+    run_supervised(build_supervisor())
@@ -0,0 +1,179 @@
+"""
+بث رسالة واحدة من المشرف العام إلى كل المجموعات أو إلى جزء منها
+قائمة الأهداف وموضع التقدم يُحفظان في القاعدة بعد كل دفعة، فيُستأنف البث بعد أي انقطاع من حيث توقف
+"""
+import threading
+import time
+
+from file_id_cache import largest_photo_id
+
+# المرشحات المتاحة: اسمها ← هل المجموعة مشمولة
+FILTERS = {
+    "all": lambda data: True,
+    "images": lambda data: data.images_active,
+    "khatma": lambda data: data.khatma_active,
+}
+
+MEDIA_TYPES = ("photo", "video", "animation", "document", "audio", "voice")
+
+
+def message_content(message):
+    """
+    محتوى الرسالة للبث: النص بتنسيق HTML، أو file_id الوسائط المرفوعة مسبقاً مع التعليق
+    حتى تُرسل الوسائط لكل المجموعات دون إعادة رفعها؛ None لأي نوع غير مدعوم
+    """
+    if message.content_type == "text":
+        return {"type": "text", "text": message.html_text}
+    if message.content_type not in MEDIA_TYPES:
+        return None
+    if message.content_type == "photo":
+        file_id = largest_photo_id(message)
+    else:
+        file_id = getattr(message, message.content_type).file_id
+    return {"type": message.content_type, "file_id": file_id, "caption": message.html_caption}
+
+
+def send_content(bot, chat_id, content):
+    if content["type"] == "text":
+        return bot.send_message(chat_id, content["text"], parse_mode="HTML")
+    sender = getattr(bot, f"send_{content['type']}")
+    return sender(chat_id, content["file_id"], caption=content.get("caption"), parse_mode="HTML")
+
+
+class Broadcaster:
+    """
+    بث واحد في كل مرة على دفعات عبر الموزع المشترك (بنفس حدود المعدل)
+    send(chat_id, content): الإرسال لمجموعة واحدة
+    is_target(chat_id): هل المجموعة ما زالت موجودة (تُتخطى المحذوفة، وتُحسب المحذوفة أثناء الدفعة بسبب Forbidden)
+    after_chunk(chat_ids): يُستدعى بعد كل دفعة لحفظ التغييرات
+    on_progress(state, messages_per_second, finished): لعرض التقدم
+    """
+
+    def __init__(self, store, dispatcher, send, is_target, after_chunk=None, on_progress=None,
+                 chunk_size=200, progress_interval=3):
+        self.store = store
+        self.dispatcher = dispatcher
+        self.send = send
+        self.is_target = is_target
+        self.after_chunk = after_chunk
+        self.on_progress = on_progress
+        # الانقطاع وسط دفعة قد يعيد إرسال هذه الدفعة فقط بعد الاستئناف
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.running = False
+        self.cancelled = False
+        self.paused = False
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def state(self):
+        return self.store.load_broadcast()
+
+    def start(self, content, filter_name, chat_ids, report_chat_id):
+        """ بدء بث جديد في خيط منفصل؛ يرجع False إذا كان هناك بث لم ينته """
+        with self.lock:
+            if self.running or self.store.load_broadcast() is not None:
+                return False
+            state = {
+                "content": content,
+                "filter": filter_name,
+                "report_chat_id": report_chat_id,
+                "progress_message_id": None,
+                "total": len(chat_ids),
+                "cursor": 0,
+                "done": 0,
+                "sent": 0,
+                "failed": 0,
+                "skipped": 0,
+                "pruned": 0,
+            }
+            self.store.begin_broadcast(state, sorted(chat_ids))
+            self._spawn(state)
+            return True
+
+    def resume(self):
+        """ متابعة بث محفوظ لم يكتمل (عند التشغيل)؛ يرجع حالته أو None """
+        with self.lock:
+            state = self.store.load_broadcast()
+            if state is None or self.running:
+                return None
+            self._spawn(state)
+            return state
+
+    def cancel(self):
+        with self.lock:
+            if self.running:
+                self.cancelled = True
+            else:
+                self.store.end_broadcast()
+
+    def pause(self, timeout=None):
+        """ إيقاف البث بعد الدفعة الحالية مع إبقاء نقطة الاستئناف (عند إيقاف العملية أو فقد القيادة) """
+        with self.lock:
+            if self.running:
+                self.paused = True
+        return self.idle.wait(timeout)
+
+    def _spawn(self, state):
+        self.running = True
+        self.cancelled = False
+        self.paused = False
+        self.idle.clear()
+        threading.Thread(target=self._run, args=(state,), daemon=True).start()
+
+    def _report(self, state, started, sent_before, finished):
+        if self.on_progress is None:
+            return
+        elapsed = time.monotonic() - started
+        rate = (state["sent"] - sent_before) / elapsed if elapsed else 0.0
+        try:
+            self.on_progress(state, rate, finished)
+        except Exception as e:
+            print(f"Error reporting broadcast progress: {e}")
+
+    def _run(self, state):
+        started = time.monotonic()
+        sent_before = state["sent"]
+        last_report = 0.0
+        content = state["content"]
+        try:
+            while not self.cancelled and not self.paused:
+                batch = self.store.broadcast_targets(state["cursor"], self.chunk_size)
+                if not batch:
+                    break
+                chat_ids = [chat_id for _, chat_id in batch if self.is_target(chat_id)]
+                stats = self.dispatcher.run([
+                    (chat_id, lambda chat_id=chat_id: self.send(chat_id, content), 1)
+                    for chat_id in chat_ids
+                ])
+                if self.after_chunk:
+                    self.after_chunk(chat_ids)
+                state["cursor"] = batch[-1][0]
+                state["done"] += len(batch)
+                state["sent"] += stats["sent"]
+                state["failed"] += stats["failed"]
+                state["skipped"] += len(batch) - len(chat_ids)
+                state["pruned"] += sum(1 for chat_id in chat_ids if not self.is_target(chat_id))
+                self.store.save_broadcast(state)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    self._report(state, started, sent_before, False)
+        except Exception as e:
+            # تبقى نقطة الاستئناف محفوظة ليكمل البث عند التشغيل التالي
+            print(f"Broadcast stopped: {e}")
+            self._stopped()
+            return
+        if self.paused and not self.cancelled:
+            print(f"Broadcast paused at {state['done']}/{state['total']}")
+            self._stopped()
+            return
+        state["cancelled"] = self.cancelled
+        self.store.end_broadcast()
+        self._stopped()
+        self._report(state, started, sent_before, True)
+
+    def _stopped(self):
+        with self.lock:
+            self.running = False
+        self.idle.set()
@@ -0,0 +1,178 @@
+"""
+الختمة الجماعية: أعضاء المجموعة يحجزون الأجزاء من لوحة أزرار ثم يعلّمونها عند الانتهاء
+الأجزاء المحجوزة والمكتملة عددان من 30 بت لكل ختمة، فالحجز والإتمام عملية بت واحدة تحت قفل المحادثة،
+والمحفوظ لكل ختمة بضعة أرقام فقط (مع صاحب كل جزء محجوز)
+"""
+import threading
+
+from group_state import PrecomputedMarkup
+
+JUZ_COUNT = 30
+ALL_JUZ = (1 << JUZ_COUNT) - 1
+
+# نتيجة الضغط على جزء
+CLAIMED = "claimed"
+COMPLETED = "completed"
+FINISHED = "finished"
+TAKEN = "taken"
+ALREADY_DONE = "already_done"
+STALE = "stale"
+
+# النتائج التي تغير الحالة (فتُعدَّل اللوحة وتُحفظ)
+CHANGED = (CLAIMED, COMPLETED, FINISHED)
+
+
+class KhatmaState:
+    """
+    ختمة جماعية واحدة: رقمها، والأجزاء المحجوزة والمكتملة كبتات، وصاحب كل جزء محجوز
+    ended: ختمة أنهاها المشرف؛ تبقى برقمها فقط حتى تأخذ الختمة التالية رقماً جديداً
+    """
+    __slots__ = ("number", "claimed", "completed", "owners", "ended")
+
+    def __init__(self, number=1, claimed=0, completed=0, owners=None, ended=False):
+        self.number = number
+        self.claimed = claimed
+        self.completed = completed
+        # رقم الجزء ← user_id لمن حجزه
+        self.owners = owners or {}
+        self.ended = ended
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            number=data["n"],
+            claimed=data.get("c", 0),
+            completed=data.get("d", 0),
+            owners={int(juz): user_id for juz, user_id in data.get("o", {}).items()},
+            ended=bool(data.get("e")),
+        )
+
+    def to_dict(self):
+        if self.ended:
+            return {"n": self.number, "e": 1}
+        return {"n": self.number, "c": self.claimed, "d": self.completed, "o": dict(self.owners)}
+
+    @property
+    def finished(self):
+        return self.completed == ALL_JUZ
+
+    @property
+    def active(self):
+        return not self.ended and not self.finished
+
+    def press(self, juz, user_id):
+        """ جزء حر يُحجز لمن ضغط، وضغط صاحبه عليه مرة أخرى يعني إتمامه """
+        bit = 1 << (juz - 1)
+        if self.completed & bit:
+            return ALREADY_DONE
+        if not self.claimed & bit:
+            self.claimed |= bit
+            self.owners[juz] = user_id
+            return CLAIMED
+        if self.owners.get(juz) != user_id:
+            return TAKEN
+        self.completed |= bit
+        return FINISHED if self.finished else COMPLETED
+
+
+def render_keyboard(state):
+    """ 30 زراً في صفوف من 5 مع سطر للتقدم؛ تُبنى كنص JSON مباشرة لأنها تُعاد بعد كل دفعة ضغطات """
+    rows = []
+    for start in range(1, JUZ_COUNT + 1, 5):
+        buttons = []
+        for juz in range(start, start + 5):
+            bit = 1 << (juz - 1)
+            mark = " ✅" if state.completed & bit else " 📖" if state.claimed & bit else ""
+            buttons.append(f'{{"text":"{juz}{mark}","callback_data":"ck_{state.number}_{juz}"}}')
+        rows.append("[" + ",".join(buttons) + "]")
+    done = bin(state.completed).count("1")
+    reading = bin(state.claimed & ~state.completed).count("1")
+    rows.append(f'[{{"text":"✅ {done}/30 | 📖 {reading}","callback_data":"ck_info"}}]')
+    return PrecomputedMarkup('{"inline_keyboard":[' + ",".join(rows) + "]}")
+
+
+class CollectiveKhatmas:
+    """
+    chat_id ← KhatmaState لكل المجموعات، من قاموس khatma المحفوظ في القاعدة
+    القيم التي ليست بتنسيق الختمة الجماعية (من ملف JSON قديم) تُترك كما هي
+    """
+
+    def __init__(self, data, stripes=64):
+        self.states = {}
+        self.other = {}
+        for key, value in data.items():
+            if isinstance(value, dict) and "n" in value:
+                self.states[key] = KhatmaState.from_dict(value)
+            else:
+                self.other[key] = value
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def lock(self, chat_id):
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+    def get(self, chat_id):
+        """ آخر ختمة للمجموعة (جارية أو مكتملة)، أو None إذا لم توجد أو أنهاها المشرف """
+        state = self.states.get(chat_id)
+        return None if state is None or state.ended else state
+
+    def start(self, chat_id):
+        """ بدء ختمة جديدة إذا لم توجد ختمة جارية؛ يرجع (الحالة، هل بدأت الآن) """
+        with self.lock(chat_id):
+            state = self.states.get(chat_id)
+            if state is not None and state.active:
+                return state, False
+            # الرقم يستمر بعد الختمات المنتهية، فلا تعمل أزرار لوحة قديمة على الختمة الجديدة
+            state = self.states[chat_id] = KhatmaState(number=state.number + 1 if state else 1)
+            return state, True
+
+    def end(self, chat_id):
+        """ إنهاء الختمة مع إبقاء رقمها؛ يرجع الختمة المنتهية أو None إذا لم توجد """
+        with self.lock(chat_id):
+            state = self.states.get(chat_id)
+            if state is None or state.ended:
+                return None
+            self.states[chat_id] = KhatmaState(number=state.number, ended=True)
+            return state
+
+    def replace(self, chat_id, value):
+        """ استبدال الحالة بما قرأته عملية أخرى من القاعدة (None للحذف) """
+        with self.lock(chat_id):
+            if value is None:
+                self.states.pop(chat_id, None)
+            else:
+                self.states[chat_id] = KhatmaState.from_dict(value)
+
+    def press(self, chat_id, number, juz, user_id):
+        """ نتيجة الضغط (CHANGED تعني أن الحالة تغيرت وتحتاج اللوحة تعديلاً والحالة حفظاً) """
+        if not 1 <= juz <= JUZ_COUNT:
+            return STALE
+        with self.lock(chat_id):
+            state = self.states.get(chat_id)
+            if state is None or state.ended or state.number != number:
+                return STALE
+            return state.press(juz, user_id)
+
+    def keyboard(self, chat_id, number=None):
+        """ لوحة الختمة الجارية للمجموعة، أو None إذا لم توجد أو اكتملت (أو لم تعد الختمة number) """
+        with self.lock(chat_id):
+            state = self.states.get(chat_id)
+            if state is None or not state.active or number not in (None, state.number):
+                return None
+            return render_keyboard(state)
+
+    def snapshot(self, chat_ids=None):
+        """ القيم المحفوظة (للكل أو للمحادثات المحددة) كقواميس منسوخة تحت أقفالها """
+        if chat_ids is None:
+            snapshot = dict(self.other)
+            chat_ids = list(self.states)
+        else:
+            snapshot = {}
+        for chat_id in chat_ids:
+            with self.lock(chat_id):
+                state = self.states.get(chat_id)
+                if state is not None:
+                    snapshot[chat_id] = state.to_dict()
+        return snapshot
+
+    def __len__(self):
+        return len(self.states)
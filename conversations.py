@@ -0,0 +1,71 @@
+"""
+الخطوات المنتظرة من المشرفين (مثل رقم صفحة البدء بعد /set_start_page) بمفتاح (المحادثة، المستخدم)
+حتى لا تُعتبر رسالة عضو آخر في المجموعة رداً؛ لكل خطوة مدة صلاحية والعدد محدود،
+وتُحفظ في القاعدة بجانب بيانات المجموعات فتبقى بعد إعادة التشغيل
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ConversationStore:
+    """
+    (chat_id، user_id) ← (اسم الخطوة، وقت الانتهاء) بترتيب وقت الانتهاء
+    مدة الصلاحية واحدة للجميع، فالأقدم في الترتيب هو الأسبق انتهاءً ويُحذف أولاً عند امتلاء الحد
+    store: يوفر save_conversation و delete_conversation و load_conversations
+    الذاكرة والقاعدة تُعدلان تحت نفس القفل، فلا يقع pop بين الكتابتين فتبقى في القاعدة خطوة حُذفت
+    (وتعود بعد إعادة التشغيل)
+    """
+
+    def __init__(self, store, ttl=600, max_entries=10000):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        for chat_id, user_id, step, expires_at in store.load_conversations(time.time(), max_entries):
+            self.entries[(chat_id, user_id)] = (step, expires_at)
+
+    def _drop_expired(self, now):
+        """ حذف المنتهية من بداية الترتيب؛ يرجع مفاتيحها لحذفها من القاعدة """
+        expired = []
+        while self.entries:
+            key, (_, expires_at) = next(iter(self.entries.items()))
+            if expires_at > now and len(self.entries) <= self.max_entries:
+                break
+            del self.entries[key]
+            expired.append(key)
+        return expired
+
+    def start(self, chat_id, user_id, step):
+        """ انتظار رد المستخدم بالخطوة step (تحل محل أي خطوة سابقة له في نفس المحادثة) """
+        now = time.time()
+        key = (str(chat_id), int(user_id))
+        expires_at = now + self.ttl
+        with self.lock:
+            self.entries[key] = (step, expires_at)
+            self.entries.move_to_end(key)
+            for old_key in self._drop_expired(now):
+                self.store.delete_conversation(*old_key)
+            self.store.save_conversation(key[0], key[1], step, expires_at)
+
+    def get(self, chat_id, user_id):
+        """ اسم الخطوة المنتظرة أو None """
+        with self.lock:
+            entry = self.entries.get((str(chat_id), int(user_id)))
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def pop(self, chat_id, user_id):
+        """ أخذ الخطوة المنتظرة وحذفها (مرة واحدة فقط حتى مع رسالتين متزامنتين) """
+        key = (str(chat_id), int(user_id))
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            self.store.delete_conversation(*key)
+        return entry[0] if entry[1] > time.time() else None
+
+    def __len__(self):
+        return len(self.entries)
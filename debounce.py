@@ -0,0 +1,118 @@
+"""
+تجميع الضغطات المتتالية على أزرار نفس الرسالة: التعديل في الذاكرة يتم فوراً،
+أما تعديل لوحة الأزرار والحفظ فيُنفذان مرة واحدة بعد أن تهدأ الضغطات
+"""
+import threading
+import time
+
+
+class Debouncer:
+    """
+    مفتاح (مثل (chat_id، message_id)) ← عمل مؤجل؛ كل طلب جديد خلال delay يؤجله،
+    ولا يتأخر أكثر من max_delay من أول طلب حتى لا تؤجله الضغطات المستمرة إلى ما لا نهاية
+
+    flush(key, first, last, requests): تُستدعى مرة واحدة بأول وآخر قيمة طُلبت وعدد الطلبات المجمعة
+    لا يُنفذ عملان لنفس المفتاح في نفس الوقت، فلا يسبق تعديلٌ قديم تعديلاً أحدث منه
+    """
+
+    def __init__(self, flush, delay=1.0, max_delay=3.0, workers=2, name="debounce"):
+        self.flush = flush
+        self.delay = delay
+        self.max_delay = max_delay
+        self.workers = workers
+        self.name = name
+        self.lock = threading.Condition()
+        # المفتاح ← [وقت أول طلب، وقت التنفيذ، أول قيمة، آخر قيمة، عدد الطلبات]
+        self.pending = {}
+        self.running = set()
+        self.requests = 0
+        self.flushes = 0
+        # طلبات دُمجت في عمل مؤجل موجود (كل منها تعديل وحفظ لم يُنفذا)
+        self.coalesced = 0
+        self._threads = []
+
+    def touch(self, key, value=None):
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [now, now + self.delay, value, value, 1]
+            else:
+                entry[1] = min(now + self.delay, entry[0] + self.max_delay)
+                entry[3] = value
+                entry[4] += 1
+                self.coalesced += 1
+            if not self._threads:
+                self._start()
+            self.lock.notify()
+
+    def cancel(self, key):
+        """ إلغاء العمل المؤجل للمفتاح (وانتظار تنفيذ جارٍ له)؛ يرجع (أول قيمة، آخر قيمة) أو None """
+        with self.lock:
+            while key in self.running:
+                self.lock.wait()
+            entry = self.pending.pop(key, None)
+        return None if entry is None else (entry[2], entry[3])
+
+    def flush_all(self):
+        """ تنفيذ كل المؤجل الآن (عند الإيقاف) """
+        with self.lock:
+            while self.running:
+                self.lock.wait()
+            entries = list(self.pending.items())
+            self.pending.clear()
+            self.running.update(key for key, _ in entries)
+        for key, entry in entries:
+            self._run(key, entry)
+
+    def _start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_due(self, now):
+        """ مفتاح حان وقته ولا يُنفذ الآن، أو (None، مدة الانتظار حتى أقرب موعد) """
+        wait = None
+        for key, entry in self.pending.items():
+            if key in self.running:
+                continue
+            if entry[1] <= now:
+                return key, None
+            wait = entry[1] - now if wait is None else min(wait, entry[1] - now)
+        return None, wait
+
+    def _loop(self):
+        while True:
+            with self.lock:
+                key, wait = self._next_due(time.monotonic())
+                if key is None:
+                    self.lock.wait(wait)
+                    continue
+                entry = self.pending.pop(key)
+                self.running.add(key)
+            self._run(key, entry)
+
+    def _run(self, key, entry):
+        try:
+            self.flush(key, entry[2], entry[3], entry[4])
+        except Exception as e:
+            print(f"Error in {self.name} flush for {key}: {e}")
+        finally:
+            with self.lock:
+                self.flushes += 1
+                self.running.discard(key)
+                self.lock.notify_all()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "pending": len(self.pending),
+                "requests": self.requests,
+                "flushes": self.flushes,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,209 @@
+"""
+موزع الإرسال: عدد محدود من العمال مع حدود معدل عامة ولكل محادثة
+واحترام retry_after عند خطأ 429 من تيليجرام دون إيقاف باقي المحادثات
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+
+def retry_after_seconds(error):
+    """ مدة الانتظار التي طلبها تيليجرام في خطأ 429، أو None لأي خطأ آخر """
+    if not isinstance(error, ApiTelegramException) or error.error_code != 429:
+        return None
+    parameters = (error.result_json or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+class TokenBucket:
+    """ دلو رموز: rate رمز في الثانية بسعة capacity """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost, now):
+        """ سحب cost رمزاً وإرجاع 0، أو إرجاع مدة الانتظار اللازمة دون سحب شيء """
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Job:
+    __slots__ = ("chat_id", "func", "cost", "priority", "attempts", "follow_up")
+
+    def __init__(self, chat_id, func, cost, priority=0, follow_up=False):
+        self.chat_id = chat_id
+        self.func = func
+        self.cost = cost
+        # الأصغر أولاً بين المهام الجاهزة في نفس اللحظة
+        self.priority = priority
+        self.attempts = 0
+        # أضافتها مهمة أخرى أثناء الدفعة (follow_up)، فتُحسب وحدها في الإحصائيات
+        self.follow_up = follow_up
+
+
+class Dispatcher:
+    """ تنفيذ دفعات من مهام الإرسال بالتوازي تحت حدود المعدل """
+
+    def __init__(self, workers=8, global_rate=30, chat_rate_per_minute=20, max_attempts=5, on_error=None):
+        self.workers = workers
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate_per_minute / 60.0
+        self.chat_capacity = chat_rate_per_minute
+        self.chat_buckets = {}
+        self.max_attempts = max_attempts
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.batch_lock = threading.Lock()
+        # عدد مهام الدفعة الحالية التي لم تنته بعد (للمراقبة)
+        self.queue_depth = 0
+        # إضافة مهمة إلى الدفعة الجارية (None خارج run)
+        self._submit = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_capacity)
+        return bucket
+
+    def _prune_buckets(self):
+        # الدلاء الممتلئة لا تحمل أي معلومة، فحذفها يبقي الذاكرة بحجم المحادثات النشطة فقط
+        now = time.monotonic()
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_full(now)]:
+            del self.chat_buckets[chat_id]
+
+    def _reserve(self, job, now):
+        """ 0 إذا سُمح بالإرسال الآن، وإلا مدة الانتظار قبل المحاولة مجدداً """
+        with self.lock:
+            chat_bucket = self._chat_bucket(job.chat_id)
+            wait = chat_bucket.reserve(job.cost, now)
+            if wait:
+                return wait
+            wait = self.global_bucket.reserve(job.cost, now)
+            if wait:
+                # إعادة رموز المحادثة لأن الرسالة لم تُرسل بعد
+                chat_bucket.tokens = min(chat_bucket.capacity, chat_bucket.tokens + job.cost)
+            return wait
+
+    def follow_up(self, chat_id, func, cost=1, priority=0):
+        """
+        إضافة مهمة إلى الدفعة الجارية (مثل رسالة تالية لإرسال تم) فتأخذ حصتها من حدود المعدل وتُعاد بعد 429؛
+        يرجع False إذا لم تكن هناك دفعة جارية، فيرسلها المستدعي بنفسه
+        """
+        submit = self._submit
+        return submit is not None and submit(Job(chat_id, func, cost, priority, follow_up=True))
+
+    def run(self, jobs, on_error=None):
+        """
+        تنفيذ المهام (chat_id, func, cost) أو (chat_id, func, cost, priority) حتى تفرغ وإرجاع إحصائيات الدفعة
+        func تُستدعى بدون معاملات، ونتيجتها False تُحسب فشلاً و None تُحسب تخطياً (لا شيء لإرساله)
+        on_error: بدلاً من معالج الأخطاء العام لهذه الدفعة فقط
+        """
+        with self.batch_lock:
+            return self._run(jobs, on_error or self.on_error)
+
+    def _run(self, jobs, on_error):
+        started = time.monotonic()
+        counter = itertools.count()
+        ready = []
+        for job in jobs:
+            job = Job(*job)
+            ready.append((started, job.priority, next(counter), job))
+        heapq.heapify(ready)
+        stats = {"jobs": len(ready), "sent": 0, "failed": 0, "skipped": 0, "rate_limited": 0,
+                 "follow_ups": 0, "follow_ups_failed": 0}
+        pending = [len(ready)]
+        self.queue_depth = pending[0]
+        cond = threading.Condition()
+
+        def submit(job):
+            with cond:
+                # بعد أن يصل العدد إلى صفر يكون العمال قد خرجوا أو يخرجون
+                if pending[0] == 0:
+                    return False
+                pending[0] += 1
+                self.queue_depth = pending[0]
+                heapq.heappush(ready, (time.monotonic(), job.priority, next(counter), job))
+                cond.notify_all()
+                return True
+
+        def finish(job, result):
+            with cond:
+                if job.follow_up:
+                    stats["follow_ups_failed" if result is False else "follow_ups"] += 1
+                else:
+                    stats["failed" if result is False else "skipped" if result is None else "sent"] += 1
+                pending[0] -= 1
+                self.queue_depth = pending[0]
+                cond.notify_all()
+
+        def push_back(job, delay):
+            with cond:
+                heapq.heappush(ready, (time.monotonic() + delay, job.priority, next(counter), job))
+                cond.notify_all()
+
+        def worker():
+            while True:
+                with cond:
+                    while True:
+                        if pending[0] == 0:
+                            return
+                        now = time.monotonic()
+                        if ready and ready[0][0] <= now:
+                            job = heapq.heappop(ready)[-1]
+                            break
+                        cond.wait(ready[0][0] - now if ready else None)
+
+                wait = self._reserve(job, time.monotonic())
+                if wait:
+                    push_back(job, wait)
+                    continue
+
+                job.attempts += 1
+                try:
+                    finish(job, job.func())
+                except Exception as e:
+                    retry_after = retry_after_seconds(e)
+                    if retry_after is not None and job.attempts < self.max_attempts:
+                        with cond:
+                            stats["rate_limited"] += 1
+                        push_back(job, retry_after)
+                        continue
+                    if on_error:
+                        try:
+                            on_error(job.chat_id, e)
+                        except Exception as handler_error:
+                            print(f"Error in dispatcher error handler: {handler_error}")
+                    finish(job, False)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(min(self.workers, len(ready)))]
+        self._submit = submit
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self._submit = None
+
+        with self.lock:
+            self._prune_buckets()
+        stats["drain_seconds"] = time.monotonic() - started
+        stats["messages_per_second"] = stats["sent"] / stats["drain_seconds"] if stats["drain_seconds"] else 0.0
+        return stats
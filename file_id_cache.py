@@ -0,0 +1,120 @@
+"""
+ذاكرة file_id الخاصة بتيليجرام للصور المرفوعة مسبقاً
+حتى لا يعيد تيليجرام تحميل نفس الصورة من مصدرها مع كل إرسال
+"""
+import json
+import os
+import threading
+
+# أوصاف أخطاء Bot API عندما لا يعود الـ file_id المحفوظ صالحاً
+INVALID_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference expired",
+    "file_reference_expired",
+)
+
+
+class FileIdCache:
+    """ ربط مفتاح (مثل رقم الصفحة) بالـ file_id مع حفظ دائم في ملف JSON """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.file_ids = self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, "r", encoding='utf-8') as f:
+                    return json.load(f)
+            return {}
+        except Exception as e:
+            print(f"Error loading file_id cache: {e}")
+            return {}
+
+    def _save(self):
+        # الكتابة في ملف مؤقت ثم الاستبدال حتى لا يتلف الملف عند انقطاع التشغيل
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding='utf-8') as f:
+                json.dump(self.file_ids, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"Error saving file_id cache: {e}")
+
+    def get(self, key, count=True):
+        """ إرجاع الـ file_id المحفوظ أو None مع تحديث عدادات الإصابة (إلا إذا count=False) """
+        with self.lock:
+            file_id = self.file_ids.get(str(key))
+            if count:
+                if file_id:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            return file_id
+
+    def put(self, key, file_id):
+        with self.lock:
+            if self.file_ids.get(str(key)) == file_id:
+                return
+            self.file_ids[str(key)] = file_id
+            self._save()
+
+    def put_many(self, items):
+        """ حفظ عدة مفاتيح بكتابة واحدة للملف """
+        with self.lock:
+            changed = False
+            for key, file_id in items:
+                if file_id and self.file_ids.get(str(key)) != file_id:
+                    self.file_ids[str(key)] = file_id
+                    changed = True
+            if changed:
+                self._save()
+
+    def discard(self, key, file_id=None):
+        """
+        حذف file_id رفضه تيليجرام حتى يُرفع من المصدر مرة أخرى؛ مع file_id لا يُحذف إلا إذا كان هو المحفوظ
+        (فلا يُحذف file_id جديد حفظه إرسال آخر بعد الرفض)؛ يرجع True إذا حُذف
+        """
+        with self.lock:
+            current = self.file_ids.get(str(key))
+            if current is None or file_id not in (None, current):
+                return False
+            del self.file_ids[str(key)]
+            self.invalidated += 1
+            self._save()
+            return True
+
+    def __contains__(self, key):
+        return str(key) in self.file_ids
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.file_ids),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+
+def is_invalid_file_id_error(error):
+    """ هل رفض تيليجرام الـ file_id نفسه (وليس خطأ شبكة أو حدود إرسال) """
+    description = str(getattr(error, "description", None) or error).lower()
+    return any(text in description for text in INVALID_FILE_ID_ERRORS)
+
+
+def largest_photo_id(message):
+    """ file_id لأكبر مقاس من الصورة المرسلة في رسالة تيليجرام """
+    if message is None or not getattr(message, "photo", None):
+        return None
+    return message.photo[-1].file_id
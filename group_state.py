@@ -0,0 +1,332 @@
+"""
+حالة المجموعة في الذاكرة: سجل بـ __slots__ والأوقات المختارة كقناع من 12 بت،
+وجدول السجلات بأقفال لكل محادثة، مع جدول لوحات مفاتيح الأوقات مبني مسبقاً لكل (قناع، بادئة)
+"""
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from telebot import types
+
+# الأوقات المتاحة للاختيار، وترتيبها هو رقم البت في القناع
+AVAILABLE_TIMES = (
+    "01:00", "03:00", "05:00",
+    "07:00", "09:00", "11:00",
+    "13:00", "15:00", "17:00",
+    "19:00", "21:00", "23:00",
+)
+SLOT_BITS = {time_str: 1 << i for i, time_str in enumerate(AVAILABLE_TIMES)}
+ALL_SLOTS_MASK = (1 << len(AVAILABLE_TIMES)) - 1
+
+# ما يرجعه GroupTable.snapshot لمحادثة غير محملة في الذاكرة (لا يُكتب عنها شيء عند الحفظ)
+NOT_LOADED = object()
+
+
+def times_to_mask(times):
+    mask = 0
+    for time_str in times or ():
+        mask |= SLOT_BITS.get(time_str, 0)
+    return mask
+
+
+def mask_to_times(mask):
+    return [time_str for time_str, bit in SLOT_BITS.items() if mask & bit]
+
+
+def time_display(time_str):
+    hour = int(time_str.split(":")[0])
+    return f"{hour}:00 {'ص' if hour < 12 else 'م'}"
+
+
+class GroupRecord:
+    """ إعدادات مجموعة واحدة """
+    __slots__ = (
+        "current_page", "image_mask", "images_active", "last_image_sent",
+        "current_part", "khatma_mask", "khatma_active", "last_khatma_sent",
+        "completed_khatmas", "timezone",
+    )
+
+    def __init__(self, current_page=1, image_mask=0, images_active=False, last_image_sent=None,
+                 current_part=1, khatma_mask=0, khatma_active=False, last_khatma_sent=None,
+                 completed_khatmas=0, timezone=None):
+        self.current_page = current_page
+        self.image_mask = image_mask
+        self.images_active = images_active
+        self.last_image_sent = last_image_sent
+        self.current_part = current_part
+        self.khatma_mask = khatma_mask
+        self.khatma_active = khatma_active
+        self.last_khatma_sent = last_khatma_sent
+        self.completed_khatmas = completed_khatmas
+        # اسم المنطقة الزمنية (IANA) للمجموعة، و None تعني المنطقة الافتراضية للبوت
+        self.timezone = timezone
+
+    @classmethod
+    def from_dict(cls, data):
+        """ من تنسيق القاموس القديم (image_times/khatma_times كقوائم) """
+        return cls(
+            current_page=data.get("current_page") or 1,
+            image_mask=times_to_mask(data.get("image_times")),
+            images_active=bool(data.get("images_active", False)),
+            last_image_sent=data.get("last_image_sent"),
+            current_part=data.get("current_part") or 1,
+            khatma_mask=times_to_mask(data.get("khatma_times")),
+            khatma_active=bool(data.get("khatma_active", False)),
+            last_khatma_sent=data.get("last_khatma_sent"),
+            completed_khatmas=data.get("completed_khatmas") or 0,
+            timezone=data.get("timezone"),
+        )
+
+    def to_dict(self):
+        return {
+            "current_page": self.current_page,
+            "image_times": mask_to_times(self.image_mask),
+            "images_active": self.images_active,
+            "last_image_sent": self.last_image_sent,
+            "current_part": self.current_part,
+            "khatma_times": mask_to_times(self.khatma_mask),
+            "khatma_active": self.khatma_active,
+            "last_khatma_sent": self.last_khatma_sent,
+            "completed_khatmas": self.completed_khatmas,
+            "timezone": self.timezone,
+        }
+
+    def mask(self, kind):
+        return self.image_mask if kind == "image" else self.khatma_mask
+
+    def active(self, kind):
+        return self.images_active if kind == "image" else self.khatma_active
+
+    def toggle_time(self, kind, time_str):
+        """ إضافة/إزالة وقت بعملية XOR واحدة؛ يرجع True إذا أصبح الوقت مختاراً """
+        bit = SLOT_BITS[time_str]
+        if kind == "image":
+            self.image_mask ^= bit
+            return bool(self.image_mask & bit)
+        self.khatma_mask ^= bit
+        return bool(self.khatma_mask & bit)
+
+
+class GroupTable:
+    """
+    chat_id ← GroupRecord مع قفل لكل محادثة لعمليات القراءة-التعديل-الكتابة الذرية
+    الأقفال مقسمة على عدد ثابت (وليس قفلاً لكل محادثة) حتى لا تكبر الذاكرة مع عدد المجموعات
+    ترتيب الأقفال: قفل المخزن ثم قفل المحادثة، لذلك لا يُستدعى الحفظ داخل locked()
+
+    مع source (GroupStore) تُحمّل السجلات عند أول طلب وتبقى آخر capacity منها فقط (LRU)؛
+    لا يُخرج من الذاكرة إلا سجل مطابق لآخر ما حُفظ منه، والمحذوف يبقى علامة حتى يُحفظ حذفه
+    """
+
+    # عدد السجلات الأقدم التي تُفحص في كل إدخال بحثاً عن سجل يمكن إخراجه
+    EVICT_SCAN = 16
+
+    def __init__(self, source=None, capacity=None, stripes=256):
+        self.source = source
+        self.capacity = capacity
+        self._records = OrderedDict()
+        # محادثات حُذفت ولم يُكتب حذفها في القاعدة بعد
+        self.removed = set()
+        # يزيد مع كل إخراج أو حذف، فيُعاد تحميل سجل قُرئ من القاعدة قبل أحدهما
+        self._generation = 0
+        self._table_lock = threading.Lock()
+        self._locks = [threading.RLock() for _ in range(stripes)]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lock(self, chat_id):
+        return self._locks[hash(chat_id) % len(self._locks)]
+
+    def __len__(self):
+        """ عدد السجلات المحملة في الذاكرة """
+        return len(self._records)
+
+    def __iter__(self):
+        with self._table_lock:
+            return iter(list(self._records))
+
+    def __contains__(self, chat_id):
+        """ هل المحادثة موجودة (في الذاكرة أو في القاعدة) دون تحميلها """
+        if chat_id in self._records:
+            return True
+        if chat_id in self.removed or self.source is None:
+            return False
+        return self.source.has_group(chat_id)
+
+    def __setitem__(self, chat_id, record):
+        with self.lock(chat_id):
+            self.removed.discard(chat_id)
+            self._insert(chat_id, record)
+
+    def cached(self, chat_id):
+        """ السجل إذا كان محملاً في الذاكرة فقط (بدون قراءة من القاعدة) """
+        with self._table_lock:
+            record = self._records.get(chat_id)
+            if record is not None:
+                self._records.move_to_end(chat_id)
+            return record
+
+    def _insert(self, chat_id, record):
+        with self._table_lock:
+            self._records[chat_id] = record
+            self._records.move_to_end(chat_id)
+            if self.capacity is not None and len(self._records) > self.capacity:
+                self._evict(keep=chat_id)
+
+    def trim(self):
+        """ إخراج ما زاد عن السعة بعد الحفظ (السجلات التي لم تُحفظ لا تُخرج عند إدخالها) """
+        if self.capacity is not None:
+            with self._table_lock:
+                self._evict()
+
+    def _evict(self, keep=None):
+        """
+        إخراج أقدم السجلات المحفوظة؛ السجل المقفل أو الذي لم يُحفظ بعد يُنقل إلى آخر الترتيب،
+        ولا يُخرج keep (السجل المُدخل للتو) وإلا أُعيد تحميله فوراً كلما امتلأت الذاكرة بسجلات لم تُحفظ
+        """
+        for _ in range(min(self.EVICT_SCAN, len(self._records))):
+            if len(self._records) <= self.capacity:
+                return
+            chat_id, record = next(iter(self._records.items()))
+            if chat_id == keep:
+                self._records.move_to_end(chat_id)
+                continue
+            # بدون انتظار: الانتظار هنا على قفل محادثة قد يعكس ترتيب الأقفال
+            lock = self.lock(chat_id)
+            if not lock.acquire(blocking=False):
+                self._records.move_to_end(chat_id)
+                continue
+            try:
+                if not self.source.is_clean(chat_id, record):
+                    self._records.move_to_end(chat_id)
+                    continue
+                del self._records[chat_id]
+                self.source.forget(chat_id)
+                self._generation += 1
+                self.evictions += 1
+            finally:
+                lock.release()
+
+    def get(self, chat_id):
+        """ سجل المحادثة (يُحمّل من القاعدة إذا لم يكن في الذاكرة)، أو None إذا لم توجد """
+        while True:
+            record = self.cached(chat_id)
+            if record is not None:
+                self.hits += 1
+                return record
+            if chat_id in self.removed or self.source is None:
+                return None
+            self.misses += 1
+            generation = self._generation
+            # القراءة من القاعدة خارج قفل المحادثة (ترتيب الأقفال: المخزن ثم المحادثة)
+            record = self.source.load_group(chat_id)
+            if record is None:
+                return None
+            with self.lock(chat_id):
+                current = self.cached(chat_id)
+                if current is not None:
+                    return current
+                if chat_id in self.removed:
+                    return None
+                if self._generation == generation:
+                    self._insert(chat_id, record)
+                    return record
+
+    @contextmanager
+    def locked(self, chat_id, create=True):
+        """
+        سجل المحادثة تحت قفلها طوال كتلة with (يُنشأ بالقيم الافتراضية إذا لم يوجد،
+        أو None مع create=False)
+        """
+        while True:
+            record = self.get(chat_id)
+            with self.lock(chat_id):
+                # قد يُخرج السجل من الذاكرة بين تحميله وأخذ القفل، فيُحمّل من جديد
+                if self._records.get(chat_id) is not record:
+                    continue
+                if record is None and create:
+                    record = GroupRecord()
+                    self.removed.discard(chat_id)
+                    self._insert(chat_id, record)
+                yield record
+                return
+
+    def remove(self, chat_id):
+        """ حذف المحادثة؛ يبقى حذفها معلقاً حتى يكتبه الحفظ التالي """
+        with self.lock(chat_id):
+            with self._table_lock:
+                record = self._records.pop(chat_id, None)
+                self._generation += 1
+            self.removed.add(chat_id)
+            return record
+
+    def discard(self, chat_id):
+        """ إخراج المحادثة من الذاكرة فقط (حذفتها عملية أخرى من القاعدة) """
+        with self.lock(chat_id):
+            with self._table_lock:
+                self._records.pop(chat_id, None)
+                self._generation += 1
+
+    def snapshot(self, chat_id):
+        """ حقول المحادثة كقاموس منسوخ تحت قفلها، None إذا حُذفت، أو NOT_LOADED إذا لم تكن محملة """
+        with self.lock(chat_id):
+            record = self._records.get(chat_id)
+            if record is not None:
+                return record.to_dict()
+            if chat_id in self.removed:
+                self.removed.discard(chat_id)
+                return None
+            return NOT_LOADED if self.source is not None else None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._records),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# ========== لوحات مفاتيح الأوقات ==========
+class PrecomputedMarkup(types.JsonSerializable):
+    """ لوحة مفاتيح JSON جاهزة يقبلها telebot مثل InlineKeyboardMarkup """
+    __slots__ = ("json",)
+
+    def __init__(self, json_str):
+        self.json = json_str
+
+    def to_json(self):
+        return self.json
+
+
+def _render_keyboard(prefix, mask):
+    rows = []
+    for i in range(0, len(AVAILABLE_TIMES), 3):
+        row = []
+        for time_str in AVAILABLE_TIMES[i:i+3]:
+            text = time_display(time_str)
+            if mask & SLOT_BITS[time_str]:
+                text = "✅ " + text
+            row.append({"text": text, "callback_data": f"{prefix}_{time_str}"})
+        rows.append(row)
+    rows.append([{"text": "تم الاختيار", "callback_data": f"done_{prefix}"}])
+    return PrecomputedMarkup(json.dumps({"inline_keyboard": rows}, ensure_ascii=False))
+
+
+_keyboards = {}
+_keyboards_lock = threading.Lock()
+
+
+def time_keyboard(prefix, mask):
+    """ لوحة اختيار الأوقات من الجدول؛ كل (بادئة، قناع) يُبنى مرة واحدة فقط """
+    key = (prefix, mask & ALL_SLOTS_MASK)
+    markup = _keyboards.get(key)
+    if markup is None:
+        with _keyboards_lock:
+            markup = _keyboards.get(key)
+            if markup is None:
+                markup = _keyboards[key] = _render_keyboard(*key)
+    return markup
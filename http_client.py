@@ -0,0 +1,164 @@
+"""
+طبقة HTTP مشتركة لكل الطلبات الصادرة (ومنها طلبات telebot إلى Bot API):
+اتصالات دائمة بحجم محدد، إعادة محاولة بتأخير عشوائي لما يُؤمن تكراره فقط،
+قاطع دائرة لكل مضيف غير مستثنى، وعدادات زمن الاستجابة والأخطاء
+"""
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """ المضيف معطل مؤقتاً بعد أخطاء متتالية، فيُرفض الطلب فوراً """
+
+
+class HostState:
+    __slots__ = ("requests", "errors", "latency_total", "latency_max",
+                 "consecutive_failures", "open_until", "trial_running")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trial_running = False
+
+
+# طرق Bot API للقراءة فقط: وحدها تُعاد بعد انتهاء مهلة القراءة أو رد 5xx
+READ_ONLY_API_METHODS = frozenset(("getMe", "getChatMember", "getUpdates", "getFile"))
+
+
+def _idempotent(method, url):
+    """
+    هل تكرار الطلب آمن؛ telebot يرسل بعض طرق الإرسال (sendMediaGroup، copyMessage، forwardMessage، leaveChat)
+    بـ GET، فطلبات Bot API تُحكم باسم الطريقة لا بالفعل
+    """
+    path = urlsplit(url).path
+    if path.startswith("/file/bot"):
+        return True
+    if path.startswith("/bot"):
+        return path.rsplit("/", 1)[-1] in READ_ONLY_API_METHODS
+    return method.upper() in ("GET", "HEAD")
+
+
+def _safe_to_retry(idempotent, error, files=None):
+    """
+    الطلب غير الآمن تكراره يُعاد فقط إذا تأكدنا أنه لم يصل للخادم (حتى لا تتكرر الرسائل)،
+    ولا يُعاد أبداً إذا حمل ملفات (قد يكون الملف قُرئ جزئياً، ويعيده المستدعي بنفسه إن أراد)
+    """
+    if idempotent and not files:
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    if files:
+        return False
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and "NewConnectionError" in type(reason).__name__
+
+
+class HttpClient:
+    """
+    breaker_exempt: مضيفون لا يُطبق عليهم قاطع الدائرة (مثل Bot API: أخطاؤه المؤقتة كثيرة،
+    وإيقافه 30 ثانية يوقف الاستطلاع والإرسال المجدول كله)؛ تُسجل عداداتهم فقط
+    """
+
+    def __init__(self, pool_connections=10, pool_size=32, max_retries=3, backoff=0.5,
+                 default_timeout=(5, 15), failure_threshold=5, reset_after=30,
+                 breaker_exempt=()):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.default_timeout = default_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.breaker_exempt = frozenset(breaker_exempt)
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _host(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState()
+        return state
+
+    def _before_request(self, host):
+        if host in self.breaker_exempt:
+            return
+        with self.lock:
+            state = self._host(host)
+            if state.open_until:
+                if time.monotonic() < state.open_until or state.trial_running:
+                    raise CircuitOpenError(f"Circuit open for {host}")
+                # انتهت مدة الإيقاف: نسمح بطلب تجريبي واحد
+                state.trial_running = True
+
+    def _record(self, host, elapsed, failed):
+        with self.lock:
+            state = self._host(host)
+            state.requests += 1
+            state.latency_total += elapsed
+            state.latency_max = max(state.latency_max, elapsed)
+            state.trial_running = False
+            if failed:
+                state.errors += 1
+                if host in self.breaker_exempt:
+                    return
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= self.failure_threshold:
+                    state.open_until = time.monotonic() + self.reset_after
+            else:
+                state.consecutive_failures = 0
+                state.open_until = 0.0
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """
+        نفس واجهة requests.Session.request (ومتوافقة مع CUSTOM_REQUEST_SENDER في telebot)؛
+        انتهاء مهلة القراءة وردود 5xx تُعاد فقط للطلبات الآمن تكرارها (_idempotent)
+        """
+        host = urlsplit(url).hostname or ""
+        timeout = timeout or self.default_timeout
+        idempotent = _idempotent(method, url)
+        attempt = 0
+        while True:
+            attempt += 1
+            self._before_request(host)
+            started = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(host, time.monotonic() - started, failed=True)
+                if attempt > self.max_retries or not _safe_to_retry(idempotent, e, kwargs.get("files")):
+                    raise
+            else:
+                failed = response.status_code >= 500
+                self._record(host, time.monotonic() - started, failed=failed)
+                if not failed or attempt > self.max_retries or not idempotent:
+                    return response
+            # تأخير أسي مع عشوائية كاملة حتى لا تتزامن المحاولات
+            time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            now = time.monotonic()
+            return {
+                host: {
+                    "requests": state.requests,
+                    "errors": state.errors,
+                    "avg_latency": state.latency_total / state.requests if state.requests else 0.0,
+                    "max_latency": state.latency_max,
+                    "circuit_open": state.open_until > now,
+                }
+                for host, state in self.hosts.items()
+            }
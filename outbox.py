@@ -0,0 +1,132 @@
+"""
+صندوق الإرسال للأوقات المجدولة: كل إرسال مستحق يُسجل في القاعدة بمفتاح ثابت قبل إرساله ويُؤكد بعد نجاحه،
+والتأكيدات تُكتب مع تقدم الصفحة أو الجزء في نفس المعاملة على دفعات؛ فالانقطاع لا يعيد إلا ما بعد آخر دفعة،
+وما أُكد لا يُرسل مرة أخرى ولا يتقدم مرتين
+الأخطاء تُجمع لكل وقت في ملخص واحد بدلاً من رسالة للمشرف عن كل فشل
+"""
+import threading
+from collections import Counter
+
+
+def delivery_key(kind, chat_id, day):
+    """ مفتاح الإرسال: مرة واحدة لكل نوع ومحادثة ويوم محلي """
+    return f"{kind}:{chat_id}:{day}"
+
+
+def error_kind(error):
+    """ وصف مختصر للخطأ تُجمع به الأخطاء المتشابهة في الملخص """
+    description = getattr(error, "description", None)
+    if description:
+        return f"{getattr(error, 'error_code', '')} {description}".strip()[:120]
+    return f"{type(error).__name__}: {error}"[:120]
+
+
+class Delivery:
+    """ إرسال مستحق واحد: payload الصفحة أو الجزء، و send(batch) يرسل ثم يؤكد عبر batch """
+    __slots__ = ("kind", "chat_id", "day", "payload", "send", "cost", "priority")
+
+    def __init__(self, kind, chat_id, day, payload, send, cost=1, priority=0):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.day = day
+        self.payload = payload
+        self.send = send
+        self.cost = cost
+        self.priority = priority
+
+    @property
+    def key(self):
+        return delivery_key(self.kind, self.chat_id, self.day)
+
+    def job(self, batch):
+        """ مهمة الموزع (chat_id, func, cost, priority) """
+        return (self.chat_id, lambda: self.send(batch), self.cost, self.priority)
+
+
+class DeliveryBatch:
+    """
+    إرسالات وقت واحد (أو دفعة تعويض)
+    claim(rows): تسجيل (key, chat_id, kind, day, payload) كمعلقة، ويرجع مفاتيح ما أُرسل منها بالفعل
+    commit(sent, failed): كتابة [(key, chat_id)] المؤكدة مع تقدم محادثاتها و [(key, الخطأ)] الفاشلة في معاملة واحدة
+    """
+
+    def __init__(self, claim, commit, commit_every=200):
+        self._claim = claim
+        self._commit = commit
+        self.commit_every = commit_every
+        self.lock = threading.Lock()
+        # (النوع، chat_id) ← المفتاح لما سُجل في هذه الدفعة
+        self.keys = {}
+        self.acked = set()
+        self.sent = []
+        self.failed = []
+        self.errors = Counter()
+        self.total = 0
+        self.already_sent = 0
+        self.commits = 0
+
+    def claim(self, deliveries):
+        """ تسجيل الإرسالات في صندوق الإرسال؛ يرجع ما لم يُؤكد إرساله من قبل """
+        rows = [(d.key, d.chat_id, d.kind, d.day, d.payload) for d in deliveries]
+        done = self._claim(rows) if rows else set()
+        pending = [d for d in deliveries if d.key not in done]
+        self.keys = {(d.kind, d.chat_id): d.key for d in pending}
+        self.total = len(pending)
+        self.already_sent = len(deliveries) - len(pending)
+        return pending
+
+    def ack(self, kind, chat_id):
+        """ تأكيد إرسال نجح (بعد تقدم المحادثة في الذاكرة)؛ يُكتب مع الدفعة """
+        with self.lock:
+            key = self.keys.get((kind, chat_id))
+            if key is None or key in self.acked:
+                return
+            self.acked.add(key)
+            self.sent.append((key, chat_id))
+            due = len(self.sent) >= self.commit_every
+        if due:
+            self.commit()
+
+    def fail(self, kind, chat_id, error):
+        with self.lock:
+            key = self.keys.get((kind, chat_id))
+            if key in self.acked:
+                return
+            self.errors[error_kind(error)] += 1
+            if key is not None:
+                self.failed.append((key, error_kind(error)))
+
+    def fail_chat(self, chat_id, error):
+        """ خطأ وصل الموزع (429 بعد كل المحاولات أو طرد البوت) يُحسب لإرسالات المحادثة التي لم تُؤكد """
+        for kind in ("image", "khatma"):
+            if (kind, chat_id) in self.keys:
+                self.fail(kind, chat_id, error)
+
+    def commit(self):
+        """ كتابة ما تجمع من تأكيدات وأخطاء؛ عند فشل الكتابة تبقى للدفعة التالية """
+        with self.lock:
+            sent, failed = self.sent, self.failed
+            self.sent, self.failed = [], []
+        if not sent and not failed:
+            return
+        try:
+            self._commit(sent, failed)
+            with self.lock:
+                self.commits += 1
+        except Exception as e:
+            print(f"Error committing deliveries: {e}")
+            with self.lock:
+                self.sent[:0] = sent
+                self.failed[:0] = failed
+
+    def failures(self):
+        return sum(self.errors.values())
+
+    def summary(self, label):
+        """ رسالة واحدة للمشرف بعدد الإخفاقات وأكثر أسبابها، أو None إذا لم يفشل شيء """
+        failed = self.failures()
+        if not failed:
+            return None
+        lines = [f"⚠️ {label}: تعذر {failed} من {self.total} إرسال"]
+        lines += [f"• {count} × {kind}" for kind, count in self.errors.most_common(5)]
+        return "\n".join(lines)
@@ -0,0 +1,256 @@
+"""
+فهرس صفحات المصحف (مصحف المدينة - 604 صفحة) مضمّن مع البوت
+بدلاً من طلب معلومات كل صفحة من api.alquran.cloud
+"""
+from array import array
+from bisect import bisect_right
+
+TOTAL_PAGES = 604
+TOTAL_AYAHS = 6236
+
+# ========== البيانات المضمّنة ==========
+# حدود الصفحات مأخوذة من فواصل صفحات نص مجمع الملك فهد (رواية حفص)،
+# وأسماء السور وأرباع الأحزاب من بيانات مشروع Tanzil (tanzil.net)
+# كل بداية مخزنة كزوج (السورة، الآية)
+
+SURAH_NAMES = (
+    "الفاتحة", "البقرة", "آل عمران", "النساء", "المائدة", "الأنعام",
+    "الأعراف", "الأنفال", "التوبة", "يونس", "هود", "يوسف",
+    "الرعد", "ابراهيم", "الحجر", "النحل", "الإسراء", "الكهف",
+    "مريم", "طه", "الأنبياء", "الحج", "المؤمنون", "النور",
+    "الفرقان", "الشعراء", "النمل", "القصص", "العنكبوت", "الروم",
+    "لقمان", "السجدة", "الأحزاب", "سبإ", "فاطر", "يس",
+    "الصافات", "ص", "الزمر", "غافر", "فصلت", "الشورى",
+    "الزخرف", "الدخان", "الجاثية", "الأحقاف", "محمد", "الفتح",
+    "الحجرات", "ق", "الذاريات", "الطور", "النجم", "القمر",
+    "الرحمن", "الواقعة", "الحديد", "المجادلة", "الحشر", "الممتحنة",
+    "الصف", "الجمعة", "المنافقون", "التغابن", "الطلاق", "التحريم",
+    "الملك", "القلم", "الحاقة", "المعارج", "نوح", "الجن",
+    "المزمل", "المدثر", "القيامة", "الانسان", "المرسلات", "النبإ",
+    "النازعات", "عبس", "التكوير", "الإنفطار", "المطففين", "الإنشقاق",
+    "البروج", "الطارق", "الأعلى", "الغاشية", "الفجر", "البلد",
+    "الشمس", "الليل", "الضحى", "الشرح", "التين", "العلق",
+    "القدر", "البينة", "الزلزلة", "العاديات", "القارعة", "التكاثر",
+    "العصر", "الهمزة", "الفيل", "قريش", "الماعون", "الكوثر",
+    "الكافرون", "النصر", "المسد", "الإخلاص", "الفلق", "الناس",
+)
+
+SURAH_AYAH_COUNTS = (
+    7, 286, 200, 176, 120, 165, 206, 75, 129, 109, 123, 111, 43, 52, 99, 128,
+    111, 110, 98, 135, 112, 78, 118, 64, 77, 227, 93, 88, 69, 60, 34, 30,
+    73, 54, 45, 83, 182, 88, 75, 85, 54, 53, 89, 59, 37, 35, 38, 29,
+    18, 45, 60, 49, 62, 55, 78, 96, 29, 22, 24, 13, 14, 11, 11, 18,
+    12, 12, 30, 52, 52, 44, 28, 28, 20, 56, 40, 31, 50, 40, 46, 42,
+    29, 19, 36, 25, 22, 17, 19, 26, 30, 20, 15, 21, 11, 8, 8, 19,
+    5, 8, 8, 11, 11, 8, 3, 9, 5, 4, 7, 3, 6, 3, 5, 4,
+    5, 6,
+)
+
+JUZ_STARTS = (
+    (1, 1), (2, 142), (2, 253), (3, 92), (4, 24), (4, 148),
+    (5, 82), (6, 111), (7, 88), (8, 41), (9, 94), (11, 6),
+    (12, 53), (15, 1), (17, 1), (18, 75), (21, 1), (23, 1),
+    (25, 21), (27, 56), (29, 46), (33, 31), (36, 28), (39, 32),
+    (41, 47), (46, 1), (51, 31), (58, 1), (67, 1), (78, 1),
+)
+
+QUARTER_STARTS = (
+    (1, 1), (2, 26), (2, 44), (2, 60), (2, 75), (2, 92), (2, 106), (2, 124),
+    (2, 142), (2, 158), (2, 177), (2, 189), (2, 203), (2, 219), (2, 233), (2, 243),
+    (2, 253), (2, 263), (2, 272), (2, 283), (3, 15), (3, 33), (3, 52), (3, 75),
+    (3, 92), (3, 113), (3, 133), (3, 153), (3, 171), (3, 186), (4, 1), (4, 12),
+    (4, 24), (4, 36), (4, 58), (4, 74), (4, 88), (4, 100), (4, 114), (4, 135),
+    (4, 148), (4, 163), (5, 1), (5, 12), (5, 27), (5, 41), (5, 51), (5, 67),
+    (5, 82), (5, 97), (5, 109), (6, 13), (6, 36), (6, 59), (6, 74), (6, 95),
+    (6, 111), (6, 127), (6, 141), (6, 151), (7, 1), (7, 31), (7, 47), (7, 65),
+    (7, 88), (7, 117), (7, 142), (7, 156), (7, 171), (7, 189), (8, 1), (8, 22),
+    (8, 41), (8, 61), (9, 1), (9, 19), (9, 34), (9, 46), (9, 60), (9, 75),
+    (9, 94), (9, 111), (9, 122), (10, 11), (10, 26), (10, 53), (10, 71), (10, 90),
+    (11, 6), (11, 24), (11, 41), (11, 61), (11, 84), (11, 108), (12, 7), (12, 30),
+    (12, 53), (12, 77), (12, 101), (13, 5), (13, 19), (13, 35), (14, 10), (14, 28),
+    (15, 1), (15, 49), (16, 1), (16, 30), (16, 51), (16, 75), (16, 90), (16, 111),
+    (17, 1), (17, 23), (17, 50), (17, 70), (17, 99), (18, 17), (18, 32), (18, 51),
+    (18, 75), (18, 99), (19, 22), (19, 59), (20, 1), (20, 55), (20, 83), (20, 111),
+    (21, 1), (21, 29), (21, 51), (21, 83), (22, 1), (22, 19), (22, 38), (22, 60),
+    (23, 1), (23, 36), (23, 75), (24, 1), (24, 21), (24, 35), (24, 53), (25, 1),
+    (25, 21), (25, 53), (26, 1), (26, 52), (26, 111), (26, 181), (27, 1), (27, 27),
+    (27, 56), (27, 82), (28, 12), (28, 29), (28, 51), (28, 76), (29, 1), (29, 26),
+    (29, 46), (30, 1), (30, 31), (30, 54), (31, 22), (32, 11), (33, 1), (33, 18),
+    (33, 31), (33, 51), (33, 60), (34, 10), (34, 24), (34, 46), (35, 15), (35, 41),
+    (36, 28), (36, 60), (37, 22), (37, 83), (37, 145), (38, 21), (38, 52), (39, 8),
+    (39, 32), (39, 53), (40, 1), (40, 21), (40, 41), (40, 66), (41, 9), (41, 25),
+    (41, 47), (42, 13), (42, 27), (42, 51), (43, 24), (43, 57), (44, 17), (45, 12),
+    (46, 1), (46, 21), (47, 10), (47, 33), (48, 18), (49, 1), (49, 14), (50, 27),
+    (51, 31), (52, 24), (53, 26), (54, 9), (55, 1), (56, 1), (56, 75), (57, 16),
+    (58, 1), (58, 14), (59, 11), (60, 7), (62, 1), (63, 4), (65, 1), (66, 1),
+    (67, 1), (69, 1), (70, 19), (72, 1), (73, 20), (75, 1), (76, 19), (77, 1),
+    (78, 1), (80, 1), (82, 1), (84, 1), (87, 1), (90, 1), (94, 1), (100, 9),
+)
+
+PAGE_STARTS = (
+    (1, 1), (2, 1), (2, 6), (2, 17), (2, 25), (2, 30), (2, 38), (2, 49),
+    (2, 58), (2, 62), (2, 70), (2, 77), (2, 84), (2, 89), (2, 94), (2, 102),
+    (2, 106), (2, 113), (2, 120), (2, 127), (2, 135), (2, 142), (2, 146), (2, 154),
+    (2, 164), (2, 170), (2, 177), (2, 182), (2, 187), (2, 191), (2, 197), (2, 203),
+    (2, 211), (2, 216), (2, 220), (2, 225), (2, 231), (2, 234), (2, 238), (2, 246),
+    (2, 249), (2, 253), (2, 257), (2, 260), (2, 265), (2, 270), (2, 275), (2, 282),
+    (2, 283), (3, 1), (3, 10), (3, 16), (3, 23), (3, 30), (3, 38), (3, 46),
+    (3, 53), (3, 62), (3, 71), (3, 78), (3, 84), (3, 92), (3, 101), (3, 109),
+    (3, 116), (3, 122), (3, 133), (3, 141), (3, 149), (3, 154), (3, 158), (3, 166),
+    (3, 174), (3, 181), (3, 187), (3, 195), (4, 1), (4, 7), (4, 12), (4, 15),
+    (4, 20), (4, 24), (4, 27), (4, 34), (4, 38), (4, 45), (4, 52), (4, 60),
+    (4, 66), (4, 75), (4, 80), (4, 87), (4, 92), (4, 95), (4, 102), (4, 106),
+    (4, 114), (4, 122), (4, 128), (4, 135), (4, 141), (4, 148), (4, 155), (4, 163),
+    (4, 171), (4, 176), (5, 3), (5, 6), (5, 10), (5, 14), (5, 18), (5, 24),
+    (5, 32), (5, 37), (5, 42), (5, 46), (5, 51), (5, 58), (5, 65), (5, 71),
+    (5, 78), (5, 84), (5, 91), (5, 96), (5, 104), (5, 109), (5, 114), (6, 1),
+    (6, 9), (6, 19), (6, 28), (6, 36), (6, 45), (6, 53), (6, 60), (6, 69),
+    (6, 74), (6, 82), (6, 91), (6, 95), (6, 102), (6, 111), (6, 119), (6, 125),
+    (6, 131), (6, 138), (6, 143), (6, 147), (6, 152), (6, 158), (7, 1), (7, 12),
+    (7, 23), (7, 31), (7, 38), (7, 44), (7, 52), (7, 58), (7, 68), (7, 74),
+    (7, 82), (7, 88), (7, 96), (7, 105), (7, 121), (7, 131), (7, 138), (7, 144),
+    (7, 150), (7, 156), (7, 160), (7, 164), (7, 171), (7, 179), (7, 188), (7, 196),
+    (8, 1), (8, 9), (8, 17), (8, 26), (8, 34), (8, 41), (8, 46), (8, 53),
+    (8, 62), (8, 70), (9, 1), (9, 7), (9, 14), (9, 21), (9, 27), (9, 32),
+    (9, 37), (9, 41), (9, 48), (9, 55), (9, 62), (9, 69), (9, 73), (9, 80),
+    (9, 87), (9, 94), (9, 100), (9, 107), (9, 112), (9, 118), (9, 123), (10, 1),
+    (10, 7), (10, 15), (10, 21), (10, 26), (10, 34), (10, 43), (10, 54), (10, 62),
+    (10, 71), (10, 79), (10, 89), (10, 98), (10, 107), (11, 6), (11, 13), (11, 20),
+    (11, 29), (11, 38), (11, 46), (11, 54), (11, 63), (11, 72), (11, 82), (11, 89),
+    (11, 98), (11, 109), (11, 118), (12, 5), (12, 15), (12, 23), (12, 31), (12, 38),
+    (12, 44), (12, 53), (12, 64), (12, 70), (12, 79), (12, 87), (12, 96), (12, 104),
+    (13, 1), (13, 6), (13, 14), (13, 19), (13, 29), (13, 35), (13, 43), (14, 6),
+    (14, 11), (14, 19), (14, 25), (14, 34), (14, 43), (15, 1), (15, 16), (15, 32),
+    (15, 52), (15, 71), (15, 91), (16, 7), (16, 15), (16, 27), (16, 35), (16, 43),
+    (16, 55), (16, 65), (16, 73), (16, 80), (16, 88), (16, 94), (16, 103), (16, 111),
+    (16, 119), (17, 1), (17, 8), (17, 18), (17, 28), (17, 39), (17, 50), (17, 59),
+    (17, 67), (17, 76), (17, 87), (17, 97), (17, 105), (18, 5), (18, 16), (18, 21),
+    (18, 28), (18, 35), (18, 46), (18, 54), (18, 62), (18, 75), (18, 84), (18, 98),
+    (19, 1), (19, 12), (19, 26), (19, 39), (19, 52), (19, 65), (19, 77), (19, 96),
+    (20, 13), (20, 38), (20, 52), (20, 65), (20, 77), (20, 88), (20, 99), (20, 114),
+    (20, 126), (21, 1), (21, 11), (21, 25), (21, 36), (21, 45), (21, 58), (21, 73),
+    (21, 82), (21, 91), (21, 102), (22, 1), (22, 6), (22, 16), (22, 24), (22, 31),
+    (22, 39), (22, 47), (22, 56), (22, 65), (22, 73), (23, 1), (23, 18), (23, 28),
+    (23, 43), (23, 60), (23, 75), (23, 90), (23, 105), (24, 1), (24, 11), (24, 21),
+    (24, 28), (24, 32), (24, 37), (24, 44), (24, 54), (24, 59), (24, 62), (25, 3),
+    (25, 12), (25, 21), (25, 33), (25, 44), (25, 56), (25, 68), (26, 1), (26, 20),
+    (26, 40), (26, 61), (26, 84), (26, 112), (26, 137), (26, 160), (26, 184), (26, 207),
+    (27, 1), (27, 14), (27, 23), (27, 36), (27, 45), (27, 56), (27, 64), (27, 77),
+    (27, 89), (28, 6), (28, 14), (28, 22), (28, 29), (28, 36), (28, 44), (28, 51),
+    (28, 60), (28, 71), (28, 78), (28, 85), (29, 7), (29, 15), (29, 24), (29, 31),
+    (29, 39), (29, 46), (29, 53), (29, 64), (30, 6), (30, 16), (30, 25), (30, 33),
+    (30, 42), (30, 51), (31, 1), (31, 12), (31, 20), (31, 29), (32, 1), (32, 12),
+    (32, 21), (33, 1), (33, 7), (33, 16), (33, 23), (33, 31), (33, 36), (33, 44),
+    (33, 51), (33, 55), (33, 63), (34, 1), (34, 8), (34, 15), (34, 23), (34, 32),
+    (34, 40), (34, 49), (35, 4), (35, 12), (35, 19), (35, 31), (35, 39), (35, 45),
+    (36, 13), (36, 28), (36, 41), (36, 55), (36, 71), (37, 1), (37, 25), (37, 52),
+    (37, 77), (37, 103), (37, 127), (37, 154), (38, 1), (38, 17), (38, 27), (38, 43),
+    (38, 62), (38, 84), (39, 6), (39, 11), (39, 22), (39, 32), (39, 41), (39, 48),
+    (39, 57), (39, 68), (39, 75), (40, 8), (40, 17), (40, 26), (40, 34), (40, 41),
+    (40, 50), (40, 59), (40, 67), (40, 78), (41, 1), (41, 12), (41, 21), (41, 30),
+    (41, 39), (41, 47), (42, 1), (42, 11), (42, 16), (42, 23), (42, 32), (42, 45),
+    (42, 52), (43, 11), (43, 23), (43, 34), (43, 48), (43, 61), (43, 74), (44, 1),
+    (44, 19), (44, 40), (45, 1), (45, 14), (45, 23), (45, 33), (46, 6), (46, 15),
+    (46, 21), (46, 29), (47, 1), (47, 12), (47, 20), (47, 30), (48, 1), (48, 10),
+    (48, 16), (48, 24), (48, 29), (49, 5), (49, 12), (50, 1), (50, 16), (50, 36),
+    (51, 7), (51, 31), (51, 52), (52, 15), (52, 32), (53, 1), (53, 27), (53, 45),
+    (54, 7), (54, 28), (54, 50), (55, 19), (55, 42), (55, 70), (56, 17), (56, 51),
+    (56, 77), (57, 4), (57, 12), (57, 19), (57, 25), (58, 1), (58, 7), (58, 12),
+    (58, 22), (59, 4), (59, 10), (59, 17), (60, 1), (60, 6), (60, 12), (61, 6),
+    (62, 1), (62, 9), (63, 5), (64, 1), (64, 10), (65, 1), (65, 6), (66, 1),
+    (66, 8), (67, 1), (67, 13), (67, 27), (68, 17), (68, 43), (69, 9), (69, 36),
+    (70, 11), (70, 41), (71, 11), (72, 1), (72, 14), (73, 1), (73, 20), (74, 19),
+    (74, 48), (75, 20), (76, 6), (76, 26), (77, 20), (78, 1), (78, 31), (79, 17),
+    (80, 1), (80, 41), (82, 1), (83, 5), (83, 34), (84, 25), (86, 1), (87, 11),
+    (88, 23), (89, 23), (90, 19), (92, 10), (94, 3), (96, 13), (98, 6), (100, 6),
+    (103, 1), (106, 1), (109, 1), (112, 1),
+)
+
+
+# ========== بناء الجداول ==========
+def _build_surah_first():
+    """ الرقم المطلق (من 0) لأول آية في كل سورة، مع قيمة ختامية = عدد الآيات """
+    surah_first = array("H", [0])
+    for count in SURAH_AYAH_COUNTS:
+        surah_first.append(surah_first[-1] + count)
+    return surah_first
+
+_SURAH_FIRST = _build_surah_first()
+
+def _build_tables():
+    """ تحويل البيانات المضمّنة إلى مصفوفات مضغوطة يُقرأ منها كل شيء بفهرسة مباشرة """
+    surah_first = _SURAH_FIRST
+
+    def absolute(surah, ayah):
+        return surah_first[surah - 1] + ayah - 1
+
+    page_first = [absolute(*ref) for ref in PAGE_STARTS] + [TOTAL_AYAHS]
+    juz_first = [absolute(*ref) for ref in JUZ_STARTS]
+    quarter_first = [absolute(*ref) for ref in QUARTER_STARTS]
+
+    def surah_of(index):
+        return bisect_right(surah_first, index)
+
+    # الفهرس 0 غير مستخدم حتى تكون أرقام الصفحات هي نفسها مواضع المصفوفات
+    tables = {
+        "first_surah": array("B", [0]),
+        "first_ayah": array("H", [0]),
+        "last_surah": array("B", [0]),
+        "last_ayah": array("H", [0]),
+        "juz": array("B", [0]),
+        "quarter": array("B", [0]),
+    }
+    for page in range(TOTAL_PAGES):
+        first = page_first[page]
+        last = page_first[page + 1] - 1
+        first_surah, last_surah = surah_of(first), surah_of(last)
+        tables["first_surah"].append(first_surah)
+        tables["first_ayah"].append(first - surah_first[first_surah - 1] + 1)
+        tables["last_surah"].append(last_surah)
+        tables["last_ayah"].append(last - surah_first[last_surah - 1] + 1)
+        tables["juz"].append(bisect_right(juz_first, first))
+        tables["quarter"].append(bisect_right(quarter_first, first))
+    return tables
+
+_TABLES = _build_tables()
+_FIRST_SURAH = _TABLES["first_surah"]
+_FIRST_AYAH = _TABLES["first_ayah"]
+_LAST_SURAH = _TABLES["last_surah"]
+_LAST_AYAH = _TABLES["last_ayah"]
+_JUZ = _TABLES["juz"]
+_QUARTER = _TABLES["quarter"]
+
+# ========== الاستعلام ==========
+def page_info(page):
+    """ معلومات الصفحة (السور، الجزء، الحزب، الربع، أول وآخر آية) بدون أي طلب شبكة """
+    if not 1 <= page <= TOTAL_PAGES:
+        raise ValueError(f"رقم الصفحة خارج النطاق: {page}")
+    quarter = _QUARTER[page]
+    return {
+        "page": page,
+        "first_surah": _FIRST_SURAH[page],
+        "first_ayah": _FIRST_AYAH[page],
+        "last_surah": _LAST_SURAH[page],
+        "last_ayah": _LAST_AYAH[page],
+        "surah": SURAH_NAMES[_FIRST_SURAH[page] - 1],
+        "juz": _JUZ[page],
+        "hizb": (quarter - 1) // 4 + 1,
+        "rub": (quarter - 1) % 4 + 1,
+    }
+
+def surah_name(number):
+    """ اسم السورة من رقمها (1-114) """
+    return SURAH_NAMES[number - 1]
+
+def ayah_ref(index):
+    """ (رقم السورة، رقم الآية) من الرقم المطلق للآية (0-6235) """
+    if not 0 <= index < TOTAL_AYAHS:
+        raise ValueError(f"رقم الآية خارج النطاق: {index}")
+    surah = bisect_right(_SURAH_FIRST, index)
+    return surah, index - _SURAH_FIRST[surah - 1] + 1
+
+def pages_surahs(first_page, last_page):
+    """ أسماء السور التي تظهر بين صفحتين (شاملة) بترتيبها """
+    first = _FIRST_SURAH[first_page]
+    last = _LAST_SURAH[last_page]
+    return [SURAH_NAMES[number - 1] for number in range(first, last + 1)]
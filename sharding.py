@@ -0,0 +1,64 @@
+"""
+التشغيل المقسم: عملية استقبال واحدة تعالج التحديثات وتملك كتابة الإعدادات،
+وعدة عمليات عمال تملك كل منها جزءاً من المحادثات (حسب hash لـ chat_id) للإرسال المجدول.
+التنسيق يتم عبر قاعدة SQLite المشتركة (جدول changes) بدون أي خدمة خارجية
+"""
+import os
+import subprocess
+import sys
+import time
+import zlib
+
+
+def shard_of(chat_id, shard_count):
+    """ رقم الجزء الثابت للمحادثة (crc32 لا يتغير بين العمليات بخلاف hash) """
+    return zlib.crc32(str(chat_id).encode("utf-8")) % shard_count
+
+
+def spawn_workers(script, shard_count, global_rate):
+    """ تشغيل عملية عامل لكل جزء؛ حد الإرسال العام يُقسم بينها بالتساوي """
+    workers = []
+    for shard in range(shard_count):
+        env = dict(os.environ)
+        env.update({
+            "BOT_ROLE": "worker",
+            "SHARD_INDEX": str(shard),
+            "SHARD_COUNT": str(shard_count),
+            "GLOBAL_RATE_PER_SECOND": str(global_rate / shard_count),
+        })
+        workers.append(subprocess.Popen([sys.executable, script], env=env))
+    return workers
+
+
+def stop_workers(workers, timeout=30):
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        try:
+            worker.wait(timeout)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+def follow_changes(store, since, is_mine, apply_change, interval=5, stop=None):
+    """
+    متابعة المحادثات التي غيرت عملية الاستقبال إعداداتها وإعادة تحميل ما يخص هذا العامل
+    apply_change(chat_id) تُستدعى لكل محادثة تغيرت؛ تعمل حتى يُضبط stop وترجع آخر تغيير طُبق
+    """
+    while stop is None or not stop.is_set():
+        batch = []
+        try:
+            batch = store.changes_since(since)
+            for seq, chat_id in batch:
+                if is_mine(chat_id):
+                    apply_change(chat_id)
+                since = seq
+        except Exception as e:
+            print(f"Error following config changes: {e}")
+        # دفعة ممتلئة تعني وجود تغييرات أخرى تنتظر، فلا داعي للانتظار
+        if len(batch) < 1000:
+            if stop is None:
+                time.sleep(interval)
+            else:
+                stop.wait(interval)
+    return since
@@ -0,0 +1,218 @@
+"""
+فهرس أوقات الإرسال: لكل دقيقة من اليوم بتوقيت UTC المحادثات المستحقة فيها
+أوقات كل مجموعة بتوقيتها المحلي تُحوّل مرة واحدة عند تسجيلها حسب فرق منطقتها الزمنية،
+ويُعاد بناء مواضع المنطقة فقط عند تغير فرقها (التوقيت الصيفي)، فلا يحوّل المجدول أي توقيت لكل محادثة
+"""
+import bisect
+import os
+import threading
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
+KINDS = ("image", "khatma")
+MINUTES_PER_DAY = 24 * 60
+
+# مدى البحث عن التغيير القادم في فرق التوقيت؛ إذا لم يوجد يُعاد الفحص بعده
+TRANSITION_SEARCH_DAYS = 31
+
+
+def host_zone_name():
+    """
+    اسم المنطقة الزمنية لجهاز التشغيل (من TZ ثم /etc/localtime ثم /etc/timezone)، وإلا UTC
+    قبل دعم المناطق الزمنية كانت المجموعات تُجدول بتوقيت الجهاز، فيبقى هو الافتراضي لمن لم يحدد منطقته
+    """
+    candidates = [os.environ.get("TZ", "").lstrip(":")]
+    try:
+        candidates.append(os.path.realpath("/etc/localtime"))
+    except OSError:
+        pass
+    try:
+        with open("/etc/timezone", encoding="utf-8") as f:
+            candidates.append(f.read().strip())
+    except OSError:
+        pass
+    for name in candidates:
+        # مسار ملف داخل قاعدة المناطق مثل /usr/share/zoneinfo/Africa/Cairo
+        name = name.split("/zoneinfo/", 1)[-1]
+        if not name:
+            continue
+        try:
+            ZoneInfo(name)
+        except Exception:
+            continue
+        return name
+    return "UTC"
+
+
+def slot_minute(time_str):
+    hour, minute = map(int, time_str.split(":"))
+    return hour * 60 + minute
+
+
+def _offset_minutes(zone, moment):
+    return int(moment.astimezone(zone).utcoffset().total_seconds() // 60)
+
+
+def zone_offset(zone_name, now):
+    """
+    (فرق المنطقة عن UTC بالدقائق الآن، أول لحظة UTC يتغير فيها هذا الفرق)
+    ZoneInfo لا يعرض مواعيد التغيير، فيُبحث عنها يوماً بيوم ثم بالتنصيف حتى الثانية
+    """
+    zone = ZoneInfo(zone_name)
+    offset = _offset_minutes(zone, now)
+    low = now
+    for _ in range(TRANSITION_SEARCH_DAYS):
+        high = low + timedelta(days=1)
+        if _offset_minutes(zone, high) != offset:
+            while high - low > timedelta(seconds=1):
+                middle = low + (high - low) / 2
+                if _offset_minutes(zone, middle) == offset:
+                    low = middle
+                else:
+                    high = middle
+            return offset, high
+        low = high
+    return offset, low
+
+
+class SlotIndex:
+    """
+    (النوع، دقيقة UTC) ← {chat_id: المنطقة الزمنية}، يُحدَّث تدريجياً مع كل تغيير في الإعدادات
+    كل الأوقات المعطاة له aware بتوقيت UTC
+    """
+
+    def __init__(self, default_zone="UTC"):
+        self.default_zone = default_zone
+        self.lock = threading.Lock()
+        self.chats = {}
+        # (chat_id, النوع) ← (المنطقة، دقائق الأوقات المحلية) لإعادة البناء عند تغير الفرق
+        self.entries = {}
+        # المنطقة ← [الفرق بالدقائق، لحظة تغيره]
+        self.zones = {}
+        # يزيد مع كل إعادة بناء بسبب التوقيت الصيفي، لإهمال ما جُهز قبلها
+        self.version = 0
+        self._minutes = None
+
+    def _zone(self, zone_name, now):
+        state = self.zones.get(zone_name)
+        if state is None:
+            state = self.zones[zone_name] = list(zone_offset(zone_name, now))
+        return state
+
+    def _link(self, chat_id, kind, zone_name, local_minutes):
+        offset = self.zones[zone_name][0]
+        for minute in local_minutes:
+            self.chats.setdefault((kind, (minute - offset) % MINUTES_PER_DAY), {})[chat_id] = zone_name
+        self._minutes = None
+
+    def _unlink(self, chat_id, kind):
+        entry = self.entries.pop((chat_id, kind), None)
+        if entry is None:
+            return
+        zone_name, local_minutes = entry
+        offset = self.zones[zone_name][0]
+        for minute in local_minutes:
+            key = (kind, (minute - offset) % MINUTES_PER_DAY)
+            chats = self.chats.get(key)
+            if chats is not None:
+                chats.pop(chat_id, None)
+                if not chats:
+                    del self.chats[key]
+        self._minutes = None
+
+    def update(self, chat_id, kind, times, active, zone_name, now):
+        """ جعل المحادثة مسجلة فقط في أوقات times (بتوقيت zone_name) إذا كان النظام مفعلاً """
+        local_minutes = tuple(sorted(set(map(slot_minute, times)))) if active else ()
+        zone_name = zone_name or self.default_zone
+        with self.lock:
+            self._unlink(chat_id, kind)
+            if not local_minutes:
+                return
+            try:
+                self._zone(zone_name, now)
+            except Exception as e:
+                print(f"Unknown time zone {zone_name!r} for {chat_id}, using {self.default_zone}: {e}")
+                zone_name = self.default_zone
+                self._zone(zone_name, now)
+            self.entries[(chat_id, kind)] = (zone_name, local_minutes)
+            self._link(chat_id, kind, zone_name, local_minutes)
+
+    def remove(self, chat_id):
+        with self.lock:
+            for kind in KINDS:
+                self._unlink(chat_id, kind)
+
+    def refresh_offsets(self, now):
+        """ إعادة بناء مواضع المناطق التي تغير فرقها فقط؛ يرجع عدد المناطق المتغيرة """
+        changed = 0
+        with self.lock:
+            for zone_name, state in self.zones.items():
+                if now < state[1]:
+                    continue
+                offset, state[1] = zone_offset(zone_name, now)
+                if offset == state[0]:
+                    continue
+                entries = [(key, entry) for key, entry in self.entries.items() if entry[0] == zone_name]
+                for (chat_id, kind), _ in entries:
+                    self._unlink(chat_id, kind)
+                state[0] = offset
+                for (chat_id, kind), (_, local_minutes) in entries:
+                    self.entries[(chat_id, kind)] = (zone_name, local_minutes)
+                    self._link(chat_id, kind, zone_name, local_minutes)
+                changed += 1
+            if changed:
+                self.version += 1
+        return changed
+
+    def next_rebuild(self):
+        """ أقرب لحظة قد يتغير فيها فرق إحدى المناطق المستخدمة """
+        with self.lock:
+            return min((state[1] for state in self.zones.values()), default=None)
+
+    def due(self, kind, minute):
+        """ نسخة من (chat_id، المنطقة) المستحقة في دقيقة UTC هذه """
+        with self.lock:
+            return list(self.chats.get((kind, minute), {}).items())
+
+    def local_time(self, zone_name, moment):
+        """ الوقت المحلي (بدون منطقة) للحظة UTC من فرق المنطقة المحفوظ """
+        with self.lock:
+            offset = self.zones[zone_name][0]
+        return (moment + timedelta(minutes=offset)).replace(tzinfo=None)
+
+    def _occupied_minutes(self):
+        with self.lock:
+            if self._minutes is None:
+                self._minutes = sorted({minute for _, minute in self.chats})
+            return self._minutes
+
+    def next_boundary(self, after):
+        """ أول بداية دقيقة فيها إرسال تأتي بعد after مباشرة (None إذا لم يكن هناك أي إرسال) """
+        minutes = self._occupied_minutes()
+        if not minutes:
+            return None
+        day = after.replace(hour=0, minute=0, second=0, microsecond=0)
+        i = bisect.bisect_right(minutes, after.hour * 60 + after.minute)
+        if i == len(minutes):
+            return day + timedelta(days=1, minutes=minutes[0])
+        return day + timedelta(minutes=minutes[i])
+
+    def boundaries_between(self, start, end):
+        """ بدايات الدقائق التي فيها إرسال في الفترة (start, end] بترتيب زمني """
+        minutes = self._occupied_minutes()
+        boundaries = []
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day <= end:
+            for minute in minutes:
+                boundary = day + timedelta(minutes=minute)
+                if start < boundary <= end:
+                    boundaries.append(boundary)
+            day += timedelta(days=1)
+        return boundaries
+
+    def count(self):
+        with self.lock:
+            return {
+                f"{kind}_{minute // 60:02d}:{minute % 60:02d}": len(chats)
+                for (kind, minute), chats in self.chats.items()
+            }
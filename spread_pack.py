@@ -0,0 +1,165 @@
+"""
+صور الصفحتين المتقابلتين (1-2، 3-4، ... 603-604) مركبة مسبقاً في صورة واحدة مضغوطة (JPEG أو WebP)
+لإرسالها بـ send_photo واحد بدلاً من مجموعة وسائط من صورتين (رسالة واحدة بدل رسالتين)
+
+كل الصور في ملف واحد: ترويسة ثم مصفوفة (الموضع، الطول) لكل صورة ثم البيانات،
+ويُفتح بـ mmap فتُقرأ أي صورة مباشرة دون تحميل الملف كله
+
+البناء يتم مرة واحدة خارج البوت ويحتاج مكتبة Pillow (اختيارية، لا يحتاجها البوت نفسه ولا تُضاف للمستودع):
+    pip install Pillow
+    python spread_pack.py --source https://raw.githubusercontent.com/Mohamed-Nagdy/Quran-App-Data/main/quran_images
+    python spread_pack.py --source ./quran_images --format webp --quality 75
+"""
+import mmap
+import os
+import struct
+import threading
+
+import quran_index
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+PACK_FILE = os.path.join(DATA_DIR, "spreads.pack")
+
+SPREAD_COUNT = quran_index.TOTAL_PAGES // 2
+FORMATS = ("jpeg", "webp")
+
+# الترويسة: التوقيع، الصيغة (4 أحرف)، عدد الصور؛ ثم لكل صورة: الموضع (8 بايت) والطول (4 بايت)
+MAGIC = b"KSPREAD1"
+HEADER = struct.Struct("<8s4sI")
+ENTRY = struct.Struct("<QI")
+
+
+def spread_index(page):
+    """ رقم الصورة المركبة التي تبدأ بالصفحة page (الفردية)، أو None إذا لم تكن بداية صفحتين """
+    if page % 2 != 1 or not 1 <= page < quran_index.TOTAL_PAGES:
+        return None
+    return (page - 1) // 2
+
+
+class SpreadPack:
+    """ قراءة ملف الصور المركبة؛ يُفتح عند أول استخدام ويبقى على القرص """
+
+    def __init__(self, path=PACK_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.format = None
+        self._data = None
+        self._entries = None
+
+    def _load(self):
+        if self._data is None:
+            with self.lock:
+                if self._data is None:
+                    with open(self.path, "rb") as f:
+                        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, image_format, count = HEADER.unpack_from(data, 0)
+                    if magic != MAGIC or count != SPREAD_COUNT:
+                        raise ValueError(f"ملف الصور المركبة تالف: {self.path}")
+                    self._entries = [
+                        ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size) for i in range(count)
+                    ]
+                    self.format = image_format.decode("ascii").strip()
+                    self._data = data
+        return self._data, self._entries
+
+    def check(self):
+        """ فتح الملف والتحقق منه عند التشغيل (يرفع خطأ إذا لم يوجد أو كان تالفاً) """
+        self._load()
+        return self
+
+    def read(self, page):
+        """ بيانات الصورة المركبة للصفحتين page و page+1 """
+        data, entries = self._load()
+        offset, length = entries[spread_index(page)]
+        return data[offset:offset + length]
+
+    def upload(self, page):
+        """ (اسم الملف، البيانات) بالشكل الذي يقبله send_photo للرفع """
+        extension = "jpg" if self.format == "jpeg" else self.format
+        return f"pages-{page}-{page + 1}.{extension}", self.read(page)
+
+
+def write_pack(path, image_format, images):
+    """ كتابة الملف من بيانات SPREAD_COUNT صورة مضغوطة بالترتيب (في ملف مؤقت ثم استبدال) """
+    if image_format not in FORMATS or len(images) != SPREAD_COUNT:
+        raise ValueError("صيغة غير مدعومة أو عدد صور غير صحيح")
+    offset = HEADER.size + ENTRY.size * len(images)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, image_format.encode("ascii"), len(images)))
+        for image in images:
+            f.write(ENTRY.pack(offset, len(image)))
+            offset += len(image)
+        for image in images:
+            f.write(image)
+    os.replace(tmp_path, path)
+
+
+# ========== البناء (يحتاج Pillow) ==========
+def _open_page(source, page):
+    import io
+    from urllib.request import urlopen
+
+    from PIL import Image
+
+    location = f"{source.rstrip('/')}/{page}.png"
+    if location.startswith(("http://", "https://")):
+        with urlopen(location, timeout=60) as response:
+            return Image.open(io.BytesIO(response.read()))
+    return Image.open(location)
+
+
+def compose_spread(right, left, height, image_format, quality):
+    """
+    صورة واحدة للصفحتين بنفس الارتفاع: الصفحة الفردية يميناً كما في المصحف المطبوع
+    (حدود تيليجرام لـ send_photo: مجموع البعدين حتى 10000 والحجم حتى 10MB)
+    """
+    import io
+
+    from PIL import Image
+
+    pages = []
+    for image in (left, right):
+        image = image.convert("RGB")
+        width = round(image.width * height / image.height)
+        pages.append(image.resize((width, height), Image.LANCZOS))
+    spread = Image.new("RGB", (pages[0].width + pages[1].width, height), "white")
+    spread.paste(pages[0], (0, 0))
+    spread.paste(pages[1], (pages[0].width, 0))
+    output = io.BytesIO()
+    if image_format == "webp":
+        spread.save(output, "WEBP", quality=quality, method=6)
+    else:
+        spread.save(output, "JPEG", quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def build_pack(source, path=PACK_FILE, image_format="jpeg", quality=80, height=1600):
+    """ بناء الملف من صور الصفحات ({page}.png في مجلد أو على رابط) """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise SystemExit("Pillow is required to build the spread pack: pip install Pillow")
+    images = []
+    for index in range(SPREAD_COUNT):
+        page = 2 * index + 1
+        images.append(compose_spread(
+            _open_page(source, page), _open_page(source, page + 1), height, image_format, quality
+        ))
+        print(f"\rpages {page}-{page + 1}: {len(images[-1]) // 1024} KB", end="", flush=True)
+    write_pack(path, image_format, images)
+    total = sum(map(len, images))
+    print(f"\nwrote {path}: {len(images)} spreads, {total / (1024 * 1024):.1f} MB")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the two-page spread pack")
+    parser.add_argument("--source", required=True, help="directory or base URL with {page}.png")
+    parser.add_argument("--output", default=PACK_FILE)
+    parser.add_argument("--format", choices=FORMATS, default="jpeg")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--height", type=int, default=1600, help="height of each page in pixels")
+    args = parser.parse_args()
+    build_pack(args.source, args.output, args.format, args.quality, args.height)
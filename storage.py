@@ -0,0 +1,505 @@
+"""
+تخزين بيانات المجموعات في SQLite (وضع WAL) بصف واحد لكل محادثة
+بدلاً من إعادة كتابة ملف JSON كامل مع كل تغيير
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from group_state import NOT_LOADED, GroupRecord
+
+# الحقول المخزنة لكل مجموعة (بتنسيق GroupRecord.to_dict) مع طريقة تحويلها من وإلى أعمدة SQLite
+GROUP_FIELDS = (
+    ("current_page", "INTEGER", int),
+    ("image_times", "TEXT", list),
+    ("images_active", "INTEGER", bool),
+    ("last_image_sent", "TEXT", str),
+    ("current_part", "INTEGER", int),
+    ("khatma_times", "TEXT", list),
+    ("khatma_active", "INTEGER", bool),
+    ("last_khatma_sent", "TEXT", str),
+    ("completed_khatmas", "INTEGER", int),
+    ("timezone", "TEXT", str),
+)
+FIELD_NAMES = tuple(name for name, _, _ in GROUP_FIELDS)
+
+
+def _encode(data):
+    row = []
+    for name, _, kind in GROUP_FIELDS:
+        value = data.get(name)
+        if value is None:
+            row.append(None)
+        elif kind is list:
+            row.append(json.dumps(value, ensure_ascii=False))
+        elif kind is bool:
+            row.append(int(bool(value)))
+        else:
+            row.append(value)
+    return tuple(row)
+
+
+def _decode(row):
+    data = {}
+    for (name, _, kind), value in zip(GROUP_FIELDS, row):
+        if kind is list:
+            data[name] = json.loads(value) if value else []
+        elif value is None:
+            # الحقل غير موجود في الأصل، فتبقى القيمة الافتراضية في data.get()
+            continue
+        elif kind is bool:
+            data[name] = bool(value)
+        else:
+            data[name] = value
+    return data
+
+
+def _snapshot(groups, chat_id):
+    """
+    قاموس حقول المحادثة؛ GroupTable تنسخه تحت قفل المحادثة حتى لا تُحفظ نسخة نصف معدلة،
+    وترجع NOT_LOADED للمحادثة غير المحملة في الذاكرة فلا يُكتب عنها شيء
+    """
+    if hasattr(groups, "snapshot"):
+        return groups.snapshot(chat_id)
+    data = groups.get(chat_id)
+    return data.to_dict() if data is not None else None
+
+
+def upgrade_legacy_keys(data):
+    """ تحويل البيانات القديمة (image_time/khatma_time) إلى التنسيق الجديد """
+    for chat_id, group_data in data.items():
+        if "image_time" in group_data:
+            group_data["image_times"] = [group_data.pop("image_time")] if group_data["image_time"] else []
+        if "khatma_time" in group_data:
+            group_data["khatma_times"] = [group_data.pop("khatma_time")] if group_data["khatma_time"] else []
+    return data
+
+
+# ========== ترحيلات مخطط القاعدة ==========
+# كل ترحيل يُطبق مرة واحدة ويُسجل رقمه في جدول schema_migrations؛ الترحيلات الأولى تتحقق
+# مما هو موجود لأن القواعد التي أنشأتها النسخ السابقة لهذا الجدول فيها بعض هذه التغييرات
+def _create_base_tables(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS groups (chat_id TEXT PRIMARY KEY, current_page INTEGER, image_times TEXT, "
+        "images_active INTEGER, last_image_sent TEXT, current_part INTEGER, khatma_times TEXT, "
+        "khatma_active INTEGER, last_khatma_sent TEXT, completed_khatmas INTEGER)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS khatma (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT)")
+
+
+def _create_broadcast_targets(conn):
+    conn.execute("CREATE TABLE IF NOT EXISTS broadcast_targets (seq INTEGER PRIMARY KEY, chat_id TEXT)")
+
+
+def _add_group_timezone(conn):
+    if "timezone" not in {row[1] for row in conn.execute("PRAGMA table_info(groups)")}:
+        conn.execute("ALTER TABLE groups ADD COLUMN timezone TEXT")
+
+
+def _index_active_groups(conn):
+    # فهرس جزئي بالمجموعات المفعلة فقط، فيقرأ التشغيل فهرس الأوقات دون المرور على المجموعات المتوقفة
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS groups_active ON groups (chat_id) "
+        "WHERE images_active = 1 OR khatma_active = 1"
+    )
+
+
+def _create_conversations(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS conversations "
+        "(chat_id TEXT, user_id INTEGER, step TEXT, expires_at REAL, PRIMARY KEY (chat_id, user_id))"
+    )
+
+
+def _create_leases(conn):
+    # القيادة بين العمليات التي تتشارك القاعدة (عملية نشطة وأخرى احتياطية)
+    conn.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, holder TEXT, expires_at REAL)")
+
+
+def _create_outbox(conn):
+    # الإرسالات المجدولة بمفتاح ثابت (النوع:المحادثة:اليوم المحلي) وحالتها: pending ثم sent أو failed
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS outbox (key TEXT PRIMARY KEY, chat_id TEXT, kind TEXT, day TEXT, "
+        "payload INTEGER, status TEXT, error TEXT, updated_at REAL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS outbox_updated ON outbox (updated_at)")
+
+
+MIGRATIONS = (
+    (1, "base tables", _create_base_tables),
+    (2, "broadcast targets", _create_broadcast_targets),
+    (3, "group time zone", _add_group_timezone),
+    (4, "active groups index", _index_active_groups),
+    (5, "conversation steps", _create_conversations),
+    (6, "leases", _create_leases),
+    (7, "delivery outbox", _create_outbox),
+)
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding='utf-8') as f:
+        return json.load(f)
+
+
+class GroupStore:
+    """ مخزن المجموعات: يكتب فقط الأعمدة التي تغيرت منذ آخر حفظ """
+
+    def __init__(self, path, track_changes=False):
+        self.path = path
+        # عند التشغيل المقسم تسجل عملية الاستقبال كل محادثة تغيرت ليتابعها العمال
+        self.track_changes = track_changes
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.migrate()
+        # آخر نسخة محفوظة من كل صف لمعرفة الحقول المتغيرة
+        self.persisted = {}
+        self.persisted_khatma = {}
+
+    def migrate(self):
+        """
+        تطبيق الترحيلات التي لم تُسجل بعد في معاملة واحدة؛ BEGIN IMMEDIATE يجعل العمليات الأخرى
+        (العمال في التشغيل المقسم) تنتظر حتى ينتهي الترحيل بدلاً من تطبيقه مرتين
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations "
+                    "(version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT)"
+                )
+                applied = {row[0] for row in self.conn.execute("SELECT version FROM schema_migrations")}
+                for version, name, migration in MIGRATIONS:
+                    if version in applied:
+                        continue
+                    migration(self.conn)
+                    self.conn.execute(
+                        "INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, datetime('now'))",
+                        (version, name)
+                    )
+                    print(f"Applied schema migration {version}: {name}")
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def schema_version(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+            return row[0] or 0
+
+    def reset_cache(self):
+        """ نسيان آخر ما حُفظ (بعد أن كتبت عملية أخرى في القاعدة)، فيُقرأ كل شيء من جديد """
+        with self.lock:
+            self.persisted = {}
+            self.persisted_khatma = {}
+
+    def acquire_lease(self, name, holder, ttl):
+        """ أخذ القيادة name أو تجديدها إذا كانت لنفس الصاحب أو انتهت مدتها؛ في عبارة واحدة ذرية """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                (name, holder, now + ttl, now)
+            )
+            row = self.conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def release_lease(self, name, holder):
+        """ ترك القيادة عند الإيقاف فتستلمها العملية الاحتياطية فوراً دون انتظار انتهاء المدة """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def import_json_once(self, groups_file, khatma_file):
+        """ استيراد ملفات JSON القديمة مرة واحدة فقط عند أول تشغيل """
+        if self.get_meta("json_imported"):
+            return False
+        try:
+            groups = upgrade_legacy_keys(_read_json(groups_file))
+            khatma = _read_json(khatma_file)
+        except Exception as e:
+            print(f"Error reading legacy JSON data: {e}")
+            return False
+        placeholders = ", ".join("?" for _ in range(len(FIELD_NAMES) + 1))
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO groups (chat_id, {', '.join(FIELD_NAMES)}) VALUES ({placeholders})",
+                [(chat_id,) + _encode(data) for chat_id, data in groups.items()]
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO khatma (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in khatma.items()]
+            )
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_imported', '1')")
+        print(f"Imported {len(groups)} groups from {groups_file}")
+        return True
+
+    def iter_groups(self, active_only=False, chat_filter=None, batch=1000):
+        """
+        (chat_id، GroupRecord) لكل المجموعات (أو المفعلة فقط) على دفعات مرتبة بـ chat_id،
+        دون الاحتفاظ بها في الذاكرة أو في persisted؛ يُستخدم لبناء فهرس الأوقات عند التشغيل وللبث
+        """
+        condition = "(images_active = 1 OR khatma_active = 1) AND " if active_only else ""
+        after = ""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT chat_id, {', '.join(FIELD_NAMES)} FROM groups "
+                    f"WHERE {condition}chat_id > ? ORDER BY chat_id LIMIT ?", (after, batch)
+                ).fetchall()
+            for row in rows:
+                if chat_filter is None or chat_filter(row[0]):
+                    yield row[0], GroupRecord.from_dict(_decode(row[1:]))
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    def has_group(self, chat_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM groups WHERE chat_id = ?", (chat_id,)).fetchone() is not None
+
+    def is_clean(self, chat_id, record):
+        """ هل السجل مطابق لآخر ما حُفظ منه (فيمكن إخراجه من الذاكرة دون فقد شيء) """
+        return self.persisted.get(chat_id) == _encode(record.to_dict())
+
+    def forget(self, chat_id):
+        """ نسيان آخر نسخة محفوظة لمحادثة أُخرجت من الذاكرة؛ تُقرأ مجدداً عند تحميلها """
+        self.persisted.pop(chat_id, None)
+
+    def load_group(self, chat_id, current=None):
+        """
+        إعادة قراءة صف محادثة واحدة من القاعدة (None إذا حُذفت)
+        مع current: تؤخذ من القاعدة فقط الحقول التي غيرتها عملية أخرى منذ آخر قراءة،
+        وتبقى تغييرات هذه العملية التي لم تُحفظ بعد كما هي
+        """
+        with self.lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(FIELD_NAMES)} FROM groups WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            if row is None:
+                self.persisted.pop(chat_id, None)
+                return None
+            row = tuple(row)
+            base = self.persisted.get(chat_id)
+            self.persisted[chat_id] = row
+        fresh = _decode(row)
+        if current is None or base is None:
+            return GroupRecord.from_dict(fresh)
+        merged = current.to_dict()
+        for i, name in enumerate(FIELD_NAMES):
+            if row[i] != base[i] and name in fresh:
+                merged[name] = fresh[name]
+        return GroupRecord.from_dict(merged)
+
+    # ========== سجل التغييرات للعمليات الأخرى ==========
+    def last_change_seq(self):
+        with self.lock:
+            row = self.conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+            return row[0] or 0
+
+    def changes_since(self, seq, limit=1000):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, chat_id FROM changes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+            ).fetchall()
+
+    def prune_changes(self, keep=100000):
+        """ حذف السجلات القديمة مع إبقاء آخر keep تغيير """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (keep,))
+
+    # ========== نقطة استئناف البث ==========
+    def begin_broadcast(self, state, chat_ids):
+        """ حفظ قائمة الأهداف الثابتة وحالة البث في معاملة واحدة """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM broadcast_targets")
+            self.conn.executemany(
+                "INSERT INTO broadcast_targets (seq, chat_id) VALUES (?, ?)",
+                enumerate(chat_ids, 1)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('broadcast', ?)",
+                (json.dumps(state, ensure_ascii=False),)
+            )
+
+    def broadcast_targets(self, after, limit):
+        """ (الترتيب، chat_id) للأهداف بعد الموضع after """
+        with self.lock:
+            return self.conn.execute(
+                "SELECT seq, chat_id FROM broadcast_targets WHERE seq > ? ORDER BY seq LIMIT ?", (after, limit)
+            ).fetchall()
+
+    def save_broadcast(self, state):
+        self.set_meta("broadcast", json.dumps(state, ensure_ascii=False))
+
+    def load_broadcast(self):
+        value = self.get_meta("broadcast")
+        return json.loads(value) if value else None
+
+    def end_broadcast(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM broadcast_targets")
+            self.conn.execute("DELETE FROM meta WHERE key = 'broadcast'")
+
+    # ========== الخطوات المنتظرة من المشرفين ==========
+    def save_conversation(self, chat_id, user_id, step, expires_at):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO conversations (chat_id, user_id, step, expires_at) VALUES (?, ?, ?, ?)",
+                (chat_id, user_id, step, expires_at)
+            )
+
+    def delete_conversation(self, chat_id, user_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM conversations WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    def load_conversations(self, now, limit):
+        """ حذف الخطوات المنتهية ثم أحدث limit خطوة بترتيب انتهائها """
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM conversations WHERE expires_at <= ?", (now,))
+            rows = self.conn.execute(
+                "SELECT chat_id, user_id, step, expires_at FROM conversations ORDER BY expires_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return rows[::-1]
+
+    def load_khatma(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT key, value FROM khatma").fetchall()
+        self.persisted_khatma = dict(rows)
+        return {key: json.loads(value) for key, value in rows}
+
+    def load_khatma_value(self, key):
+        """ قيمة مفتاح واحد كما في القاعدة الآن (None إذا لم يوجد) """
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM khatma WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _record_change(self, chat_id):
+        if self.track_changes:
+            self.conn.execute("INSERT INTO changes (chat_id) VALUES (?)", (chat_id,))
+
+    def _write_group(self, chat_id, data):
+        if data is None:
+            # الصف قد لا يكون في persisted إذا أُخرجت المحادثة من الذاكرة قبل حذفها
+            self.persisted.pop(chat_id, None)
+            if self.conn.execute("DELETE FROM groups WHERE chat_id = ?", (chat_id,)).rowcount:
+                self._record_change(chat_id)
+            return
+        row = _encode(data)
+        old = self.persisted.get(chat_id)
+        if old is None:
+            placeholders = ", ".join("?" for _ in range(len(row) + 1))
+            self.conn.execute(
+                f"INSERT OR REPLACE INTO groups (chat_id, {', '.join(FIELD_NAMES)}) VALUES ({placeholders})",
+                (chat_id,) + row
+            )
+        else:
+            changed = [(name, value) for name, value, previous in zip(FIELD_NAMES, row, old) if value != previous]
+            if not changed:
+                return
+            assignments = ", ".join(f"{name} = ?" for name, _ in changed)
+            self.conn.execute(
+                f"UPDATE groups SET {assignments} WHERE chat_id = ?",
+                [value for _, value in changed] + [chat_id]
+            )
+        self.persisted[chat_id] = row
+        self._record_change(chat_id)
+
+    def _save_groups(self, groups, chat_ids):
+        if chat_ids is None:
+            chat_ids = set(groups) | set(self.persisted) | set(getattr(groups, "removed", ()))
+        for chat_id in chat_ids:
+            data = _snapshot(groups, chat_id)
+            if data is not NOT_LOADED:
+                self._write_group(chat_id, data)
+
+    def save_groups(self, groups, chat_ids=None):
+        """
+        حفظ المحادثات المحددة (أو الكل) في معاملة واحدة
+        المحادثة غير الموجودة في groups تُحذف من القاعدة
+        """
+        with self.lock, self.conn:
+            self._save_groups(groups, chat_ids)
+
+    # ========== صندوق الإرسال ==========
+    def claim_deliveries(self, rows, keep_seconds=3 * 86400):
+        """
+        تسجيل الإرسالات المستحقة (key, chat_id, kind, day, payload) كمعلقة إذا لم تكن مسجلة،
+        وإرجاع مفاتيح ما أُكد إرساله منها من قبل؛ السجلات الأقدم من keep_seconds تُحذف
+        """
+        now = time.time()
+        keys = [row[0] for row in rows]
+        sent = set()
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM outbox WHERE updated_at < ?", (now - keep_seconds,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO outbox (key, chat_id, kind, day, payload, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                [tuple(row) + (now,) for row in rows]
+            )
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                sent.update(key for key, in self.conn.execute(
+                    f"SELECT key FROM outbox WHERE status = 'sent' AND key IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ))
+        return sent
+
+    def commit_deliveries(self, groups, sent, failed):
+        """
+        في معاملة واحدة: تأكيد الإرسالات sent [(key, chat_id)] مع حفظ تقدم محادثاتها،
+        وتسجيل الفاشلة failed [(key, الخطأ)]؛ فلا يُكتب تأكيد دون تقدمه ولا تقدم دون تأكيده
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'sent', error = NULL, updated_at = ? WHERE key = ?",
+                [(now, key) for key, _ in sent]
+            )
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'failed', error = ?, updated_at = ? WHERE key = ? AND status != 'sent'",
+                [(error, now, key) for key, error in failed]
+            )
+            self._save_groups(groups, {chat_id for _, chat_id in sent})
+
+    def outbox_counts(self):
+        """ عدد سجلات صندوق الإرسال حسب الحالة """
+        with self.lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+
+    def save_khatma(self, khatma, keys=None):
+        """
+        حفظ القيم المتغيرة فقط؛ مع keys تُفحص هذه المفاتيح وحدها،
+        والمفتاح غير الموجود في khatma يُحذف من القاعدة
+        """
+        with self.lock, self.conn:
+            if keys is None:
+                keys = set(self.persisted_khatma) | set(khatma)
+            for key in keys:
+                if key not in khatma:
+                    if self.persisted_khatma.pop(key, None) is not None:
+                        self.conn.execute("DELETE FROM khatma WHERE key = ?", (key,))
+                    continue
+                encoded = json.dumps(khatma[key], ensure_ascii=False)
+                if self.persisted_khatma.get(key) != encoded:
+                    self.conn.execute("INSERT OR REPLACE INTO khatma (key, value) VALUES (?, ?)", (key, encoded))
+                    self.persisted_khatma[key] = encoded
@@ -0,0 +1,188 @@
+"""
+تشغيل مكونات البوت الطويلة (الاستطلاع، المجدول، متابعة الإعدادات) تحت مشرف واحد:
+كل مكون يعمل في خيط واحد فقط ويُعاد تشغيله وحده عند توقفه مع انتظار متزايد،
+والإيقاف ينتظر انتهاء الإرسال الجاري قبل الخروج
+
+مع Lease تعمل المكونات في عملية واحدة فقط من العمليات التي تتشارك القاعدة؛
+الأخرى تنتظر احتياطياً وتستلم خلال ثوانٍ إذا توقفت العملية النشطة عن تجديد القيادة
+"""
+import os
+import socket
+import threading
+import time
+
+
+class Lease:
+    """ قيادة باسم name في القاعدة المشتركة؛ صاحبها يجددها قبل انتهاء ttl وإلا أخذها غيره """
+
+    def __init__(self, store, name, ttl=10):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self):
+        """ أخذ القيادة أو تجديدها؛ False إذا كانت مع عملية أخرى لم تنته مدتها """
+        return self.store.acquire_lease(self.name, self.holder, self.ttl)
+
+    def release(self):
+        self.store.release_lease(self.name, self.holder)
+
+
+class Component:
+    """ مكون يعمل بـ target(stop) حتى يُضبط stop؛ وstop_hook لإيقاف ما لا يراقب stop بنفسه """
+
+    def __init__(self, name, target, stop_hook=None):
+        self.name = name
+        self.target = target
+        self.stop_hook = stop_hook
+        self.thread = None
+        self.stop = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        self.stop = threading.Event()
+        self.started_at = time.monotonic()
+        self.thread = threading.Thread(target=self._run, args=(self.stop,), name=self.name, daemon=True)
+        self.thread.start()
+
+    def _run(self, stop):
+        try:
+            self.target(stop)
+        except Exception as e:
+            print(f"{self.name} crashed: {e}")
+
+    def alive(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def request_stop(self):
+        if self.stop is not None:
+            self.stop.set()
+        if self.stop_hook is not None:
+            try:
+                self.stop_hook()
+            except Exception as e:
+                print(f"Error stopping {self.name}: {e}")
+
+
+class Supervisor:
+    """
+    on_start(takeover): قبل تشغيل المكونات؛ takeover تعني أن العملية كانت احتياطية أو فقدت القيادة،
+    فما في ذاكرتها قد يكون أقدم مما كتبته العملية النشطة السابقة
+    on_stop(): بعد إيقاف المكونات (حفظ ما بقي في الذاكرة)
+    """
+
+    # مكون عمل أطول من هذا يُعتبر مستقراً، فيبدأ انتظار إعادة تشغيله من جديد
+    STABLE_SECONDS = 60
+    BACKOFF_BASE = 1.0
+    BACKOFF_MAX = 60.0
+
+    def __init__(self, lease=None, drain_timeout=60, on_start=None, on_stop=None):
+        self.lease = lease
+        self.drain_timeout = drain_timeout
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.components = []
+        self.stopping = threading.Event()
+        self.active = False
+        self.takeover = False
+        self.restarts = 0
+
+    def add(self, name, target, stop_hook=None):
+        self.components.append(Component(name, target, stop_hook))
+
+    def shutdown(self, *_):
+        """ طلب الإيقاف (يصلح معالجاً لإشارات SIGTERM/SIGINT) """
+        self.stopping.set()
+
+    def run(self):
+        """ حلقة الإشراف حتى shutdown؛ تنتظر القيادة ثم تشغل المكونات وتراقبها """
+        interval = min(1.0, self.lease.ttl / 3) if self.lease else 1.0
+        last_renew = 0.0
+        try:
+            while not self.stopping.is_set():
+                now = time.monotonic()
+                if self.lease is not None and (not self.active or now - last_renew >= self.lease.ttl / 3):
+                    if not self._hold_lease():
+                        self.stopping.wait(interval)
+                        continue
+                    last_renew = now
+                if not self.active:
+                    self._activate()
+                self._watch(now)
+                self.stopping.wait(interval)
+        finally:
+            if self.active:
+                self._deactivate()
+            if self.lease is not None:
+                self.lease.release()
+
+    def _hold_lease(self):
+        try:
+            held = self.lease.acquire()
+        except Exception as e:
+            # القاعدة مشغولة أو غير متاحة: تستمر المكونات حتى تنتهي المدة ولا تبدأ إذا كانت متوقفة
+            print(f"Error renewing lease {self.lease.name}: {e}")
+            return self.active
+        if held:
+            return True
+        if self.active:
+            print(f"Lease {self.lease.name} taken over by another process, stopping components")
+            self._deactivate()
+        elif not self.takeover:
+            print(f"Lease {self.lease.name} is held by another process, standing by")
+        self.takeover = True
+        return False
+
+    def _activate(self):
+        if self.on_start is not None:
+            self.on_start(self.takeover)
+        for component in self.components:
+            component.failures = 0
+            component.start()
+        self.active = True
+        self.takeover = False
+
+    def _watch(self, now):
+        """ إعادة تشغيل أي مكون توقف، بانتظار يتضاعف مع التوقفات المتتالية """
+        for component in self.components:
+            if component.alive():
+                continue
+            if component.restart_at == 0.0:
+                if now - component.started_at >= self.STABLE_SECONDS:
+                    component.failures = 0
+                delay = min(self.BACKOFF_BASE * 2 ** component.failures, self.BACKOFF_MAX)
+                component.failures += 1
+                component.restart_at = now + delay
+                print(f"{component.name} stopped, restarting in {delay:.0f}s")
+            elif now >= component.restart_at:
+                component.restart_at = 0.0
+                self.restarts += 1
+                component.start()
+
+    def _deactivate(self):
+        """ إيقاف المكونات وانتظار انتهاء ما بدأته (مثل دفعة إرسال جارية) حتى drain_timeout """
+        self.active = False
+        for component in self.components:
+            component.request_stop()
+            component.restart_at = 0.0
+        deadline = time.monotonic() + self.drain_timeout
+        for component in self.components:
+            if component.thread is not None:
+                component.thread.join(max(deadline - time.monotonic(), 0))
+                if component.thread.is_alive():
+                    print(f"{component.name} did not stop within {self.drain_timeout}s")
+        if self.on_stop is not None:
+            try:
+                self.on_stop()
+            except Exception as e:
+                print(f"Error after stopping components: {e}")
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "restarts": self.restarts,
+            "components": {component.name: component.alive() for component in self.components},
+        }
@@ -0,0 +1,23 @@
+import time
+
+from admin_cache import AdminCache
+
+
+def test_status_is_cached_until_ttl():
+    cache = AdminCache(ttl=0.1)
+    assert cache.get(-1001) is None
+    cache.set_status(-1001, "administrator")
+    assert cache.get("-1001") is True
+    time.sleep(0.15)
+    assert cache.get(-1001) is None
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (0, 1, 2)
+
+
+def test_member_updates_replace_and_invalidate():
+    cache = AdminCache()
+    cache.set_status(-1001, "creator")
+    cache.set_status(-1001, "member")
+    assert cache.get(-1001) is False
+    cache.invalidate(-1001)
+    assert cache.get(-1001) is None
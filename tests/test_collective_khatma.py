@@ -0,0 +1,27 @@
+from collective_khatma import CLAIMED, STALE, CollectiveKhatmas
+from storage import GroupStore
+
+
+def test_number_survives_end_and_old_keyboard_is_rejected(tmp_path):
+    store = GroupStore(str(tmp_path / "bot.db"))
+    khatmas = CollectiveKhatmas(store.load_khatma())
+    chat_id = "-100"
+
+    state, started = khatmas.start(chat_id)
+    assert started and state.number == 1
+    assert khatmas.press(chat_id, 1, 5, 42) == CLAIMED
+
+    assert khatmas.end(chat_id) is not None
+    assert khatmas.end(chat_id) is None
+    assert khatmas.get(chat_id) is None
+    assert khatmas.keyboard(chat_id) is None
+    assert khatmas.press(chat_id, 1, 6, 42) == STALE
+    store.save_khatma(khatmas.snapshot([chat_id]), [chat_id])
+
+    # بعد إعادة التشغيل تأخذ الختمة التالية رقماً جديداً ولا تقبل أزرار الختمة 1
+    khatmas = CollectiveKhatmas(store.load_khatma())
+    state, started = khatmas.start(chat_id)
+    assert started and state.number == 2
+    assert khatmas.press(chat_id, 1, 5, 42) == STALE
+    assert state.claimed == 0
+    assert khatmas.press(chat_id, 2, 5, 42) == CLAIMED
@@ -0,0 +1,28 @@
+import threading
+
+from conversations import ConversationStore
+from storage import GroupStore
+
+
+def test_concurrent_start_and_pop_leave_memory_and_db_in_sync(tmp_path):
+    store = GroupStore(str(tmp_path / "bot.db"))
+    conversations = ConversationStore(store, ttl=600)
+
+    def worker(user_id):
+        for _ in range(200):
+            conversations.start("-100", user_id, "start_page")
+            conversations.pop("-100", user_id)
+            conversations.start("-100", user_id, "start_part")
+
+    threads = [threading.Thread(target=worker, args=(user_id,)) for user_id in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for user_id in range(0, 8, 2):
+        assert conversations.pop("-100", user_id) == "start_part"
+
+    # بعد إعادة التشغيل لا تعود خطوة حُذفت
+    reloaded = ConversationStore(store, ttl=600)
+    assert dict(reloaded.entries) == dict(conversations.entries)
+    assert len(reloaded) == 4
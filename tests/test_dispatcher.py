@@ -0,0 +1,89 @@
+import threading
+
+from telebot.apihelper import ApiTelegramException
+
+from dispatcher import Dispatcher, TokenBucket
+
+
+def rate_limited(retry_after):
+    return ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after},
+    })
+
+
+def test_token_bucket_waits_for_missing_tokens():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    assert bucket.reserve(2, now) == 0
+    assert bucket.reserve(1, now) == 0.5
+    assert bucket.reserve(1, now + 0.5) == 0
+
+
+def test_retry_after_is_honoured():
+    dispatcher = Dispatcher(workers=2, global_rate=1000, chat_rate_per_minute=6000)
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) == 1:
+            raise rate_limited(0.05)
+        return True
+
+    stats = dispatcher.run([(1, send, 1)])
+    assert len(calls) == 2
+    assert stats["sent"] == 1 and stats["rate_limited"] == 1 and stats["failed"] == 0
+
+
+def test_gives_up_after_max_attempts():
+    errors = []
+    dispatcher = Dispatcher(workers=1, global_rate=1000, chat_rate_per_minute=6000, max_attempts=3,
+                            on_error=lambda chat_id, e: errors.append(chat_id))
+
+    def send():
+        raise rate_limited(0.01)
+
+    stats = dispatcher.run([(7, send, 1)])
+    assert stats["failed"] == 1 and stats["rate_limited"] == 2
+    assert errors == [7]
+
+
+def test_follow_up_runs_in_the_same_batch_and_is_retried():
+    dispatcher = Dispatcher(workers=2, global_rate=1000, chat_rate_per_minute=6000)
+    follow_up_calls = []
+
+    def follow_up():
+        follow_up_calls.append(1)
+        if len(follow_up_calls) == 1:
+            raise rate_limited(0.05)
+        return True
+
+    def send():
+        assert dispatcher.follow_up(1, follow_up)
+        return True
+
+    stats = dispatcher.run([(1, send, 1), (2, lambda: True, 1)])
+    assert len(follow_up_calls) == 2
+    assert stats["sent"] == 2 and stats["follow_ups"] == 1 and stats["rate_limited"] == 1
+
+
+def test_follow_up_outside_a_batch_is_refused():
+    dispatcher = Dispatcher()
+    assert dispatcher.follow_up(1, lambda: True) is False
+
+
+def test_chat_rate_limit_spaces_messages_to_one_chat():
+    dispatcher = Dispatcher(workers=4, global_rate=1000, chat_rate_per_minute=600)
+    dispatcher.chat_capacity = 1
+    lock = threading.Lock()
+    sent = []
+
+    def send():
+        with lock:
+            sent.append(1)
+        return True
+
+    stats = dispatcher.run([(1, send, 1) for _ in range(3)])
+    assert len(sent) == 3
+    # سعة 1 ومعدل 10 في الثانية: الرسالتان الأخيرتان تنتظران 0.1 ثانية لكل منهما
+    assert stats["drain_seconds"] >= 0.18
@@ -0,0 +1,32 @@
+import pytest
+import telebot
+from telebot import apihelper
+
+from benchmarks.fake_bot_api import FakeBotApi
+from dispatcher import Dispatcher
+
+
+@pytest.fixture
+def api(monkeypatch):
+    api = FakeBotApi(rate_limit_ratio=0.3, retry_after=0.05, forbidden_ratio=0.2, seed=1).start()
+    monkeypatch.setattr(apihelper, "API_URL", api.api_url)
+    yield api
+    api.stop()
+
+
+def test_dispatcher_delivers_once_through_429s(api):
+    bot = telebot.TeleBot("123:test", threaded=False)
+    chats = [-1000000 - i for i in range(40)]
+    forbidden = {chat_id for chat_id in chats if api._is_forbidden(chat_id)}
+    errors = []
+    dispatcher = Dispatcher(workers=4, global_rate=1000, chat_rate_per_minute=6000, max_attempts=20,
+                            on_error=lambda chat_id, e: errors.append(chat_id))
+
+    stats = dispatcher.run([(chat_id, lambda chat_id=chat_id: bot.send_message(chat_id, "test"), 1)
+                            for chat_id in chats])
+
+    assert forbidden and stats["rate_limited"] > 0
+    assert stats["sent"] == api.stats()["messages"] == len(chats) - len(forbidden)
+    assert sorted(errors) == sorted(forbidden)
+    calls = api.stats()["calls"]
+    assert calls["sendMessage:429"] == stats["rate_limited"]
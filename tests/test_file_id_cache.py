@@ -0,0 +1,40 @@
+from telebot.apihelper import ApiTelegramException
+
+from file_id_cache import FileIdCache, is_invalid_file_id_error
+
+
+def test_discard_only_removes_the_rejected_file_id(tmp_path):
+    path = str(tmp_path / "file_ids.json")
+    cache = FileIdCache(path)
+    cache.put_many([(1, "old"), (2, "other")])
+
+    assert not cache.discard(1, "stale")
+    assert cache.discard(1, "old")
+    assert cache.get(1) is None
+    assert cache.get(2) == "other"
+    assert FileIdCache(path).get(1) is None
+    assert cache.stats()["invalidated"] == 1
+
+
+def test_invalid_file_id_errors():
+    rejected = ApiTelegramException("sendMediaGroup", None, {
+        "error_code": 400, "description": "Bad Request: wrong file identifier/HTTP URL specified"
+    })
+    rate_limited = ApiTelegramException("sendMediaGroup", None, {
+        "error_code": 429, "description": "Too Many Requests: retry after 5"
+    })
+    assert is_invalid_file_id_error(rejected)
+    assert is_invalid_file_id_error(Exception("FILE_REFERENCE_EXPIRED"))
+    assert not is_invalid_file_id_error(rate_limited)
+
+
+def test_uncounted_lookups_leave_the_hit_ratio_alone(tmp_path):
+    cache = FileIdCache(str(tmp_path / "file_ids.json"))
+    cache.put(1, "fid")
+
+    assert cache.get(1) == "fid"
+    assert cache.get(2) is None
+    assert cache.get(1, count=False) == "fid"
+    assert cache.get(2, count=False) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
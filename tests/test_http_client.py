@@ -0,0 +1,55 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from http_client import HttpClient
+
+
+@pytest.fixture
+def server():
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            if "slow" in self.path:
+                time.sleep(0.3)
+            self.send_response(502 if "fail" in self.path else 200)
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", hits
+    httpd.shutdown()
+
+
+def test_send_methods_are_not_retried_after_read_timeout_or_5xx(server):
+    url, hits = server
+    http = HttpClient(max_retries=3, backoff=0.01, breaker_exempt=("127.0.0.1",))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http.request("GET", f"{url}/bot1:x/sendMediaGroup?slow", timeout=(1, 0.1))
+    assert http.request("GET", f"{url}/bot1:x/copyMessage?fail").status_code == 502
+    assert hits == ["/bot1:x/sendMediaGroup?slow", "/bot1:x/copyMessage?fail"]
+
+
+def test_read_only_methods_are_retried(server):
+    url, hits = server
+    http = HttpClient(max_retries=2, backoff=0.01, breaker_exempt=("127.0.0.1",))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http.request("GET", f"{url}/bot1:x/getChatMember?slow", timeout=(1, 0.1))
+    assert http.request("GET", f"{url}/bot1:x/getMe?fail").status_code == 502
+    assert len(hits) == 6
+
+
+def test_send_methods_are_retried_when_the_connection_was_refused():
+    http = HttpClient(max_retries=2, backoff=0.01, breaker_exempt=("127.0.0.1",))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        http.request("POST", "http://127.0.0.1:9/bot1:x/sendMessage", timeout=(0.5, 0.5))
+    assert http.stats()["127.0.0.1"]["requests"] == 3
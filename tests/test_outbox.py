@@ -0,0 +1,97 @@
+from group_state import GroupRecord
+from outbox import Delivery, DeliveryBatch
+from storage import GroupStore
+
+DAY = "2026-10-18"
+CHATS = ["-1001", "-1002", "-1003", "-1004", "-1005"]
+
+
+class Crash(Exception):
+    pass
+
+
+def make_batch(store, groups, commit_every):
+    return DeliveryBatch(
+        store.claim_deliveries,
+        lambda sent, failed: store.commit_deliveries(groups, sent, failed),
+        commit_every,
+    )
+
+
+def deliveries(groups, sends, crash_after=None):
+    """ إرسال صفحات الوقت: يتقدم التقدم في الذاكرة ثم يُؤكد، وينقطع بعد crash_after إرسال """
+    def send(chat_id):
+        def run(batch):
+            if crash_after is not None and len(sends) >= crash_after:
+                raise Crash()
+            sends.append(chat_id)
+            groups[chat_id].current_page += 2
+            batch.ack("image", chat_id)
+            return True
+        return run
+
+    return [Delivery("image", chat_id, DAY, groups[chat_id].current_page, send(chat_id), cost=2)
+            for chat_id in CHATS]
+
+
+def load_groups(store):
+    return {chat_id: store.load_group(chat_id) for chat_id in CHATS}
+
+
+def test_replay_after_crash_resends_only_uncommitted(tmp_path):
+    path = str(tmp_path / "bot.db")
+    store = GroupStore(path)
+    groups = {chat_id: GroupRecord(current_page=1, images_active=True) for chat_id in CHATS}
+    store.save_groups(groups)
+
+    commit_every = 2
+    sends = []
+    batch = make_batch(store, groups, commit_every)
+    try:
+        for delivery in batch.claim(deliveries(groups, sends, crash_after=3)):
+            delivery.send(batch)
+    except Crash:
+        pass
+    # الانقطاع: التأكيد الثالث وتقدمه لم يُكتبا بعد
+    assert sends == CHATS[:3]
+    assert batch.commits == 1
+    store.conn.close()
+
+    store = GroupStore(path)
+    groups = load_groups(store)
+    assert [groups[chat_id].current_page for chat_id in CHATS] == [3, 3, 1, 1, 1]
+
+    replayed = []
+    batch = make_batch(store, groups, commit_every)
+    pending = batch.claim(deliveries(groups, replayed))
+    assert batch.already_sent == 2
+    for delivery in pending:
+        delivery.send(batch)
+    batch.commit()
+
+    # مرة على الأقل لكل محادثة، والمكرر لا يزيد عن دفعة تأكيد واحدة ولا يتقدم مرتين
+    assert replayed == CHATS[2:]
+    assert len(set(sends) & set(replayed)) <= commit_every
+    assert store.outbox_counts() == {"sent": len(CHATS)}
+
+    store.conn.close()
+    store = GroupStore(path)
+    assert [store.load_group(chat_id).current_page for chat_id in CHATS] == [3] * len(CHATS)
+    batch = make_batch(store, load_groups(store), commit_every)
+    assert batch.claim(deliveries(load_groups(store), [])) == []
+
+
+def test_failures_are_summarised_and_do_not_override_acks(tmp_path):
+    store = GroupStore(str(tmp_path / "bot.db"))
+    groups = {chat_id: GroupRecord(current_page=1) for chat_id in CHATS[:2]}
+    batch = make_batch(store, groups, commit_every=10)
+    batch.claim([Delivery("image", chat_id, DAY, 1, None) for chat_id in groups])
+
+    batch.ack("image", CHATS[0])
+    batch.fail_chat(CHATS[0], Exception("late error"))
+    batch.fail_chat(CHATS[1], Exception("blocked"))
+    batch.commit()
+
+    assert store.outbox_counts() == {"sent": 1, "failed": 1}
+    assert batch.failures() == 1
+    assert "1 من 2" in batch.summary("06:00")
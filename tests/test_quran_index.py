@@ -0,0 +1,28 @@
+import quran_index
+from quran_index import JUZ_STARTS, QUARTER_STARTS, SURAH_AYAH_COUNTS, page_info
+
+
+def absolute(surah, ayah):
+    return sum(SURAH_AYAH_COUNTS[:surah - 1]) + ayah - 1
+
+
+def test_quarter_table_has_240_quarters():
+    assert len(QUARTER_STARTS) == 240
+
+
+def test_quarters_are_ordered_and_at_least_three_ayahs():
+    starts = [absolute(*ref) for ref in QUARTER_STARTS] + [quran_index.TOTAL_AYAHS]
+    for ref, first, nxt in zip(QUARTER_STARTS, starts, starts[1:]):
+        assert nxt - first >= 3, ref
+
+
+def test_every_juz_starts_a_hizb():
+    for juz, ref in enumerate(JUZ_STARTS):
+        assert QUARTER_STARTS[juz * 8] == ref
+
+
+def test_page_captions_around_fixed_boundaries():
+    assert (page_info(63)["hizb"], page_info(63)["rub"]) == (7, 1)
+    assert (page_info(77)["hizb"], page_info(77)["rub"]) == (8, 3)
+    assert (page_info(187)["hizb"], page_info(187)["rub"]) == (19, 3)
+    assert (page_info(202)["hizb"], page_info(202)["rub"]) == (21, 1)
@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+
+from slot_index import SlotIndex, host_zone_name
+
+
+def test_host_zone_from_tz(monkeypatch):
+    monkeypatch.setenv("TZ", "Asia/Riyadh")
+    assert host_zone_name() == "Asia/Riyadh"
+    monkeypatch.setenv("TZ", ":/usr/share/zoneinfo/Africa/Cairo")
+    assert host_zone_name() == "Africa/Cairo"
+
+
+def test_group_without_timezone_keeps_host_local_hour(monkeypatch):
+    # مجموعة قديمة بدون منطقة على جهاز بتوقيت UTC+3: الساعة 08:00 المحلية هي 05:00 UTC
+    monkeypatch.setenv("TZ", "Asia/Riyadh")
+    index = SlotIndex(host_zone_name())
+    now = datetime(2026, 1, 15, tzinfo=timezone.utc)
+    index.update("-100", "image", ["08:00"], True, None, now)
+    assert index.due("image", 5 * 60) == [("-100", "Asia/Riyadh")]
+    assert index.due("image", 8 * 60) == []
@@ -0,0 +1,85 @@
+import json
+import sqlite3
+
+from group_state import GroupRecord, times_to_mask
+from storage import MIGRATIONS, GroupStore
+
+
+def write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+
+
+def baseline_files(tmp_path):
+    """ ملفات البيانات كما كتبتها النسخة الأولى من البوت (وقت واحد لكل نوع) """
+    groups_file = str(tmp_path / "groups_data.json")
+    khatma_file = str(tmp_path / "khatma_data.json")
+    write_json(groups_file, {
+        "-1001": {
+            "current_page": 41, "image_time": "05:00", "images_active": True,
+            "last_image_sent": "2024-03-01", "current_part": 7, "khatma_time": "",
+            "khatma_active": False, "last_khatma_sent": None, "completed_khatmas": 2,
+        },
+        "-1002": {"current_page": 1, "image_times": ["07:00", "21:00"], "images_active": False},
+    })
+    write_json(khatma_file, {"-1001": {"members": [1, 2]}})
+    return groups_file, khatma_file
+
+
+def test_baseline_json_import_runs_all_migrations(tmp_path):
+    store = GroupStore(str(tmp_path / "bot.db"))
+    assert store.schema_version() == MIGRATIONS[-1][0] == 7
+
+    assert store.import_json_once(*baseline_files(tmp_path))
+    assert not store.import_json_once(*baseline_files(tmp_path))
+
+    record = store.load_group("-1001")
+    assert (record.current_page, record.current_part, record.completed_khatmas) == (41, 7, 2)
+    assert record.image_mask == times_to_mask(["05:00"])
+    assert record.images_active and record.khatma_mask == 0
+    assert record.last_image_sent == "2024-03-01" and record.timezone is None
+    assert store.load_group("-1002").image_mask == times_to_mask(["07:00", "21:00"])
+    assert [chat_id for chat_id, _ in store.iter_groups(active_only=True)] == ["-1001"]
+    assert store.load_khatma() == {"-1001": {"members": [1, 2]}}
+
+
+def test_database_from_before_schema_migrations_is_upgraded(tmp_path):
+    path = str(tmp_path / "bot.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE groups (chat_id TEXT PRIMARY KEY, current_page INTEGER, image_times TEXT, "
+        "images_active INTEGER, last_image_sent TEXT, current_part INTEGER, khatma_times TEXT, "
+        "khatma_active INTEGER, last_khatma_sent TEXT, completed_khatmas INTEGER)"
+    )
+    conn.execute("INSERT INTO groups (chat_id, current_page, image_times, images_active) "
+                 "VALUES ('-1001', 9, '[\"09:00\"]', 1)")
+    conn.commit()
+    conn.close()
+
+    store = GroupStore(path)
+    assert store.schema_version() == 7
+    record = store.load_group("-1001")
+    assert record.current_page == 9 and record.timezone is None
+    record.timezone = "Africa/Cairo"
+    store.save_groups({"-1001": record})
+    assert GroupStore(path).load_group("-1001").timezone == "Africa/Cairo"
+
+
+def test_save_writes_only_changed_columns(tmp_path):
+    store = GroupStore(str(tmp_path / "bot.db"))
+    groups = {"-1001": GroupRecord(current_page=5, images_active=True)}
+    store.save_groups(groups)
+
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+    store.save_groups(groups)
+    assert not [s for s in statements if s.startswith(("INSERT", "UPDATE"))]
+
+    groups["-1001"].current_page = 7
+    store.save_groups(groups)
+    updates = [s for s in statements if s.startswith("UPDATE groups")]
+    assert updates == ["UPDATE groups SET current_page = 7 WHERE chat_id = '-1001'"]
+
+    del groups["-1001"]
+    store.save_groups(groups)
+    assert not store.has_group("-1001")
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from storage import GroupStore
+from supervisor import Lease, Supervisor
+
+
+def make_lease(path, holder, ttl):
+    """ قيادة لعملية مستقلة: اتصال خاص بالقاعدة وصاحب مختلف """
+    lease = Lease(GroupStore(path), "bot", ttl)
+    lease.holder = holder
+    return lease
+
+
+def test_lease_is_taken_over_after_ttl(tmp_path):
+    path = str(tmp_path / "bot.db")
+    active = make_lease(path, "active", ttl=0.2)
+    standby = make_lease(path, "standby", ttl=0.2)
+
+    assert active.acquire()
+    assert not standby.acquire()
+    assert active.acquire()
+
+    time.sleep(0.3)
+    assert standby.acquire()
+    assert not active.acquire()
+
+
+def test_released_lease_is_taken_over_at_once(tmp_path):
+    path = str(tmp_path / "bot.db")
+    active = make_lease(path, "active", ttl=60)
+    standby = make_lease(path, "standby", ttl=60)
+
+    assert active.acquire()
+    active.release()
+    assert standby.acquire()
+
+
+def test_standby_supervisor_starts_components_on_takeover(tmp_path):
+    path = str(tmp_path / "bot.db")
+    active = make_lease(path, "active", ttl=0.3)
+    assert active.acquire()
+
+    started = threading.Event()
+    takeovers = []
+    supervisor = Supervisor(make_lease(path, "standby", ttl=0.3), drain_timeout=1,
+                            on_start=takeovers.append)
+    supervisor.add("scheduler", lambda stop: (started.set(), stop.wait()))
+    thread = threading.Thread(target=supervisor.run, daemon=True)
+    thread.start()
+    try:
+        assert not started.wait(0.15)
+        # العملية النشطة توقفت عن التجديد
+        assert started.wait(2)
+        assert takeovers == [True]
+        assert not active.acquire()
+    finally:
+        supervisor.shutdown()
+        thread.join(5)
+    assert not thread.is_alive()
+    # الإيقاف يترك القيادة فتستلمها العملية الأخرى فوراً
+    assert active.acquire()
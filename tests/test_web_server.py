@@ -0,0 +1,36 @@
+import threading
+
+import pytest
+
+web_server = pytest.importorskip("web_server")
+
+
+class Bot:
+    threaded = True
+
+    def __init__(self, block=None):
+        self.block = block
+        self.processed = []
+
+    def process_new_updates(self, updates):
+        if self.block is not None:
+            self.block.wait()
+        self.processed.append(updates[0])
+
+
+def test_stuck_worker_does_not_block_shutdown_or_the_next_generation():
+    block = threading.Event()
+    stuck = Bot(block)
+    web_server.start_webhook_workers(stuck, workers=1)
+    for update in range(web_server.update_queue.maxsize):
+        web_server.update_queue.put(update)
+    # الطابور ممتلئ والعامل عالق: الإيقاف ينتهي بعد المهلة
+    web_server.stop_webhook_workers(timeout=0.3)
+
+    fresh = Bot()
+    web_server.start_webhook_workers(fresh, workers=2)
+    block.set()
+    web_server.update_queue.join()
+    web_server.stop_webhook_workers(timeout=5)
+    assert len(stuck.processed) == 1
+    assert sorted(stuck.processed + fresh.processed) == list(range(web_server.update_queue.maxsize))
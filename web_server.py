@@ -1,6 +1,128 @@
-from flask import Flask
+import hmac
+import os
+import queue
+import threading
+import time
+from flask import Flask, Response, request, abort
+from telebot import types
+
+import metrics
+
 app = Flask(__name__)
 
+# إعدادات وضع الـ webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+# اختياري: رمز يُطلب في ترويسة Authorization: Bearer لقراءة /metrics (بدونه تُقرأ من نفس الجهاز فقط)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# التحديثات الواردة تنتظر هنا حتى يعالجها أحد العمال
+update_queue = queue.Queue(maxsize=WEBHOOK_QUEUE_SIZE)
+# يُضبط فقط في العملية التي تملك القيادة، وإلا يرد المسار بـ 503 فيعيد تيليجرام الإرسال لاحقاً
+_bot = None
+# عمال التشغيل الحالي؛ لكل تشغيل إشارتا إيقاف خاصتان به فلا يؤثر عامل قديم تأخر في التوقف على التالي
+_generation = None
+
+metrics.Gauge("webhook_queue_depth", "Updates waiting in the webhook queue", func=update_queue.qsize)
+webhook_updates = metrics.Counter("webhook_updates_total", "Webhook requests by response status", ("status",))
+update_seconds = metrics.Histogram("update_processing_seconds", "Time to process one webhook update")
+
 @app.route('/')
 def home():
-    return "Bot is running!"
+    return f"Bot is running! (queue: {update_queue.qsize()}/{WEBHOOK_QUEUE_SIZE})"
+
+@app.route('/metrics')
+def metrics_endpoint():
+    if METRICS_TOKEN:
+        token = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(token, f"Bearer {METRICS_TOKEN}"):
+            abort(403)
+    elif request.remote_addr not in ("127.0.0.1", "::1"):
+        # منفذ الـ webhook مفتوح للجميع، فبدون رمز تُقرأ المقاييس من نفس الجهاز فقط
+        abort(403)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def webhook():
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        webhook_updates.inc("403")
+        abort(403)
+    if _bot is None:
+        # عملية احتياطية أو متوقفة: لا تُعالج التحديثات ولا تُكتب الحالة هنا
+        webhook_updates.inc("503")
+        return "Standby", 503
+    try:
+        update = types.Update.de_json(request.get_data(as_text=True))
+    except Exception as e:
+        print(f"Error parsing webhook update: {e}")
+        webhook_updates.inc("400")
+        abort(400)
+    try:
+        update_queue.put_nowait(update)
+    except queue.Full:
+        # تيليجرام يعيد إرسال التحديث لاحقاً عند أي رد غير 2xx
+        webhook_updates.inc("503")
+        return "Queue is full", 503
+    webhook_updates.inc("200")
+    return ""
+
+class _Generation:
+    """ stopping: إنهاء ما في الطابور ثم التوقف؛ expired: التوقف بعد التحديث الجاري (انتهت مهلة الانتظار) """
+
+    def __init__(self):
+        self.stopping = threading.Event()
+        self.expired = threading.Event()
+        self.threads = []
+
+
+def process_updates(bot, generation=None):
+    generation = generation or _Generation()
+    while not generation.expired.is_set():
+        try:
+            update = update_queue.get(timeout=0.2)
+        except queue.Empty:
+            if generation.stopping.is_set():
+                return
+            continue
+        try:
+            with update_seconds.time():
+                bot.process_new_updates([update])
+        except Exception as e:
+            print(f"Error processing webhook update: {e}")
+        finally:
+            update_queue.task_done()
+
+def start_webhook_workers(bot, workers=WEBHOOK_WORKERS):
+    """ تشغيل عمال معالجة التحديثات وتفعيل مسار الـ webhook """
+    global _bot, _generation
+    # المعالجات تعمل مباشرة على عمال الطابور بدلاً من مجموعة خيوط telebot
+    bot.threaded = False
+    generation = _Generation()
+    for _ in range(workers):
+        thread = threading.Thread(target=process_updates, args=(bot, generation), daemon=True)
+        thread.start()
+        generation.threads.append(thread)
+    _generation = generation
+    _bot = bot
+
+def stop_webhook_workers(timeout=None):
+    """
+    إيقاف قبول التحديثات (503) ثم انتظار معالجة ما في الطابور وتوقف العمال حتى timeout؛
+    بعد المهلة لا يأخذ العمال تحديثات أخرى، ويبقى ما لم يُعالج في الطابور للتشغيل التالي
+    """
+    global _bot, _generation
+    _bot = None
+    generation, _generation = _generation, None
+    if generation is None:
+        return
+    generation.stopping.set()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for thread in generation.threads:
+        thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+    generation.expired.set()
+    alive = sum(thread.is_alive() for thread in generation.threads)
+    if alive:
+        print(f"{alive} webhook workers did not stop within {timeout}s")